@@ -12,7 +12,6 @@ from functools import partial
 import yaml
 from yaml.loader import SafeLoader
 import sys
-import paho.mqtt.client
 
 from hoymiles import __main__ as my_hm
 import hoymiles
@@ -107,6 +106,22 @@ def load_day(filename):
     return x_temp, np.array(y_temp), np.array(y0_temp), np.array(y1_temp)
 
 
+def sample_values(data_dict):
+    y = -1
+    y0 = -1
+    y1 = -1
+    try:
+        phase_0 = data_dict['phases'][0]
+        y = phase_0["power"]
+        string_0 = data_dict['strings'][0]
+        y0 = string_0["power"]
+        string_1 = data_dict['strings'][1]
+        y1 = string_1["power"]
+    except (KeyError, IndexError):
+        pass
+    return y, y0, y1
+
+
 class MyData(object):
     sources: list[MySources]
     documents: list[document]
@@ -206,8 +221,7 @@ class MyData(object):
 
         my_hm.ahoy_config = dict(cfg.get('ahoy', {}))
 
-        for radio_config in my_hm.ahoy_config.get('nrf', [{}]):
-            my_hm.hmradio = hoymiles.HoymilesNRF(**radio_config)
+        my_hm.setup_radios()
 
         my_hm.mqtt_client = None
 
@@ -219,25 +233,12 @@ class MyData(object):
         if verbose:
             hoymiles.HOYMILES_DEBUG_LOGGING = True
 
-        mqtt_config = my_hm.ahoy_config.get('mqtt', [])
-        if not mqtt_config.get('disabled', False):
-            my_hm.mqtt_client = paho.mqtt.client.Client()
-            my_hm.mqtt_client.username_pw_set(mqtt_config.get('user', None), mqtt_config.get('password', None))
-            my_hm.mqtt_client.connect(mqtt_config.get('host', '127.0.0.1'), mqtt_config.get('port', 1883))
-            my_hm.mqtt_client.loop_start()
+        my_hm.setup_outputs()
+        if 'mqtt' in my_hm.outputs.workers:
+            # The mqtt output's connection also receives injected payloads
+            my_hm.mqtt_client = my_hm.outputs.workers['mqtt'].plugin.client
             my_hm.mqtt_client.on_message = my_hm.mqtt_on_command
 
-        my_hm.influx_client = None
-        influx_config = my_hm.ahoy_config.get('influxdb', {})
-        if influx_config and not influx_config.get('disabled', False):
-            from hoymiles.outputs import InfluxOutputPlugin
-            my_hm.influx_client = InfluxOutputPlugin(
-                influx_config.get('url'),
-                influx_config.get('token'),
-                org=influx_config.get('org', ''),
-                bucket=influx_config.get('bucket', None),
-                measurement=influx_config.get('measurement', 'hoymiles'))
-
         g_inverters = [g_inverter.get('serial') for g_inverter in my_hm.ahoy_config.get('inverters', [])]
         for g_inverter in my_hm.ahoy_config.get('inverters', []):
             g_inverter_ser = g_inverter.get('serial')
@@ -269,19 +270,7 @@ class MyData(object):
             x = datetime.now()
             list_of_data = my_hm.main_loop()
             self.full_log(list_of_data, x)
-            y = -1
-            data_dict_0 = list_of_data[0]
-            y0 = -1
-            y1 = -1
-            try:
-                phase_0 = data_dict_0['phases'][0]
-                y = phase_0["power"]
-                string_0 = data_dict_0['strings'][0]
-                y0 = string_0["power"]
-                string_1 = data_dict_0['strings'][1]
-                y1 = string_1["power"]
-            except KeyError:
-                pass
+            y, y0, y1 = sample_values(list_of_data[0])
 
             print('', end='', flush=True)
 
@@ -323,16 +312,7 @@ class MyData(object):
                                                                  rollover_limit=None))
             self.documents_lock.release()
 
-            self.x_data_now.pop(0)
-            self.x_data_now.append(x)
-            self.y_data_now = np.append(np.delete(self.y_data_now, 0), y)
-            self.y_data_string0_now = np.append(np.delete(self.y_data_string0_now, 0), y0)
-            self.y_data_string1_now = np.append(np.delete(self.y_data_string1_now, 0), y1)
-
-            self.x_data_today.append(x)
-            self.y_data_today = np.append(self.y_data_today, y)
-            self.y_data_string0_today = np.append(self.y_data_string0_today, y0)
-            self.y_data_string1_today = np.append(self.y_data_string1_today, y1)
+            self.append_sample(x, y, y0, y1)
 
             print(f"{x}\t{y}\t{y0}\t{y1}", file=self.output_file)
             self.output_file.flush()
@@ -344,6 +324,18 @@ class MyData(object):
                 if self.loop_interval > 0 and (t_loop_end - t_loop_start) < self.loop_interval:
                     time.sleep(self.loop_interval - (t_loop_end - t_loop_start))
 
+    def append_sample(self, x, y, y0, y1):
+        self.x_data_now.pop(0)
+        self.x_data_now.append(x)
+        self.y_data_now = np.append(np.delete(self.y_data_now, 0), y)
+        self.y_data_string0_now = np.append(np.delete(self.y_data_string0_now, 0), y0)
+        self.y_data_string1_now = np.append(np.delete(self.y_data_string1_now, 0), y1)
+
+        self.x_data_today.append(x)
+        self.y_data_today = np.append(self.y_data_today, y)
+        self.y_data_string0_today = np.append(self.y_data_string0_today, y0)
+        self.y_data_string1_today = np.append(self.y_data_string1_today, y1)
+
     def full_log(self, list_of_data: list[dict], c_datetime):
         for data_dict in list_of_data:
             print(f'{c_datetime} Decoded: ', end='', file=self.output_file_full_log)
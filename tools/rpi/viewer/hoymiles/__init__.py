@@ -7,18 +7,25 @@ Hoymiles micro-inverters python shared code
 
 import struct
 import time
-import re
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
-import crcmod
-from RF24 import RF24, RF24_PA_MIN, RF24_PA_LOW, RF24_PA_HIGH, RF24_PA_MAX, RF24_250KBPS, RF24_CRC_DISABLED, RF24_CRC_8, RF24_CRC_16
+try:
+    from RF24 import RF24, RF24_PA_MIN, RF24_PA_LOW, RF24_PA_HIGH, RF24_PA_MAX, RF24_250KBPS, RF24_CRC_DISABLED, RF24_CRC_8, RF24_CRC_16
+except ModuleNotFoundError:
+    # No RF24 wrapper installed (e.g. not on a Pi), only simulated radios
+    # are available. Values mirror the RF24 driver enums.
+    RF24 = None
+    RF24_PA_MIN, RF24_PA_LOW, RF24_PA_HIGH, RF24_PA_MAX = 0, 1, 2, 3
+    RF24_250KBPS = 2
+    RF24_CRC_DISABLED, RF24_CRC_8, RF24_CRC_16 = 0, 1, 2
 from .decoders import *
-
-f_crc_m = crcmod.predefined.mkPredefinedCrcFun('modbus')
-f_crc8 = crcmod.mkCrcFun(0x101, initCrc=0, xorOut=0)
+from .irq import RxWaitPolling, RxWaitGpio
+from .channels import RxChannelScheduler
+from .crc import f_crc_m, f_crc8, CRC_M_INIT
 
 HOYMILES_TRANSACTION_LOGGING=False
 HOYMILES_DEBUG_LOGGING=False
+HOYMILES_METRICS=None
 
 def ser_to_hm_addr(inverter_ser):
     """
@@ -77,6 +84,7 @@ class ResponseDecoderFactory:
     request = None
     response = None
     time_rx = None
+    inverter_ser = None
 
     def __init__(self, response, **params):
         self.response = response
@@ -101,8 +109,7 @@ class ResponseDecoderFactory:
         :return: unpacked values
         :rtype: tuple
         """
-        size = struct.calcsize(fmt)
-        return struct.unpack(fmt, self.response[base:base+size])
+        return struct.unpack_from(fmt, self.response, base)
 
     @property
     def inverter_model(self):
@@ -114,25 +121,8 @@ class ResponseDecoderFactory:
         :raises ValueError: on invalid inverter serial
         :raises NotImplementedError: if inverter model can not be determined
         """
-        if not self.inverter_ser:
-            raise ValueError('Inverter serial while decoding response')
-
-        ser_db = [
-                ('Hm300', r'^1121........'),
-                ('Hm600', r'^1141........'),
-                ('Hm1200', r'^1161........'),
-                ]
-        ser_str = str(self.inverter_ser)
-
-        model = None
-        for s_model, r_match in ser_db:
-            if re.match(r_match, ser_str):
-                model = s_model
-                break
-
-        if len(model):
-            return model
-        raise NotImplementedError('Model lookup failed for serial {ser_str}')
+        serial_decoders(self.inverter_ser)
+        return inverter_models[str(self.inverter_ser)[:4]]
 
     @property
     def request_command(self):
@@ -162,15 +152,11 @@ class ResponseDecoder(ResponseDecoderFactory):
         :return: payload decoder instance
         :rtype: object
         """
-        model = self.inverter_model
-        command = self.request_command
-
-        model_decoders = __import__('hoymiles.decoders')
-        if hasattr(model_decoders, f'{model}Decode{command.upper()}'):
-            device = getattr(model_decoders, f'{model}Decode{command.upper()}')
-        else:
-            if HOYMILES_DEBUG_LOGGING:
-                device = getattr(model_decoders, 'DebugDecodeAny')
+        device = serial_decoders(self.inverter_ser).get(self.request[10], None)
+        if not device:
+            if not HOYMILES_DEBUG_LOGGING:
+                raise NotImplementedError(f'No decoder for command 0x{self.request_command} of {self.model}')
+            device = DebugDecodeAny
 
         return device(self.response,
                 time_rx=self.time_rx,
@@ -202,7 +188,7 @@ class InverterPacketFragment:
         self.frame = payload
 
         # check crc8
-        if f_crc8(payload[:-1]) != payload[-1]:
+        if f_crc8(memoryview(payload)[:-1]) != payload[-1]:
             raise BufferError('Frame kaputt')
 
         self.ch_rx = ch_rx
@@ -221,8 +207,7 @@ class InverterPacketFragment:
         :return: sender address
         :rtype: int
         """
-        src = struct.unpack('>L', self.frame[1:5])
-        return src[0]
+        return struct.unpack_from('>L', self.frame, 1)[0]
     @property
     def dst(self):
         """
@@ -231,8 +216,7 @@ class InverterPacketFragment:
         :return: receiver address
         :rtype: int
         """
-        dst = struct.unpack('>L', self.frame[5:8])
-        return dst[0]
+        return struct.unpack_from('>L', self.frame, 5)[0]
     @property
     def seq(self):
         """
@@ -241,17 +225,16 @@ class InverterPacketFragment:
         :return: sequence number
         :rtype: int
         """
-        result = struct.unpack('>B', self.frame[9:10])
-        return result[0]
+        return self.frame[9]
     @property
     def data(self):
         """
         Data without protocol framing
 
-        :return: payload chunk
-        :rtype: bytes
+        :return: payload chunk, view on the received frame
+        :rtype: memoryview
         """
-        return self.frame[10:-1]
+        return memoryview(self.frame)[10:-1]
 
     def __str__(self):
         """
@@ -265,33 +248,134 @@ class InverterPacketFragment:
         channel = f' channel {self.ch_rx}' if self.ch_rx else ''
         return f"{c_datetime} Received {size} bytes{channel}: {hexify_payload(self.frame)}"
 
+class RadioConfigShadow:
+    """
+    Shadow of the nRF24 configuration, only settings that actually changed
+    are written to the radio
+    """
+    spi_ops = 0
+    spi_ops_saved = 0
+
+    def __init__(self, radio):
+        """
+        :param radio: RF24 instance to configure
+        :type radio: RF24
+        """
+        self.radio = radio
+        self.registers = {}
+        self.listening = None
+
+    def set(self, setter, *args, register=None):
+        """
+        Call radio setter if value differs from shadow
+
+        :param str setter: name of RF24 setter method
+        :param args: setter arguments
+        :param register: shadow key (default: setter name)
+        :type register: str or tuple
+        :return: if radio was reprogrammed
+        :rtype: bool
+        """
+        if register is None:
+            register = setter
+
+        if self.registers.get(register) == args:
+            self.spi_ops_saved = self.spi_ops_saved + 1
+            return False
+
+        getattr(self.radio, setter)(*args)
+        self.registers[register] = args
+        self.spi_ops = self.spi_ops + 1
+        return True
+
+    def listen(self, enable):
+        """
+        Switch radio between RX and TX mode if required
+
+        :param bool enable: True for RX mode, False for TX mode
+        :return: if radio was reprogrammed
+        :rtype: bool
+        """
+        if self.listening == enable:
+            self.spi_ops_saved = self.spi_ops_saved + 1
+            return False
+
+        if enable:
+            self.radio.startListening()
+        else:
+            self.radio.stopListening()
+        self.listening = enable
+        self.spi_ops = self.spi_ops + 1
+        return True
+
 class HoymilesNRF:
     """Hoymiles NRF24 Interface"""
     tx_channel_id = 0
     tx_channel_list = [40]
     rx_channel_id = 0
     rx_channel_list = [3,23,40,61,75]
+    rx_hop_list = None
     rx_channel_ack = False
+    rx_peer = None
+    rx_seq = None
     rx_error = 0
+    rx_dwell = 0.005
+    rx_dwell_irq = 0.04
+    rx_scheduling = 'round-robin'
+    scheduler = None
     txpower = 'max'
+    hops = 0
+    crc_errors = 0
 
-    def __init__(self, **radio_config):
+    def __init__(self, device=None, rx_wait=None, **radio_config):
         """
         Claim radio device
 
-        :param NRF24 device: instance of NRF24
+        :param device: instance of RF24 (default: create from radio_config)
+        :type device: RF24 or None
+        :param rx_wait: receive wait primitive (default: IRQ driven if
+            irq_pin is configured, polling otherwise)
+        :type rx_wait: hoymiles.irq.RxWaitPolling or hoymiles.irq.RxWaitGpio
+        :param rx_scheduling: 'round-robin' hops rx_channel_list in order,
+            'adaptive' hops in order of RxChannelScheduler predictions
+            (default: round-robin)
+        :type rx_scheduling: str
+        :raises RuntimeError: if radio is not available
+        :raises ValueError: on unknown rx_scheduling
         """
-        radio = RF24(
-                radio_config.get('ce_pin', 22),
-                radio_config.get('cs_pin', 0),
-                radio_config.get('spispeed', 1000000))
+        radio = device
+        if not radio:
+            if not RF24:
+                raise RuntimeError('RF24 python wrapper not installed')
+            radio = RF24(
+                    radio_config.get('ce_pin', 22),
+                    radio_config.get('cs_pin', 0),
+                    radio_config.get('spispeed', 1000000))
 
         if not radio.begin():
             raise RuntimeError('Can\'t open radio')
 
         self.txpower = radio_config.get('txpower', 'max')
 
+        if not rx_wait:
+            if radio_config.get('irq_pin', None) is not None:
+                rx_wait = RxWaitGpio(radio_config['irq_pin'])
+            else:
+                rx_wait = RxWaitPolling()
+        if rx_wait.irq:
+            # Only assert IRQ on received payloads (tx_ok, tx_fail masked)
+            radio.maskIRQ(True, True, False)
+        self.rx_wait = rx_wait
+
         self.radio = radio
+        self.shadow = RadioConfigShadow(radio)
+
+        self.rx_scheduling = radio_config.get('rx_scheduling', self.rx_scheduling)
+        if self.rx_scheduling not in ['round-robin', 'adaptive']:
+            raise ValueError(f'Unknown rx_scheduling {self.rx_scheduling}')
+        if self.rx_scheduling == 'adaptive':
+            self.scheduler = RxChannelScheduler(self.rx_channel_list)
+        self.rx_hop_list = list(self.rx_channel_list)
 
     def transmit(self, packet, txpower=None):
         """
@@ -308,24 +392,30 @@ class HoymilesNRF:
         inv_esb_addr = b'\01' + packet[1:5]
         dtu_esb_addr = b'\01' + packet[5:9]
 
-        self.radio.stopListening()  # put radio in TX mode
-        self.radio.setDataRate(RF24_250KBPS)
-        self.radio.openReadingPipe(1,dtu_esb_addr)
-        self.radio.openWritingPipe(inv_esb_addr)
-        self.radio.setChannel(self.tx_channel)
-        self.radio.setAutoAck(True)
-        self.radio.setRetries(3, 15)
-        self.radio.setCRCLength(RF24_CRC_16)
-        self.radio.enableDynamicPayloads()
+        # Fragment expected first: retransmit requests name it, others start at 1
+        self.rx_peer = bytes(packet[1:5])
+        self.rx_seq = 1
+        if packet[9] > 0x80 and len(packet) == 11:
+            self.rx_seq = packet[9] - 0x80
+
+        self.shadow.listen(False)  # put radio in TX mode
+        self.shadow.set('setDataRate', RF24_250KBPS)
+        self.shadow.set('openReadingPipe', 1, dtu_esb_addr, register=('openReadingPipe', 1))
+        self.shadow.set('openWritingPipe', inv_esb_addr)
+        self.shadow.set('setChannel', self.tx_channel)
+        self.shadow.set('setAutoAck', True)
+        self.shadow.set('setRetries', 3, 15)
+        self.shadow.set('setCRCLength', RF24_CRC_16)
+        self.shadow.set('enableDynamicPayloads')
 
         if txpower == 'min':
-            self.radio.setPALevel(RF24_PA_MIN)
+            self.shadow.set('setPALevel', RF24_PA_MIN)
         elif txpower == 'low':
-            self.radio.setPALevel(RF24_PA_LOW)
+            self.shadow.set('setPALevel', RF24_PA_LOW)
         elif txpower == 'high':
-            self.radio.setPALevel(RF24_PA_HIGH)
+            self.shadow.set('setPALevel', RF24_PA_HIGH)
         else:
-            self.radio.setPALevel(RF24_PA_MAX)
+            self.shadow.set('setPALevel', RF24_PA_MAX)
 
         return self.radio.write(packet)
 
@@ -341,20 +431,28 @@ class HoymilesNRF:
         if not timeout:
             timeout=12e8
 
-        self.radio.setChannel(self.rx_channel)
-        self.radio.setAutoAck(False)
-        self.radio.setRetries(0, 0)
-        self.radio.enableDynamicPayloads()
-        self.radio.setCRCLength(RF24_CRC_16)
-        self.radio.startListening()
+        if self.scheduler:
+            # Start on the channel the expected fragment most likely arrives on
+            self.rx_hop_list = self.scheduler.order(self.rx_peer, self.rx_seq)
+            self.rx_channel_id = 0
+
+        self.shadow.set('setChannel', self.rx_channel)
+        self.shadow.set('setAutoAck', False)
+        self.shadow.set('setRetries', 0, 0)
+        self.shadow.set('enableDynamicPayloads')
+        self.shadow.set('setCRCLength', RF24_CRC_16)
+        self.shadow.listen(True)
 
         fragments = []
 
         # Receive: Loop
         t_end = time.monotonic_ns()+timeout
+        has_irq = True
         while time.monotonic_ns() < t_end:
 
-            has_payload, pipe_number = self.radio.available_pipe()
+            has_payload = False
+            if has_irq:
+                has_payload, pipe_number = self.radio.available_pipe()
             if has_payload:
 
                 # Data in nRF24 buffer, read it
@@ -364,14 +462,28 @@ class HoymilesNRF:
 
                 size = self.radio.getDynamicPayloadSize()
                 payload = self.radio.read(size)
-                fragment = InverterPacketFragment(
-                        payload=payload,
-                        ch_rx=self.rx_channel, ch_tx=self.tx_channel,
-                        time_rx=datetime.now()
-                        )
+                try:
+                    fragment = InverterPacketFragment(
+                            payload=payload,
+                            ch_rx=self.rx_channel, ch_tx=self.tx_channel,
+                            time_rx=datetime.now()
+                            )
+                except BufferError:
+                    # Corrupt frame, wait for the retransmit
+                    self.crc_errors = self.crc_errors + 1
+                    continue
+                if self.scheduler:
+                    self.scheduler.record(bytes(payload[1:5]), fragment.seq, self.rx_channel)
 
                 yield fragment
 
+                if self.scheduler:
+                    # Move on to the most likely channel of the next fragment
+                    self.rx_seq = (fragment.seq & 0x7f) + 1
+                    self.rx_hop_list = self.scheduler.order(self.rx_peer, self.rx_seq)
+                    self.rx_channel_id = 0
+                    self.tune_rx_channel()
+
             else:
 
                 # No data in nRF rx buffer, search and wait
@@ -381,11 +493,17 @@ class HoymilesNRF:
                     self.rx_channel_ack = False
                 # Channel hopping
                 if self.next_rx_channel():
-                    self.radio.stopListening()
-                    self.radio.setChannel(self.rx_channel)
-                    self.radio.startListening()
-
-            time.sleep(0.005)
+                    self.tune_rx_channel()
+
+            if has_payload and self.rx_wait.irq:
+                # Drain rx fifo before waiting for the next interrupt
+                continue
+            # The IRQ ends a wait at once, so wait long for the next fragment
+            # on the channel of the last one, searching hops at rx_dwell
+            dwell = self.rx_dwell
+            if self.rx_wait.irq and self.rx_channel_ack:
+                dwell = self.rx_dwell_irq
+            has_irq = self.rx_wait.wait(max(0, min(dwell, (t_end - time.monotonic_ns()) / 1e9)))
 
     def next_rx_channel(self):
         """
@@ -398,11 +516,27 @@ class HoymilesNRF:
         """
         if not self.rx_channel_ack:
             self.rx_channel_id = self.rx_channel_id + 1
-            if self.rx_channel_id >= len(self.rx_channel_list):
+            if self.rx_channel_id >= len(self.rx_hop_list):
                 self.rx_channel_id = 0
             return True
         return False
 
+    def tune_rx_channel(self):
+        """
+        Switch listening radio to current rx channel if required
+
+        :return: if channel changed
+        :rtype: bool
+        """
+        if self.shadow.registers.get('setChannel') == (self.rx_channel,):
+            return False
+
+        self.shadow.listen(False)
+        self.shadow.set('setChannel', self.rx_channel)
+        self.shadow.listen(True)
+        self.hops = self.hops + 1
+        return True
+
     @property
     def tx_channel(self):
         """
@@ -421,7 +555,7 @@ class HoymilesNRF:
         :return: rx_channel
         :rtype: int
         """
-        return self.rx_channel_list[self.rx_channel_id]
+        return self.rx_hop_list[self.rx_channel_id]
 
     def __del__(self):
         self.radio.powerDown()
@@ -500,21 +634,237 @@ def compose_set_time_payload(timestamp=None):
 
     return frame_payload(payload)
 
+def compose_events_payload(timestamp=None, command=0x11):
+    """
+    Build event log request packet
+
+    :param timestamp: current time (default: int(time.time()) )
+    :type timestamp: int
+    :param command: 0x11 generic events, 0x12 major events
+    :type command: int
+    :return: payload
+    :rtype: bytes
+    """
+    if not timestamp:
+        timestamp = int(time.time())
+
+    payload = struct.pack('>BB', command, 0)
+    payload = payload + struct.pack('>L', timestamp)  # big-endian: msb at low address
+    payload = payload + b'\x00\x00\x00\x05\x00\x00\x00\x00'
+
+    return frame_payload(payload)
+
+class FragmentBuffer:
+    """
+    Reassembly buffer, slot table of received frames per source address and
+    sequence number
+    """
+    max_sources = 16
+    frame_size = 21
+    duplicates = 0
+
+    def __init__(self):
+        self.slots = {}
+        self.received = {}
+        self.end = {}
+        self.buffers = {}
+        self.crcs = {}
+        self.resumes = {}
+
+    def add(self, frame):
+        """
+        Store frame in its slot, repeated frames are dropped
+
+        :param InverterPacketFragment frame: received frame
+        :return: if frame was new
+        :rtype: bool
+        """
+        src = frame.src
+        seq_id = frame.seq & 0x7f
+
+        if src not in self.slots:
+            if len(self.slots) >= self.max_sources:
+                self.discard(next(iter(self.slots)))
+            self.slots[src] = {}
+            self.received[src] = 0
+
+        if self.received[src] & (1 << seq_id):
+            self.duplicates = self.duplicates + 1
+            return False
+
+        self.slots[src][seq_id] = frame
+        self.received[src] = self.received[src] | (1 << seq_id)
+        if frame.seq > 0x80:
+            self.end[src] = seq_id
+        self.chain_crc(src)
+        return True
+
+    def chain_crc(self, src):
+        """
+        Extend the running Modbus CRC of src over frames received in order
+
+        crcs[src][n] is the CRC of the data of frames 1 to n+1. The end frame
+        is not chained, it holds the payload CRC and is checked on its own.
+
+        :param int src: source address
+        """
+        chain = self.crcs.setdefault(src, [])
+        slots = self.slots[src]
+        last = self.end.get(src, None)
+
+        crc = chain[-1] if chain else CRC_M_INIT
+        seq_id = len(chain) + 1
+        while seq_id in slots and seq_id != last:
+            crc = f_crc_m(slots[seq_id].data, crc)
+            chain.append(crc)
+            seq_id = seq_id + 1
+
+    def crc_valid(self, src):
+        """
+        Check Modbus CRC of the payload of src
+
+        Uses the running CRC, only the data of the end frame is left to
+        process.
+
+        :param int src: source address
+        :return: if payload CRC matches, None if frames are missing
+        :rtype: bool
+        """
+        if not self.complete(src):
+            return None
+
+        last = self.end[src]
+        chain = self.crcs.get(src, [])
+        data = self.slots[src][last].data
+        if len(chain) < last - 1 or len(data) < 2:
+            # payload CRC split over frames
+            payload = self.payload(src)
+            return f_crc_m(payload[:-2]) == struct.unpack_from('>H', payload, len(payload) - 2)[0]
+
+        crc = chain[last - 2] if last > 1 else CRC_M_INIT
+        return f_crc_m(data[:-2], crc) == struct.unpack_from('>H', data, len(data) - 2)[0]
+
+    def missing(self, src):
+        """
+        Sequence numbers missing to reassemble payload of src
+
+        If the end frame is not known yet, the frame following the highest
+        received sequence number is reported as missing as well.
+
+        :param int src: source address
+        :return: missing sequence numbers
+        :rtype: list
+        """
+        received = self.received.get(src, 0)
+        last = self.end.get(src, None)
+        if last is None:
+            last = max(received.bit_length(), 1)
+
+        return [seq_id for seq_id in range(1, last + 1) if not received & (1 << seq_id)]
+
+    def complete(self, src):
+        """
+        Check if all frames of src are received
+
+        :param int src: source address
+        :return: if payload can be reassembled
+        :rtype: bool
+        """
+        last = self.end.get(src, None)
+        if last is None:
+            return False
+        mask = (1 << (last + 1)) - 2
+        return self.received[src] & mask == mask
+
+    def end_frame(self, src):
+        """
+        Get end frame of src
+
+        :param int src: source address
+        :return: end frame
+        :rtype: InverterPacketFragment or None
+        """
+        if src not in self.end:
+            return None
+        return self.slots[src][self.end[src]]
+
+    def payload(self, src):
+        """
+        Join frame data of src in sequence order
+
+        Frame data is copied once into a bytearray per source, allocated
+        on first use and reused by later calls.
+
+        :param int src: source address
+        :return: payload, view on the reassembly buffer
+        :rtype: memoryview
+        :raises BufferError: if one or more frames are missing
+        """
+        missing = self.missing(src)
+        if missing:
+            raise BufferError(f'Frames {missing} missing')
+
+        buffer = self.buffers.get(src, None)
+        if buffer is None or len(buffer) < self.end[src] * self.frame_size:
+            buffer = bytearray(self.end[src] * self.frame_size)
+            self.buffers[src] = buffer
+
+        view = memoryview(buffer)
+        slots = self.slots[src]
+        position = 0
+        for seq_id in range(1, self.end[src] + 1):
+            data = slots[seq_id].data
+            view[position:position + len(data)] = data
+            position = position + len(data)
+        return view[:position]
+
+    def discard(self, src):
+        """
+        Drop all frames of src
+
+        :param int src: source address
+        """
+        self.slots.pop(src, None)
+        self.received.pop(src, None)
+        self.end.pop(src, None)
+        self.buffers.pop(src, None)
+        self.crcs.pop(src, None)
+        self.resumes.pop(src, None)
+
+    def prune(self, max_age):
+        """
+        Drop frames received more than max_age seconds ago
+
+        :param float max_age: staleness bound in seconds
+        """
+        t_stale = datetime.now() - timedelta(seconds=max_age)
+        for src in list(self.slots):
+            for seq_id, frame in list(self.slots[src].items()):
+                if frame.time_rx < t_stale:
+                    del self.slots[src][seq_id]
+                    self.received[src] = self.received[src] & ~(1 << seq_id)
+                    del self.crcs[src][seq_id - 1:]
+                    if self.end.get(src, None) == seq_id:
+                        del self.end[src]
+            if not self.slots[src]:
+                self.discard(src)
+
 class InverterTransaction:
     """
     Inverter transaction buffer, implements transport-layer functions while
     communicating with Hoymiles inverters
     """
     tx_queue = []
-    scratch = []
     inverter_ser = None
     inverter_addr = None
     dtu_ser = None
     req_type = None
     time_rx = None
+    fragments = None
 
     radio = None
     txpower = None
+    retransmit_limit = 3
 
     def __init__(self,
             request_time=None,
@@ -533,6 +883,12 @@ class InverterTransaction:
         :type dtu_ser: str
         :param radio: HoymilesNRF instance to use
         :type radio: HoymilesNRF or None
+        :param scratch: previously received frames
+        :type scratch: list
+        :param retransmit_limit: re-request whole payload if more frames are missing
+        :type retransmit_limit: int
+        :param fragments: reassembly buffer to continue, e.g. from an earlier attempt
+        :type fragments: FragmentBuffer
         """
 
         if radio:
@@ -544,9 +900,8 @@ class InverterTransaction:
         if not request_time:
             request_time=datetime.now()
 
-        self.scratch = []
-        if 'scratch' in params:
-            self.scratch = params['scratch']
+        self.tx_queue = []
+        self.retransmit_limit = params.get('retransmit_limit', self.retransmit_limit)
 
         self.inverter_ser = inverter_ser
         if inverter_ser:
@@ -559,14 +914,22 @@ class InverterTransaction:
         self.request = None
         if 'request' in params:
             self.request = params['request']
-            self.queue_tx(self.request)
             self.inverter_addr, self.dtu_addr, seq, self.req_type = struct.unpack('>LLBB', params['request'][1:11])
         self.request_time = request_time
 
+        self.fragments = params.get('fragments', None)
+        if self.fragments is None:
+            self.fragments = FragmentBuffer()
+        for frame in params.get('scratch', []):
+            self.frame_append(frame)
+
+        if self.request and self.radio:
+            self.queue_request()
+
     def rxtx(self):
         """
-        Transmit next packet from tx_queue if available
-        and wait for responses
+        Transmit all packets from tx_queue if available
+        and wait for responses in a single RX window
 
         :return: if we got contact
         :rtype: bool
@@ -577,35 +940,108 @@ class InverterTransaction:
         if len(self.tx_queue) == 0:
             return False
 
-        packet = self.tx_queue.pop(0)
+        metrics = HOYMILES_METRICS
+        if metrics:
+            t_start = time.monotonic()
 
-        if HOYMILES_TRANSACTION_LOGGING:
-            c_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-            print(f'{c_datetime} Transmit {len(packet)} | {hexify_payload(packet)}')
+        while len(self.tx_queue) > 0:
+            self.transmit(self.tx_queue.pop(0))
 
-        self.radio.transmit(packet, txpower=self.txpower)
+        if metrics:
+            t_rx = time.monotonic()
+            counters = (self.radio.hops, self.radio.crc_errors)
 
         wait = False
+        receiver = self.radio.receive()
         try:
-            for response in self.radio.receive():
+            for response in receiver:
                 if HOYMILES_TRANSACTION_LOGGING:
                     print(response)
 
                 self.frame_append(response)
                 wait = True
+
+                if self.payload_received:
+                    # End RX window, nothing left to wait for
+                    break
         except TimeoutError:
             pass
+        finally:
+            receiver.close()
+
+        if metrics:
+            self.record_rx_window(metrics, t_start, t_rx, counters)
 
         return wait
 
+    def record_rx_window(self, metrics, t_start, t_rx, counters, shares=1, share_id=0):
+        """
+        Record timings and radio counters of one rxtx() call
+
+        :param hoymiles.metrics.PollMetrics metrics: metrics to update
+        :param float t_start: monotonic time transmit started
+        :param float t_rx: monotonic time receive started
+        :param tuple counters: radio hops and crc_errors when receive started
+        :param int shares: transactions sharing the RX window, radio counters
+            are split among them, the remainder goes to the first ones
+        :param int share_id: index of this transaction among them
+        """
+        metrics.observe(self.inverter_ser, 'tx', t_rx - t_start)
+        metrics.observe(self.inverter_ser, 'rx', time.monotonic() - t_rx)
+        for counter, value, start in [
+                ('hops', self.radio.hops, counters[0]),
+                ('frame_crc_failures', self.radio.crc_errors, counters[1])]:
+            delta = value - start
+            metrics.count(self.inverter_ser, counter, delta // shares + (share_id < delta % shares))
+
+    def transmit(self, packet):
+        """
+        Put packet on air
+
+        :param bytes packet: ESB frame for transmit
+        :return: if ACK received of ACK disabled
+        :rtype: bool
+        """
+        if HOYMILES_TRANSACTION_LOGGING:
+            c_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+            print(f'{c_datetime} Transmit {len(packet)} | {hexify_payload(packet)}')
+
+        return self.radio.transmit(packet, txpower=self.txpower)
+
     def frame_append(self, frame):
         """
-        Append received raw frame to local scratch buffer
+        Store received raw frame in reassembly buffer
 
-        :param bytes frame: Received ESB frame
+        :param InverterPacketFragment frame: Received ESB frame
         :return None
         """
-        self.scratch.append(frame)
+        if self.fragments.add(frame):
+            if HOYMILES_METRICS:
+                HOYMILES_METRICS.count(self.inverter_ser, 'fragments')
+        elif HOYMILES_METRICS:
+            HOYMILES_METRICS.count(self.inverter_ser, 'duplicates')
+
+    @property
+    def payload_received(self):
+        """
+        Check if all frames of the payload are received, the payload may
+        still fail CRC
+
+        :return: if nothing is left to wait for
+        :rtype: bool
+        """
+        return self.fragments.complete(self.inverter_addr)
+
+    @property
+    def payload_complete(self):
+        """
+        Check if all frames of the payload are received and it passes CRC,
+        tracked while frames get appended
+
+        :return: if payload can be reassembled
+        :rtype: bool
+        """
+        return bool(self.fragments.crc_valid(self.inverter_addr))
 
     def queue_tx(self, frame):
         """
@@ -622,14 +1058,43 @@ class InverterTransaction:
 
         return True
 
+    def queue_request(self):
+        """
+        Queue request, or only retransmit requests if the reassembly buffer
+        holds few frames short of a payload from an earlier attempt
+
+        A new request gets a new response with new values, so partial frames
+        are dropped before it goes out. Frames of different responses must
+        never be mixed.
+
+        :return: if the full request was queued
+        :rtype: bool
+        """
+        src = self.inverter_addr
+        received = self.fragments.received.get(src, 0)
+        # Resume once per state of the buffer, no progress means no answer
+        if received and self.fragments.resumes.get(src, None) != received:
+            missing = self.fragments.missing(src)
+            if missing and len(missing) <= self.retransmit_limit:
+                self.fragments.resumes[src] = received
+                for frame_id in missing:
+                    self.__retransmit_frame(frame_id)
+                if HOYMILES_METRICS:
+                    HOYMILES_METRICS.count(self.inverter_ser, 'retransmits', len(missing))
+                return False
+
+        self.fragments.discard(src)
+        self.queue_tx(self.request)
+        return True
+
     def get_payload(self, src=None):
         """
-        Reconstruct Hoymiles payload from scratch buffer
+        Reconstruct Hoymiles payload from reassembly buffer
 
         :param src: filter frames by inverter hm_address (default self.inverter_address)
-        :type src: bytes
-        :return: payload
-        :rtype: bytes
+        :type src: int
+        :return: payload, view on the reassembly buffer
+        :rtype: memoryview
         :raises BufferError: if one or more frames are missing
         :raises ValueError: if assambled payload fails CRC check
         """
@@ -637,37 +1102,38 @@ class InverterTransaction:
         if not src:
             src = self.inverter_addr
 
-        # Collect all frames from source_address src
-        frames = [frame for frame in self.scratch if frame.src == src]
-
-        tr_len = 0
-        # Find end frame and extract message frame count
-        try:
-            end_frame = next(frame for frame in frames if frame.seq > 0x80)
-            self.time_rx = end_frame.time_rx
-            tr_len = end_frame.seq - 0x80
-        except StopIteration:
-            seq_last = max(frames, key=lambda frame:frame.seq).seq
-            self.__retransmit_frame(seq_last + 1)
-            raise BufferError(f'Missing packet: Last packet {len(self.scratch)}')
-
-        # Rebuild payload from unordered frames
-        payload = b''
-        for frame_id in range(1, tr_len):
-            try:
-                data_frame = next(item for item in frames if item.seq == frame_id)
-                payload = payload + data_frame.data
-            except StopIteration:
+        metrics = HOYMILES_METRICS
+        missing = self.fragments.missing(src)
+        if missing:
+            if len(missing) > self.retransmit_limit and self.request:
+                # Cheaper to ask for the whole payload again
+                self.fragments.discard(src)
+                self.queue_tx(self.request)
+                if metrics:
+                    metrics.count(self.inverter_ser, 'payload_requests')
+                raise BufferError(f'Frames {missing} missing: Request Payload')
+
+            for frame_id in missing:
                 self.__retransmit_frame(frame_id)
-                raise BufferError(f'Frame {frame_id} missing: Request Retransmit')
+            if metrics:
+                metrics.count(self.inverter_ser, 'retransmits', len(missing))
+            raise BufferError(f'Frames {missing} missing: Request Retransmit')
+
+        if metrics:
+            t_start = time.monotonic()
 
-        payload = payload + end_frame.data
+        payload = self.fragments.payload(src)
+        self.time_rx = self.fragments.end_frame(src).time_rx
 
         # check crc
-        pcrc = struct.unpack('>H', payload[-2:])[0]
-        if f_crc_m(payload[:-2]) != pcrc:
+        if not self.fragments.crc_valid(src):
+            self.fragments.discard(src)
+            if metrics:
+                metrics.count(self.inverter_ser, 'crc_failures')
             raise ValueError('Payload failed CRC check.')
 
+        if metrics:
+            metrics.observe(self.inverter_ser, 'reassembly', time.monotonic() - t_start)
         return payload
 
     def __retransmit_frame(self, frame_id):
@@ -700,6 +1166,93 @@ class InverterTransaction:
         size = len(self.request)
         return f'{c_datetime} Transmit | {hexify_payload(self.request)}'
 
+class TransactionPipeline:
+    """
+    Runs several inverter transactions on one radio at the same time.
+    Queued packets of all transactions go on air back to back, answers are
+    demultiplexed by source address from one shared RX window.
+    """
+
+    def __init__(self, radio, transactions):
+        """
+        :param HoymilesNRF radio: radio all transactions share
+        :param list transactions: InverterTransaction instances
+        """
+        self.radio = radio
+        self.pending = {com.inverter_addr: com for com in transactions}
+
+    def finish(self, com):
+        """
+        Remove transaction from pipeline once its payload is retrieved
+
+        :param InverterTransaction com: finished transaction
+        """
+        self.pending.pop(com.inverter_addr, None)
+
+    def requeue(self):
+        """
+        Queue request again for pending transactions with nothing queued,
+        partial payloads are resumed or dropped (see InverterTransaction.queue_request)
+        """
+        for com in self.pending.values():
+            if len(com.tx_queue) == 0 and com.request:
+                com.queue_request()
+
+    def rxtx(self):
+        """
+        Transmit all queued packets of pending transactions and wait for
+        responses in one shared RX window
+
+        :return: transactions which received frames
+        :rtype: list
+        """
+        packets = []
+        for com in self.pending.values():
+            while len(com.tx_queue) > 0:
+                packets.append((com, com.tx_queue.pop(0)))
+        if not packets:
+            return []
+
+        metrics = HOYMILES_METRICS
+        if metrics:
+            t_start = time.monotonic()
+
+        for com, packet in packets:
+            com.transmit(packet)
+
+        if metrics:
+            t_rx = time.monotonic()
+            counters = (self.radio.hops, self.radio.crc_errors)
+
+        contacted = {}
+        receiver = self.radio.receive()
+        try:
+            for response in receiver:
+                if HOYMILES_TRANSACTION_LOGGING:
+                    print(response)
+
+                com = self.pending.get(response.src, None)
+                if not com:
+                    continue
+                com.frame_append(response)
+                contacted[response.src] = com
+
+                if all(com.payload_received for com in self.pending.values()):
+                    # End RX window, nothing left to wait for
+                    break
+        except TimeoutError:
+            pass
+        finally:
+            receiver.close()
+
+        if metrics:
+            # Inverters share the window, each one gets its timings and a
+            # share of the radio counters recorded
+            for share_id, com in enumerate(self.pending.values()):
+                com.record_rx_window(metrics, t_start, t_rx, counters, len(self.pending), share_id)
+
+        return list(contacted.values())
+
 def hexify_payload(byte_var):
     """
     Represent bytes
@@ -9,19 +9,46 @@ import sys
 import struct
 import re
 import time
+import asyncio
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 import yaml
 from yaml.loader import SafeLoader
-import paho.mqtt.client
 import hoymiles
+from .sharding import RadioShards
+from .events import EventStore
+from .memtrace import AllocationMeter
+from .metrics import PollMetrics
+from .spool import Spool, SpoolDrainer
+from .outputs import output_plugins
+from .fanout import OutputFanout
+from .aio import AsyncHoymilesNRF, AsyncInverterTransaction, run_mqtt_client
 
 ahoy_config = None
 mqtt_client = None
 command_queue = {}
+fragment_cache = {}
 mqtt_command_topic_subs = []
-influx_client = None
+outputs = None
+event_store = None
+event_counts = {}
+event_fetches = {}
 hmradio = None
+hmradios = []
+radio_shards = None
+radio_workers = None
+async_radios = []
+alloc_meter = None
+t_metrics_report = 0
+spool = None
+spool_drainers = []
+
+# Config defaults that differ from the plugin's own, kept so existing
+# ahoy.yml files write to the same series as before outputs were plugins
+output_defaults = {
+        'influxdb': {'measurement': 'hoymiles'},
+        }
 
 
 def main_loop():
@@ -30,24 +57,74 @@ def main_loop():
         inverter for inverter in ahoy_config.get('inverters', [])
         if not inverter.get('disabled', False)]
 
-    list_of_data = []
-    for inverter in inverters:
-        if hoymiles.HOYMILES_DEBUG_LOGGING:
-            print(f'Poll inverter {inverter["serial"]}')
-        list_of_data.append(poll_inverter(inverter))
+    radios = hmradios if hmradios else [hmradio]
+    shards = radio_shards.assign(inverters) if radio_shards else [inverters]
+
+    # One worker per radio, all radios are on air at the same time
+    results = {}
+    if radio_workers:
+        jobs = [radio_workers.submit(poll_shard, radio_id, radios[radio_id], shard)
+                for radio_id, shard in enumerate(shards)]
+        for job in jobs:
+            results.update(job.result())
+    else:
+        results = poll_shard(0, radios[0], shards[0])
+
+    list_of_data = [results[str(inverter.get('serial'))] for inverter in inverters]
+
+    if hoymiles.HOYMILES_DEBUG_LOGGING:
+        for radio_id, radio in enumerate(radios):
+            print(f'Radio {radio_id} SPI config writes: {radio.shadow.spi_ops}, saved: {radio.shadow.spi_ops_saved}')
     return list_of_data
 
 
-def poll_inverter(inverter, retries=4):
+def poll_shard(radio_id, radio, inverters):
+    """
+    Poll inverters assigned to one radio, one after another
+
+    :param int radio_id: radio index
+    :param hoymiles.HoymilesNRF radio: radio to use
+    :param list inverters: inverter config sections
+    :return: poll result per inverter serial
+    :rtype: dict
+    """
+    results = {}
+    window = ahoy_config.get('pipeline_window', 1)
+    if window > 1:
+        # Several inverters in flight at once, answers share RX windows
+        for i in range(0, len(inverters), window):
+            if hoymiles.HOYMILES_DEBUG_LOGGING:
+                print(f'Poll inverters {[inverter["serial"] for inverter in inverters[i:i+window]]} on radio {radio_id}')
+            results.update(poll_inverters_pipelined(inverters[i:i+window], radio=radio))
+    else:
+        for inverter in inverters:
+            if hoymiles.HOYMILES_DEBUG_LOGGING:
+                print(f'Poll inverter {inverter["serial"]} on radio {radio_id}')
+            results[str(inverter['serial'])] = poll_inverter(inverter, radio=radio)
+
+    if radio_shards:
+        for inverter in inverters:
+            radio_shards.record(radio_id, inverter['serial'], bool(results[str(inverter['serial'])]))
+    return results
+
+
+def poll_inverter(inverter, retries=4, radio=None):
     """
     Send/Receive command_queue, initiate status poll on inverter
 
     :param str inverter: inverter serial
     :param retries: tx retry count if no inverter contact
     :type retries: int
+    :param radio: radio to use (default: hmradio)
+    :type radio: hoymiles.HoymilesNRF
     """
+    if not radio:
+        radio = hmradio
+
     inverter_ser = inverter.get('serial')
-    dtu_ser = ahoy_config.get('dtu', {}).get('serial')
+    metrics = hoymiles.HOYMILES_METRICS
+    if metrics:
+        t_start = time.monotonic()
 
     # Queue at least status data request
     command_queue[str(inverter_ser)].append(hoymiles.compose_set_time_payload())
@@ -59,18 +136,10 @@ def poll_inverter(inverter, retries=4):
         # Send payload {ttl}-times until we get at least one reponse
         payload_ttl = retries
         while payload_ttl > 0:
+            if metrics and payload_ttl < retries:
+                metrics.count(inverter_ser, 'retries')
             payload_ttl = payload_ttl - 1
-            com = hoymiles.InverterTransaction(
-                radio=hmradio,
-                txpower=inverter.get('txpower', None),
-                dtu_ser=dtu_ser,
-                inverter_ser=inverter_ser,
-                request=next(hoymiles.compose_esb_packet(
-                    payload,
-                    seq=b'\x80',
-                    src=dtu_ser,
-                    dst=inverter_ser
-                )))
+            com = new_transaction(inverter, payload, radio)
             response = None
             while com.rxtx():
                 try:
@@ -82,76 +151,521 @@ def poll_inverter(inverter, retries=4):
 
         # Handle the response data if any
         if response:
-            c_datetime = datetime.now()
-            print(f'{c_datetime} Payload: ' + hoymiles.hexify_payload(response))
-            decoder = hoymiles.ResponseDecoder(response,
-                                               request=com.request,
-                                               inverter_ser=inverter_ser
-                                               )
-            result = decoder.decode()
-            if isinstance(result, hoymiles.decoders.StatusResponse):
-                data = result.__dict__()
-                if hoymiles.HOYMILES_DEBUG_LOGGING:
-                    print(f'{c_datetime} Decoded: temp={data["temperature"]}', end='')
-                    if data['powerfactor'] is not None:
-                        print(f', pf={data["powerfactor"]}', end='')
-                    phase_id = 0
-                    for phase in data['phases']:
-                        print(
-                            f' phase{phase_id}=voltage:{phase["voltage"]}, current:{phase["current"]}, power:{phase["power"]}, frequency:{data["frequency"]}',
-                            end='')
-                        phase_id = phase_id + 1
-                    string_id = 0
-                    for string in data['strings']:
-                        print(
-                            f' string{string_id}=voltage:{string["voltage"]}, current:{string["current"]}, power:{string["power"]}, total:{string["energy_total"] / 1000}, daily:{string["energy_daily"]}',
-                            end='')
-                        string_id = string_id + 1
-                    print()
-
-                if mqtt_client:
-                    mqtt_send_status(mqtt_client, inverter_ser, data,
-                                     topic=inverter.get('mqtt', {}).get('topic', None))
-                if influx_client:
-                    influx_client.store_status(result)
+            data = handle_response(inverter, com, response) or data
+
+    if metrics:
+        metrics.observe(inverter_ser, 'poll', time.monotonic() - t_start)
+    return data
+
+
+def poll_inverters_pipelined(inverters, retries=4, radio=None):
+    """
+    Send/Receive command_queue of several inverters at once, requests go
+    on air back to back and all answers are collected in shared RX windows
+
+    :param list inverters: inverter config sections
+    :param retries: tx retry count if no inverter contact
+    :type retries: int
+    :param radio: radio to use (default: hmradio)
+    :type radio: hoymiles.HoymilesNRF
+    :return: poll result per inverter serial
+    :rtype: dict
+    """
+    if not radio:
+        radio = hmradio
+
+    results = {}
+    for inverter in inverters:
+        # Queue at least status data request
+        command_queue[str(inverter.get('serial'))].append(hoymiles.compose_set_time_payload())
+        results[str(inverter.get('serial'))] = dict()
+
+    # One queued command per inverter and round
+    while True:
+        responses = exchange_pipelined(inverters, retries, radio)
+        if responses is None:
+            break
+
+        # Handle the response data if any
+        for inverter, com, response in responses:
+            inverter_ser = str(inverter.get('serial'))
+            results[inverter_ser] = handle_response(inverter, com, response) or results[inverter_ser]
+    return results
+
+
+def exchange_pipelined(inverters, retries=4, radio=None):
+    """
+    Send the next queued command of every inverter in one pipeline and
+    collect the answers, radio work only
+
+    :param list inverters: inverter config sections
+    :param retries: tx retry count if no inverter contact
+    :type retries: int
+    :param radio: radio to use (default: hmradio)
+    :type radio: hoymiles.HoymilesNRF
+    :return: (inverter, transaction, response) of answered commands, None
+        if no command was queued
+    :rtype: list
+    """
+    if not radio:
+        radio = hmradio
+
+    coms = {}
+    for inverter in inverters:
+        if len(command_queue[str(inverter.get('serial'))]) > 0:
+            payload = command_queue[str(inverter.get('serial'))].pop(0)
+            coms[str(inverter.get('serial'))] = (inverter, new_transaction(inverter, payload, radio))
+    if not coms:
+        return None
+
+    pipeline = hoymiles.TransactionPipeline(radio, [com for inverter, com in coms.values()])
+    responses = {}
+    for attempt in range(retries):
+        if attempt > 0:
+            pipeline.requeue()
+            if hoymiles.HOYMILES_METRICS:
+                for com in pipeline.pending.values():
+                    hoymiles.HOYMILES_METRICS.count(com.inverter_ser, 'retries')
+
+        contacted = pipeline.rxtx()
+        while contacted:
+            for com in contacted:
+                try:
+                    responses[str(com.inverter_ser)] = com.get_payload()
+                    pipeline.finish(com)
+                except Exception as e_all:
+                    print(f'Error while retrieving data: {e_all}')
+            contacted = pipeline.rxtx()
+
+        if not pipeline.pending:
+            break
+
+    return [coms[inverter_ser] + (response,) for inverter_ser, response in responses.items()]
+
+
+def new_transaction(inverter, payload, radio, transaction=hoymiles.InverterTransaction):
+    """
+    Prepare transaction for payload, continue with fragments received on
+    earlier attempts
+
+    :param dict inverter: inverter config section
+    :param bytes payload: payload to send
+    :param hoymiles.HoymilesNRF radio: radio to use
+    :param transaction: transaction class (default: hoymiles.InverterTransaction)
+    :type transaction: type
+    :return: transaction
+    :rtype: hoymiles.InverterTransaction
+    """
+    inverter_ser = inverter.get('serial')
+    dtu_ser = ahoy_config.get('dtu', {}).get('serial')
+
+    fragments = fragment_cache.setdefault((str(inverter_ser), payload[0]), hoymiles.FragmentBuffer())
+    fragments.prune(ahoy_config.get('fragment_max_age', 10))
+
+    return transaction(
+        radio=radio,
+        txpower=inverter.get('txpower', None),
+        dtu_ser=dtu_ser,
+        inverter_ser=inverter_ser,
+        retransmit_limit=ahoy_config.get('retransmit_limit', 3),
+        fragments=fragments,
+        request=next(hoymiles.compose_esb_packet(
+            payload,
+            seq=b'\x80',
+            src=dtu_ser,
+            dst=inverter_ser
+        )))
+
+
+def handle_response(inverter, com, response):
+    """
+    Decode response and publish it
+
+    :param dict inverter: inverter config section
+    :param hoymiles.InverterTransaction com: transaction the response belongs to
+    :param bytes response: reassembled payload
+    :return: decoded status data if response is a StatusResponse
+    :rtype: hoymiles.decoders.StatusRecord or None
+    """
+    inverter_ser = inverter.get('serial')
+    fragment_cache.pop((str(inverter_ser), com.req_type), None)
+
+    c_datetime = datetime.now()
+    print(f'{c_datetime} Payload: ' + hoymiles.hexify_payload(response))
+    metrics = hoymiles.HOYMILES_METRICS
+    if metrics:
+        t_start = time.monotonic()
+    try:
+        decoder = hoymiles.ResponseDecoder(response,
+                                           request=com.request,
+                                           inverter_ser=inverter_ser
+                                           )
+        result = decoder.decode()
+    except (ValueError, NotImplementedError) as e_decode:
+        print(f'{c_datetime} Decode failed: {e_decode}')
+        if metrics:
+            metrics.count(inverter_ser, 'decode_failures')
+        return None
+    if isinstance(result, hoymiles.decoders.StatusResponse):
+        data = result.record
+        if metrics:
+            metrics.observe(inverter_ser, 'decode', time.monotonic() - t_start)
+        if hoymiles.HOYMILES_DEBUG_LOGGING:
+            print(f'{c_datetime} Decoded: temp={data.temperature}', end='')
+            if data.powerfactor is not None:
+                print(f', pf={data.powerfactor}', end='')
+            phase_id = 0
+            for phase in data.phases:
+                print(
+                    f' phase{phase_id}=voltage:{phase.voltage}, current:{phase.current}, power:{phase.power}, frequency:{data.frequency}',
+                    end='')
+                phase_id = phase_id + 1
+            string_id = 0
+            for string in data.strings:
+                print(
+                    f' string{string_id}=voltage:{string.voltage}, current:{string.current}, power:{string.power}, total:{string.energy_total / 1000}, daily:{string.energy_daily}',
+                    end='')
+                string_id = string_id + 1
+            print()
+
+        if spool:
+            # Drainer threads send it on to the output plugins
+            if metrics:
+                t_start = time.monotonic()
+            spool.append([spool_record(data)])
+            if metrics:
+                metrics.observe(inverter_ser, 'spool', time.monotonic() - t_start)
+        elif outputs:
+            if metrics:
+                t_start = time.monotonic()
+            outputs.publish('store_status', data, inverter=inverter)
+            if metrics:
+                metrics.observe(inverter_ser, 'output_enqueue', time.monotonic() - t_start)
+        queue_event_fetch(inverter, data)
+        return data
+    if isinstance(result, hoymiles.decoders.EventsResponse):
+        if str(inverter_ser) in event_fetches:
+            event_counts[str(inverter_ser)] = event_fetches[str(inverter_ser)][0]
+        events = result.events
+        if event_store:
+            events = event_store.add(inverter_ser, events)
+        if hoymiles.HOYMILES_DEBUG_LOGGING:
+            for event in events:
+                print(f'{c_datetime} Event: {event.time} uptime={event.uptime} count={event.count} ' \
+                      f'code={event.code} text={event.text}')
+        if outputs and events:
+            outputs.publish('store_events', inverter_ser, events, inverter=inverter)
+    return None
+
+
+async def async_main_loop():
+    """Main loop on asyncio event loop, all radios poll concurrently"""
+    inverters = [
+        inverter for inverter in ahoy_config.get('inverters', [])
+        if not inverter.get('disabled', False)]
+
+    shards = radio_shards.assign(inverters) if radio_shards else [inverters]
+
+    results = {}
+    for shard_results in await asyncio.gather(*[
+            async_poll_shard(radio_id, async_radios[radio_id], shard)
+            for radio_id, shard in enumerate(shards)]):
+        results.update(shard_results)
+
+    return [results[str(inverter.get('serial'))] for inverter in inverters]
+
+
+async def async_poll_shard(radio_id, radio, inverters):
+    """
+    Poll inverters assigned to one radio, decoding and outputs of one
+    inverter (or pipeline window) overlap with radio I/O of the next one
+
+    :param int radio_id: radio index
+    :param hoymiles.aio.AsyncHoymilesNRF radio: radio to use
+    :param list inverters: inverter config sections
+    :return: poll result per inverter serial
+    :rtype: dict
+    """
+    loop = asyncio.get_running_loop()
+    handled = {}
+    window = ahoy_config.get('pipeline_window', 1)
+    if window > 1:
+        for i in range(0, len(inverters), window):
+            group = inverters[i:i+window]
+            responses = {}
+            for inverter in group:
+                # Queue at least status data request
+                command_queue[str(inverter['serial'])].append(hoymiles.compose_set_time_payload())
+                responses[str(inverter['serial'])] = []
+            # Pipelined exchange has no async variant, only it runs on the SPI thread
+            while True:
+                exchanged = await radio.spi(exchange_pipelined, group, 4, radio.radio)
+                if exchanged is None:
+                    break
+                for inverter, com, response in exchanged:
+                    responses[str(inverter['serial'])].append((com, response))
+            for inverter in group:
+                handled[str(inverter['serial'])] = loop.run_in_executor(None,
+                        handle_responses, inverter, responses[str(inverter['serial'])])
+    else:
+        for inverter in inverters:
+            if hoymiles.HOYMILES_DEBUG_LOGGING:
+                print(f'Poll inverter {inverter["serial"]} on radio {radio_id}')
+            responses = await async_poll_inverter(inverter, radio=radio)
+            handled[str(inverter['serial'])] = loop.run_in_executor(None, handle_responses, inverter, responses)
+
+    results = {}
+    for inverter_ser, future in handled.items():
+        results[inverter_ser] = await future
+
+    if radio_shards:
+        for inverter in inverters:
+            radio_shards.record(radio_id, inverter['serial'], bool(results[str(inverter['serial'])]))
+    return results
+
+
+async def async_poll_inverter(inverter, retries=4, radio=None):
+    """
+    Send/Receive command_queue, initiate status poll on inverter
+
+    Unlike poll_inverter() the responses are returned undecoded, so the
+    caller can hand them to handle_responses() off the event loop.
+
+    :param str inverter: inverter serial
+    :param retries: tx retry count if no inverter contact
+    :type retries: int
+    :param radio: radio to use (default: first radio)
+    :type radio: hoymiles.aio.AsyncHoymilesNRF
+    :return: transactions and their responses
+    :rtype: list
+    """
+    if not radio:
+        radio = async_radios[0]
+
+    inverter_ser = inverter.get('serial')
+    metrics = hoymiles.HOYMILES_METRICS
+    if metrics:
+        t_start = time.monotonic()
+
+    # Queue at least status data request
+    command_queue[str(inverter_ser)].append(hoymiles.compose_set_time_payload())
+    responses = []
+    # Putt all queued commands for current inverter on air
+    while len(command_queue[str(inverter_ser)]) > 0:
+        payload = command_queue[str(inverter_ser)].pop(0)
+
+        # Send payload {ttl}-times until we get at least one reponse
+        payload_ttl = retries
+        while payload_ttl > 0:
+            if metrics and payload_ttl < retries:
+                metrics.count(inverter_ser, 'retries')
+            payload_ttl = payload_ttl - 1
+            com = new_transaction(inverter, payload, radio, transaction=AsyncInverterTransaction)
+            response = None
+            while await com.rxtx():
+                try:
+                    response = com.get_payload()
+                    payload_ttl = 0
+                except Exception as e_all:
+                    print(f'Error while retrieving data: {e_all}')
+                    pass
+
+        if response:
+            responses.append((com, response))
+
+    if metrics:
+        metrics.observe(inverter_ser, 'poll', time.monotonic() - t_start)
+    return responses
+
+
+def handle_responses(inverter, responses):
+    """
+    Decode and publish responses of one inverter
+
+    :param dict inverter: inverter config section
+    :param list responses: transactions and their responses
+    :return: last decoded status data
+    :rtype: hoymiles.decoders.StatusRecord or dict
+    """
+    data = dict()
+    for com, response in responses:
+        data = handle_response(inverter, com, response) or data
     return data
 
 
-def mqtt_send_status(broker, inverter_ser, data, topic=None):
+async def async_run(loop_interval, run_stats):
     """
-    Publish StatusResponse object
+    Poll forever on an asyncio event loop, mqtt network I/O runs on the
+    same loop
 
-    :param paho.mqtt.client.Client broker: mqtt-client instance
-    :param str inverter_ser: inverter serial
-    :param hoymiles.StatusResponse data: decoded inverter StatusResponse
-    :param topic: custom mqtt topic prefix (default: hoymiles/{inverter_ser})
-    :type topic: str
+    :param float loop_interval: seconds between poll cycles
+    :param dict run_stats: poll and payload counters, updated each cycle
     """
+    global async_radios
+    async_radios = [AsyncHoymilesNRF(radio) for radio in hmradios]
 
-    if not topic:
-        topic = f'hoymiles/{inverter_ser}'
+    mqtt_task = None
+    if mqtt_client:
+        mqtt_task = asyncio.create_task(run_mqtt_client(mqtt_client))
 
-    # AC Data
-    phase_id = 0
-    for phase in data['phases']:
-        broker.publish(f'{topic}/emeter/{phase_id}/power', phase['power'])
-        broker.publish(f'{topic}/emeter/{phase_id}/voltage', phase['voltage'])
-        broker.publish(f'{topic}/emeter/{phase_id}/current', phase['current'])
-        phase_id = phase_id + 1
+    try:
+        while True:
+            t_loop_start = time.time()
+            t_cpu_start = time.process_time()
+            if alloc_meter:
+                alloc_meter.start()
+
+            results = await async_main_loop()
+            cycle_polls = len(results)
+            cycle_payloads = len([data for data in results if data])
+            run_stats['polls'] = run_stats['polls'] + cycle_polls
+            run_stats['payloads'] = run_stats['payloads'] + cycle_payloads
+            print_cycle_stats(t_loop_start, t_cpu_start, cycle_polls, cycle_payloads, run_stats['mode'])
+            report_metrics()
+
+            if loop_interval > 0 and (time.time() - t_loop_start) < loop_interval:
+                await asyncio.sleep(loop_interval - (time.time() - t_loop_start))
+    finally:
+        if mqtt_task:
+            mqtt_task.cancel()
+        for radio in async_radios:
+            radio.close()
+
+
+def print_cycle_stats(t_loop_start, t_cpu_start, cycle_polls, cycle_payloads, poll_mode):
+    """
+    Print poll cycle timing if debug logging is enabled
+
+    :param float t_loop_start: wall clock time cycle started
+    :param float t_cpu_start: process time cycle started
+    :param int cycle_polls: inverters polled in cycle
+    :param int cycle_payloads: polls of cycle that returned a payload
+    :param str poll_mode: poll mode description
+    """
+    if hoymiles.HOYMILES_DEBUG_LOGGING:
+        rx_mode = 'irq' if hmradio.rx_wait.irq else 'polling'
+        t_cycle = time.time() - t_loop_start
+        print(f'Poll cycle: {t_cycle:.3f}s wall, ' \
+              f'{time.process_time() - t_cpu_start:.3f}s cpu ({rx_mode} receive), ' \
+              f'{cycle_payloads / t_cycle:.2f} payloads/s ' \
+              f'({cycle_payloads}/{cycle_polls} polls ok, {poll_mode})')
 
-    # DC Data
-    string_id = 0
-    for string in data['strings']:
-        broker.publish(f'{topic}/emeter-dc/{string_id}/total', string['energy_total'] / 1000)
-        broker.publish(f'{topic}/emeter-dc/{string_id}/power', string['power'])
-        broker.publish(f'{topic}/emeter-dc/{string_id}/voltage', string['voltage'])
-        broker.publish(f'{topic}/emeter-dc/{string_id}/current', string['current'])
-        string_id = string_id + 1
-    # Global
-    if data['powerfactor'] is not None:
-        broker.publish(f'{topic}/pf', data['powerfactor'])
-    broker.publish(f'{topic}/frequency', data['frequency'])
-    broker.publish(f'{topic}/temperature', data['temperature'])
+    if alloc_meter:
+        peak, retained = alloc_meter.stop(cycle_polls)
+        print(f'Poll cycle: {peak} B peak, {retained:+} B retained heap allocation ({cycle_polls} polls)')
+
+    print('', end='', flush=True)
+
+
+def report_metrics(force=False):
+    """
+    Print metrics summary and publish metrics of every inverter, at most
+    every metrics.interval seconds
+
+    :param bool force: report regardless of interval
+    """
+    global t_metrics_report
+    metrics = hoymiles.HOYMILES_METRICS
+    if not metrics:
+        return
+    if not force and time.monotonic() - t_metrics_report < ahoy_config.get('metrics', {}).get('interval', 60):
+        return
+    t_metrics_report = time.monotonic()
+
+    for line in metrics.summary():
+        print(f'Metrics: {line}')
+
+    if not outputs:
+        return
+    for inverter in ahoy_config.get('inverters', []):
+        inverter_ser = inverter.get('serial')
+        outputs.publish('store_metrics', inverter_ser, metrics.inverter(inverter_ser), inverter=inverter)
+
+    print('Metrics: outputs ' + stats_line(outputs.stats()))
+    for name, worker in outputs.workers.items():
+        print(f'Metrics: output {name} ' + stats_line(worker.stats()))
+        if hasattr(worker.plugin, 'stats'):
+            print(f'Metrics: {name} ' + stats_line(worker.plugin.stats()))
+    if spool:
+        print('Metrics: spool ' + stats_line(spool.stats()))
+        for drainer in spool_drainers:
+            print(f'Metrics: spool {drainer.sink} ' + stats_line(drainer.stats()))
+
+
+def stats_line(stats):
+    """
+    Format output statistics
+
+    :param dict stats: counters and duration summaries (see hoymiles.metrics.RollingHistogram)
+    :return: key=value pairs, durations as mean/p90 milliseconds
+    :rtype: str
+    """
+    fields = []
+    for key, value in stats.items():
+        if not isinstance(value, dict):
+            fields.append(f'{key}={value}')
+        elif 'mean' in value:
+            fields.append(f'{key}={value["mean"] * 1e3:.1f}/{value["p90"] * 1e3:.1f}ms')
+    return ' '.join(fields)
+
+
+def queue_event_fetch(inverter, data):
+    """
+    Queue event log requests if the inverter's event_count changed since
+    the last successful fetch, at most every events.min_interval seconds
+
+    The first status seen after start counts as change.
+
+    :param dict inverter: inverter config section
+    :param hoymiles.decoders.StatusRecord data: decoded inverter status
+    """
+    events_config = ahoy_config.get('events', {})
+    if data.event_count is None or not events_config.get('fetch', True):
+        return
+
+    inverter_ser = str(inverter.get('serial'))
+    if data.event_count == event_counts.get(inverter_ser, None):
+        return
+
+    _, t_fetch = event_fetches.get(inverter_ser, (None, None))
+    if t_fetch is not None and time.monotonic() - t_fetch < events_config.get('min_interval', 300):
+        return
+
+    event_fetches[inverter_ser] = (data.event_count, time.monotonic())
+    for command in events_config.get('commands', [0x11]):
+        command_queue[inverter_ser].append(hoymiles.compose_events_payload(command=command))
+
+
+def spool_record(data):
+    """
+    Spool record of decoded status
+
+    :param hoymiles.decoders.StatusRecord data: decoded inverter status
+    :return: JSON serializable record
+    :rtype: dict
+    """
+    record = data.as_dict()
+    if isinstance(data.time, datetime):
+        record['time'] = data.time.isoformat()
+    return record
+
+
+def spool_sender(name, worker):
+    """
+    Send function of the spool drainer of an output plugin, records go
+    through the plugin's worker queue and wait for the plugin's result
+
+    :param str name: plugin name, also the inverter config section of its parameters
+    :param hoymiles.fanout.OutputWorker worker: worker of the output plugin
+    :return: sends a list of spooled status records
+    :rtype: callable
+    """
+    def send(records):
+        inverters = {str(inverter.get('serial')): inverter for inverter in ahoy_config.get('inverters', [])}
+        worker.submit('send_status', [(hoymiles.decoders.StatusRecord.from_dict(record),
+                                       inverters.get(str(record.get('inverter_ser')), {}).get(name, {}))
+                                      for record in records]).result()
+    return send
 
 
 def mqtt_on_command(client, userdata, message):
@@ -200,6 +714,54 @@ def mqtt_on_command(client, userdata, message):
                     hoymiles.frame_payload(payload[1:]))
 
 
+def setup_radios(simulate=False):
+    """
+    Prepare all transceivers from ahoy_config, inverters get sharded
+    across them
+
+    :param simulate: use simulated radios for all transceivers
+    :type simulate: bool
+    """
+    global hmradio, hmradios, radio_shards, radio_workers
+    hmradios = []
+    for radio_config in ahoy_config.get('nrf', [{}]):
+        if simulate or radio_config.get('simulate', False):
+            from .simulator import HoymilesSimulatedNRF
+            hmradios.append(HoymilesSimulatedNRF(
+                inverters=[inverter.get('serial') for inverter in ahoy_config.get('inverters', [])],
+                **radio_config))
+        else:
+            hmradios.append(hoymiles.HoymilesNRF(**radio_config))
+    hmradio = hmradios[0]
+
+    radio_shards = RadioShards(len(hmradios),
+            dynamic=ahoy_config.get('radio_assignment', 'static') == 'dynamic')
+    radio_workers = None
+    if len(hmradios) > 1:
+        radio_workers = ThreadPoolExecutor(max_workers=len(hmradios), thread_name_prefix='radio')
+
+
+def setup_outputs(use_asyncio=False):
+    """
+    Build output plugins from ahoy_config: every registered plugin
+    (hoymiles.outputs.output_plugins) with a config section that is not
+    disabled gets a worker behind the fan-out queue. Keys missing in a
+    section are taken from output_defaults first.
+
+    :param bool use_asyncio: mqtt network I/O runs on the event loop
+    """
+    global outputs
+    outputs = OutputFanout(**ahoy_config.get('outputs', {}))
+    for name, plugin_class in output_plugins.items():
+        plugin_config = ahoy_config.get(name, {})
+        if not plugin_config or plugin_config.get('disabled', False):
+            continue
+        plugin = plugin_class(**dict(output_defaults.get(name, {}),
+            **dict(plugin_config, loop_start=not use_asyncio)))
+        outputs.register(name, plugin, **{key: plugin_config[key] for key in ['queue_size', 'drop_policy']
+            if key in plugin_config})
+
+
 def my_func():
     parser = argparse.ArgumentParser(description='Ahoy - Hoymiles solar inverter gateway', prog="hoymiles")
     parser.add_argument("-c", "--config-file", nargs="?", default="ahoy.yml",
@@ -208,6 +770,10 @@ def my_func():
                         help="Enable transaction logging output")
     parser.add_argument("--verbose", action="store_true", default=False,
                         help="Enable debug output")
+    parser.add_argument("--simulate", nargs="?", type=int, const=0, default=None, metavar="INVERTERS",
+                        help="Use simulated radio, optionally add INVERTERS virtual inverters")
+    parser.add_argument("--trace-alloc", action="store_true", default=False,
+                        help="Measure heap allocations per poll cycle (slow)")
     global_config = parser.parse_args()
 
     # Load ahoy.yml config file
@@ -228,17 +794,24 @@ def my_func():
     global ahoy_config
     ahoy_config = dict(cfg.get('ahoy', {}))
 
-    # Prepare for multiple transceivers, makes them configurable (currently
-    # only one supported)
-    global hmradio
-    for radio_config in ahoy_config.get('nrf', [{}]):
-        hmradio = hoymiles.HoymilesNRF(**radio_config)
+    if global_config.simulate:
+        ahoy_config['inverters'] = ahoy_config.get('inverters', []) + [
+            {'name': f'sim{sim_id}', 'serial': f'1141{sim_id:08d}'}
+            for sim_id in range(1, global_config.simulate + 1)]
+
+    setup_radios(simulate=global_config.simulate is not None)
 
     global mqtt_client
     mqtt_client = None
+    use_asyncio = ahoy_config.get('engine', 'threads') == 'asyncio'
 
     global command_queue
     command_queue = {}
+    global fragment_cache
+    fragment_cache = {}
+    global event_counts, event_fetches
+    event_counts = {}
+    event_fetches = {}
     global mqtt_command_topic_subs
     mqtt_command_topic_subs = []
 
@@ -247,25 +820,43 @@ def my_func():
     if global_config.verbose:
         hoymiles.HOYMILES_DEBUG_LOGGING = True
 
-    mqtt_config = ahoy_config.get('mqtt', [])
-    if not mqtt_config.get('disabled', False):
-        mqtt_client = paho.mqtt.client.Client()
-        mqtt_client.username_pw_set(mqtt_config.get('user', None), mqtt_config.get('password', None))
-        mqtt_client.connect(mqtt_config.get('host', '127.0.0.1'), mqtt_config.get('port', 1883))
-        mqtt_client.loop_start()
+    global alloc_meter
+    alloc_meter = None
+    if global_config.trace_alloc:
+        alloc_meter = AllocationMeter()
+
+    global t_metrics_report
+    t_metrics_report = time.monotonic()
+    hoymiles.HOYMILES_METRICS = None
+    metrics_config = ahoy_config.get('metrics', {})
+    if metrics_config.get('enabled', False):
+        hoymiles.HOYMILES_METRICS = PollMetrics(window=metrics_config.get('window', None))
+
+    setup_outputs(use_asyncio)
+    if 'mqtt' in outputs.workers:
+        # The mqtt output's connection also receives injected payloads
+        mqtt_client = outputs.workers['mqtt'].plugin.client
         mqtt_client.on_message = mqtt_on_command
 
-    global influx_client
-    influx_client = None
-    influx_config = ahoy_config.get('influxdb', {})
-    if influx_config and not influx_config.get('disabled', False):
-        from .outputs import InfluxOutputPlugin
-        influx_client = InfluxOutputPlugin(
-            influx_config.get('url'),
-            influx_config.get('token'),
-            org=influx_config.get('org', ''),
-            bucket=influx_config.get('bucket', None),
-            measurement=influx_config.get('measurement', 'hoymiles'))
+    global event_store
+    event_store = None
+    events_config = ahoy_config.get('events', {})
+    if events_config.get('store', None):
+        event_store = EventStore(events_config['store'])
+
+    global spool, spool_drainers
+    spool = None
+    spool_drainers = []
+    spool_config = ahoy_config.get('spool', {})
+    if spool_config.get('directory', None) and not spool_config.get('disabled', False) \
+            and outputs.workers:
+        spool = Spool(spool_config['directory'], **{key: spool_config[key] for key in [
+            'segment_size', 'max_bytes', 'fsync_interval', 'fsync_records']
+            if key in spool_config})
+        drainer_params = {key: spool_config[key] for key in ['batch_size', 'flush_interval', 'backoff']
+            if key in spool_config}
+        for name, worker in outputs.workers.items():
+            spool_drainers.append(SpoolDrainer(spool, name, spool_sender(name, worker), **drainer_params))
 
     g_inverters = [g_inverter.get('serial') for g_inverter in ahoy_config.get('inverters', [])]
     for g_inverter in ahoy_config.get('inverters', []):
@@ -284,18 +875,58 @@ def my_func():
             mqtt_command_topic_subs.append(topic_item)
 
     loop_interval = ahoy_config.get('interval', 1)
+    t_run_start = time.time()
+    poll_mode = 'sequential'
+    if ahoy_config.get('pipeline_window', 1) > 1:
+        poll_mode = f'pipelined, window {ahoy_config["pipeline_window"]}'
+    if use_asyncio:
+        poll_mode = poll_mode + ', asyncio'
+    run_stats = {'polls': 0, 'payloads': 0, 'mode': poll_mode}
     try:
-        while True:
-            t_loop_start = time.time()
-
-            main_loop()
-
-            print('', end='', flush=True)
-
-            if loop_interval > 0 and (time.time() - t_loop_start) < loop_interval:
-                time.sleep(loop_interval - (time.time() - t_loop_start))
+        if use_asyncio:
+            asyncio.run(async_run(loop_interval, run_stats))
+        else:
+            while True:
+                t_loop_start = time.time()
+                t_cpu_start = time.process_time()
+                if alloc_meter:
+                    alloc_meter.start()
+
+                results = main_loop()
+                cycle_polls = len(results)
+                cycle_payloads = len([data for data in results if data])
+                run_stats['polls'] = run_stats['polls'] + cycle_polls
+                run_stats['payloads'] = run_stats['payloads'] + cycle_payloads
+                print_cycle_stats(t_loop_start, t_cpu_start, cycle_polls, cycle_payloads, poll_mode)
+                report_metrics()
+
+                if loop_interval > 0 and (time.time() - t_loop_start) < loop_interval:
+                    time.sleep(loop_interval - (time.time() - t_loop_start))
 
     except KeyboardInterrupt:
+        if radio_workers:
+            radio_workers.shutdown(wait=False, cancel_futures=True)
+        if hasattr(hmradio, 'stats'):
+            t_run = time.time() - t_run_start
+            sim_stats = {}
+            for radio in hmradios:
+                for key, value in radio.stats.items():
+                    sim_stats[key] = sim_stats.get(key, 0) + value
+            polls = run_stats['polls']
+            payloads = run_stats['payloads']
+            print(f'Simulation: {payloads}/{polls} polls ok in {t_run:.1f}s ' \
+                  f'({payloads / t_run:.2f} payloads/s, {poll_mode})')
+            print('Simulation: ' + ', '.join(f'{key}={value}' for key, value in sim_stats.items()))
+        report_metrics(force=True)
+        for drainer in spool_drainers:
+            drainer.close(timeout=10)
+        if spool:
+            spool.close()
+        if outputs:
+            outputs.close(timeout=10)
+        if alloc_meter:
+            print(f'Allocations: {alloc_meter.summary()}')
+            alloc_meter.close()
         sys.exit()
 
 
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles asyncio interface
+
+Radio access still happens through HoymilesNRF, but every SPI call runs in
+a dedicated executor thread per radio, so radio I/O does not block the
+event loop and can overlap with MQTT and outputs.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import hoymiles
+from . import InverterTransaction, hexify_payload
+
+class AsyncHoymilesNRF:
+    """ asyncio front end of a HoymilesNRF instance """
+
+    def __init__(self, radio):
+        """
+        :param HoymilesNRF radio: radio to drive
+        """
+        self.radio = radio
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='spi')
+
+    @property
+    def hops(self):
+        """ RX channel hops of the radio """
+        return self.radio.hops
+
+    @property
+    def crc_errors(self):
+        """ Frames of the radio dropped for failing CRC8 """
+        return self.radio.crc_errors
+
+    async def spi(self, func, *args):
+        """
+        Run blocking radio call in the SPI executor
+
+        :param func: callable to run
+        :param args: arguments
+        :return: result of func
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def transmit(self, packet, txpower=None):
+        """
+        Transmit Packet
+
+        :param bytes packet: buffer to send
+        :return: if ACK received of ACK disabled
+        :rtype: bool
+        """
+        return await self.spi(self.radio.transmit, packet, txpower)
+
+    async def receive(self, timeout=None):
+        """
+        Receive Packets, async iterator over HoymilesNRF.receive()
+
+        :param timeout: receive timeout in nanoseconds (default: 12e8)
+        :type timeout: int
+        :yields: fragment
+        """
+        receiver = self.radio.receive(timeout)
+        try:
+            while True:
+                fragment = await self.spi(next, receiver, None)
+                if fragment is None:
+                    break
+                yield fragment
+        finally:
+            await self.spi(receiver.close)
+
+    def close(self):
+        """ Stop SPI executor """
+        self.executor.shutdown(wait=False)
+
+class AsyncInverterTransaction(InverterTransaction):
+    """
+    Inverter transaction on an AsyncHoymilesNRF radio, only rxtx() and
+    transmit() differ from InverterTransaction
+    """
+
+    async def transmit(self, packet):
+        """
+        Put packet on air
+
+        :param bytes packet: ESB frame for transmit
+        :return: if ACK received of ACK disabled
+        :rtype: bool
+        """
+        if hoymiles.HOYMILES_TRANSACTION_LOGGING:
+            c_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+            print(f'{c_datetime} Transmit {len(packet)} | {hexify_payload(packet)}')
+
+        return await self.radio.transmit(packet, txpower=self.txpower)
+
+    async def rxtx(self):
+        """
+        Transmit all packets from tx_queue if available
+        and wait for responses in a single RX window
+
+        :return: if we got contact
+        :rtype: bool
+        """
+        if not self.radio:
+            return False
+
+        if len(self.tx_queue) == 0:
+            return False
+
+        metrics = hoymiles.HOYMILES_METRICS
+        if metrics:
+            t_start = time.monotonic()
+
+        while len(self.tx_queue) > 0:
+            await self.transmit(self.tx_queue.pop(0))
+
+        if metrics:
+            t_rx = time.monotonic()
+            counters = (self.radio.hops, self.radio.crc_errors)
+
+        wait = False
+        receiver = self.radio.receive()
+        try:
+            async for response in receiver:
+                if hoymiles.HOYMILES_TRANSACTION_LOGGING:
+                    print(response)
+
+                self.frame_append(response)
+                wait = True
+
+                if self.payload_received:
+                    # End RX window, nothing left to wait for
+                    break
+        finally:
+            await receiver.aclose()
+
+        if metrics:
+            self.record_rx_window(metrics, t_start, t_rx, counters)
+
+        return wait
+
+async def run_mqtt_client(client, misc_interval=1):
+    """
+    Drive paho mqtt client network I/O from the running event loop instead
+    of its own thread (do not call loop_start())
+
+    :param paho.mqtt.client.Client client: connected mqtt-client instance
+    :param misc_interval: seconds between keepalive/housekeeping calls
+    :type misc_interval: float
+    """
+    loop = asyncio.get_running_loop()
+
+    # Callbacks also fire from publish() in output worker threads
+    def on_socket_open(client, userdata, sock):
+        loop.call_soon_threadsafe(loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(client, userdata, sock):
+        loop.call_soon_threadsafe(loop.remove_reader, sock)
+
+    def on_socket_register_write(client, userdata, sock):
+        loop.call_soon_threadsafe(loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(client, userdata, sock):
+        loop.call_soon_threadsafe(loop.remove_writer, sock)
+
+    client.on_socket_open = on_socket_open
+    client.on_socket_close = on_socket_close
+    client.on_socket_register_write = on_socket_register_write
+    client.on_socket_unregister_write = on_socket_unregister_write
+
+    # Socket was opened by connect() before the callbacks were in place
+    sock = client.socket()
+    if sock:
+        loop.add_reader(sock, client.loop_read)
+        if client.want_write():
+            loop.add_writer(sock, client.loop_write)
+
+    try:
+        while True:
+            client.loop_misc()
+            await asyncio.sleep(misc_interval)
+    finally:
+        sock = client.socket()
+        if sock:
+            loop.remove_reader(sock)
+            loop.remove_writer(sock)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles software pipeline benchmarks
+
+Times every stage between radio and outputs without a radio attached,
+using the payloads of an ahoy transaction log and synthetic payloads of
+every inverter model. Results are printed as JSON and compared against a
+stored baseline, the exit status is 1 if a stage got slower than allowed.
+
+    $ python3 -m hoymiles.benchmark
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sys
+import timeit
+from datetime import datetime
+
+import hoymiles
+from hoymiles.crc import crc_m_py
+from hoymiles.decoders import inverter_models
+from hoymiles.outputs import influx_lines
+from hoymiles.simulator import SimulatedInverter
+
+LOG_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'example-logs', 'example.log')
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'benchmark-baseline.json')
+
+DTU_SER = 99978563412
+SYNTHETIC_SERIALS = {
+        'Hm300': 112100000001,
+        'Hm600': 114100000001,
+        'Hm1200': 116100000001,
+        }
+
+def load_log(log_file):
+    """
+    Received frames of a transaction log, grouped by payload
+
+    A group ends with the end frame of a payload. Only groups holding every
+    frame of their payload exactly once are returned.
+
+    :param str log_file: log written with --log-transactions
+    :return: inverter serial, list of frame groups
+    :rtype: tuple
+    """
+    inverter_ser = None
+    groups = []
+    frames = {}
+    with open(log_file, 'r') as fh_log:
+        for line in fh_log:
+            match = re.match(r'ser# (\d+)', line)
+            if match and inverter_ser is None:
+                inverter_ser = int(match.group(1))
+                continue
+
+            match = re.search(r'Received \d+ bytes(?: on channel (\d+))?: ([0-9a-f ]+)$', line.strip())
+            if not match:
+                continue
+            frame = bytes.fromhex(match.group(2))
+            frames[frame[9] & 0x7f] = frame
+            if frame[9] > 0x80:
+                if sorted(frames) == list(range(1, (frame[9] & 0x7f) + 1)):
+                    groups.append([frames[seq_id] for seq_id in sorted(frames)])
+                frames = {}
+
+    return inverter_ser, groups
+
+def synthetic_payloads(count=20, seed=1):
+    """
+    Status payloads and frames of virtual inverters of every model
+
+    :param int count: payloads per model
+    :param int seed: random seed
+    :return: model: list of (payload, frames)
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    payloads = {}
+    for model, inverter_ser in SYNTHETIC_SERIALS.items():
+        inverter = SimulatedInverter(inverter_ser, [3, 23, 40, 61, 75], rng=rng)
+        payloads[model] = []
+        for _ in range(count):
+            payload = inverter.status_payload()
+            payloads[model].append((payload, [frame for seq, frame in inverter.fragment(payload)]))
+    return payloads
+
+def request(inverter_ser):
+    """
+    Status request frame to inverter
+
+    :param int inverter_ser: inverter serial
+    :return: ESB frame
+    :rtype: bytes
+    """
+    return next(hoymiles.compose_esb_packet(
+        hoymiles.compose_set_time_payload(1651509676),
+        seq=b'\x80', src=DTU_SER, dst=inverter_ser))
+
+def stages(log_file=LOG_FILE, seed=1):
+    """
+    Benchmark stages
+
+    :param str log_file: transaction log with example payloads
+    :param int seed: random seed of synthetic payloads
+    :return: stage name: (callable, items processed per call), None if not available
+    :rtype: dict
+    """
+    log_ser, log_groups = load_log(log_file)
+    synthetic = synthetic_payloads(seed=seed)
+
+    # (inverter serial, frame group) of every complete payload
+    transactions = [(log_ser, group) for group in log_groups]
+    for model, inverter_ser in SYNTHETIC_SERIALS.items():
+        transactions.extend((inverter_ser, frames) for payload, frames in synthetic[model])
+    requests = {inverter_ser: request(inverter_ser) for inverter_ser, group in transactions}
+
+    time_rx = datetime.now()
+    raw_frames = [frame for inverter_ser, group in transactions for frame in group]
+    parsed = [(inverter_ser, [hoymiles.InverterPacketFragment(time_rx=time_rx, payload=frame) for frame in group])
+            for inverter_ser, group in transactions]
+
+    # reassembled payloads by model
+    payloads = {model: [] for model in SYNTHETIC_SERIALS}
+    for inverter_ser, group in parsed:
+        com = hoymiles.InverterTransaction(inverter_ser=inverter_ser, dtu_ser=DTU_SER,
+                request=requests[inverter_ser], scratch=group)
+        payloads[inverter_models[str(inverter_ser)[:4]]].append((inverter_ser, bytes(com.get_payload())))
+
+    decoders = {model: [hoymiles.ResponseDecoder(payload, request=requests[inverter_ser],
+        inverter_ser=inverter_ser).decode() for inverter_ser, payload in model_payloads]
+        for model, model_payloads in payloads.items()}
+    responses = [response for model_responses in decoders.values() for response in model_responses]
+    records = [response.record for response in responses]
+
+    def compose():
+        payload = hoymiles.compose_set_time_payload(1651509676)
+        return list(hoymiles.compose_esb_packet(payload, seq=b'\x80', src=DTU_SER, dst=log_ser))
+
+    def fragment_parse():
+        for frame in raw_frames:
+            hoymiles.InverterPacketFragment(time_rx=time_rx, payload=frame)
+
+    def get_payload():
+        for inverter_ser, group in parsed:
+            com = hoymiles.InverterTransaction(inverter_ser=inverter_ser, dtu_ser=DTU_SER,
+                    request=requests[inverter_ser])
+            for frame in group:
+                com.frame_append(frame)
+            com.get_payload()
+
+    def crc(crc_m):
+        all_payloads = [payload for model_payloads in payloads.values() for inverter_ser, payload in model_payloads]
+        def crc_payloads():
+            for payload in all_payloads:
+                crc_m(payload)
+        return crc_payloads
+
+    def decode(model_payloads):
+        def decode_model():
+            for inverter_ser, payload in model_payloads:
+                hoymiles.ResponseDecoder(payload, request=requests[inverter_ser],
+                        inverter_ser=inverter_ser).decode().record
+        return decode_model
+
+    def status_dict():
+        for response in responses:
+            type(response)(response.response, inverter_ser=response.inverter_ser).__dict__()
+
+    def influx_encode():
+        for record in records:
+            influx_lines(record, 'inverter,host=benchmark')
+
+    result = {
+            'compose_esb_packet': (compose, 1),
+            'fragment_parse': (fragment_parse, len(raw_frames)),
+            'get_payload': (get_payload, len(parsed)),
+            'crc_payload': (crc(hoymiles.f_crc_m), len(parsed)),
+            'crc_payload_table': (crc(crc_m_py), len(parsed)),
+            }
+    for model, model_payloads in payloads.items():
+        result[f'decode_{model.lower()}'] = (decode(model_payloads), len(model_payloads))
+    result['status_dict'] = (status_dict, len(responses))
+    result['influx_lines'] = (influx_encode, len(records))
+    result['viewer_update'] = None
+
+    try:
+        import data_generation
+    except ModuleNotFoundError:
+        # viewer dependencies (bokeh, ...) not installed
+        return result
+
+    def viewer_update():
+        viewer = data_generation.MyData()
+        for record in records:
+            y, y0, y1 = data_generation.sample_values(record)
+            viewer.append_sample(time_rx, y, y0, y1)
+
+    result['viewer_update'] = (viewer_update, len(records))
+    return result
+
+def run(benchmarks, repeat=5, min_time=0.2):
+    """
+    Time benchmark stages
+
+    :param dict benchmarks: stages as returned by stages()
+    :param int repeat: measurements per stage, the fastest is reported
+    :param float min_time: minimum seconds per measurement
+    :return: stage name: results
+    :rtype: dict
+    """
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if benchmark is None:
+            results[name] = {'skipped': True}
+            continue
+
+        func, items = benchmark
+        timer = timeit.Timer(func)
+        number, t_total = timer.autorange()
+        number = max(1, int(number * min_time / max(t_total, 1e-9)))
+        t_best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+        results[name] = {
+                'ns_per_item': round(t_best / items * 1e9, 1),
+                'items': items,
+                'loops': number,
+                }
+    return results
+
+def regressions(results, baseline, threshold=0.25):
+    """
+    Stages slower than their baseline
+
+    :param dict results: results of run()
+    :param dict baseline: stored results of run()
+    :param float threshold: allowed slowdown (0.25: 25%)
+    :return: stage name: ratio to baseline
+    :rtype: dict
+    """
+    slower = {}
+    for name, result in results.items():
+        reference = baseline.get(name, {})
+        if 'ns_per_item' not in result or 'ns_per_item' not in reference:
+            continue
+        ratio = result['ns_per_item'] / reference['ns_per_item']
+        if ratio > 1 + threshold:
+            slower[name] = round(ratio, 3)
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description='Ahoy - software pipeline benchmarks', prog='hoymiles.benchmark')
+    parser.add_argument('--log', default=LOG_FILE,
+                        help='transaction log with example payloads')
+    parser.add_argument('--baseline', default=BASELINE_FILE,
+                        help='stored results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', default=False,
+                        help='store results as new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown per stage (default: 0.25)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measurements per stage (default: 5)')
+    parser.add_argument('--output', default=None,
+                        help='write results to file instead of stdout')
+    args = parser.parse_args()
+
+    results = run(stages(args.log), repeat=args.repeat)
+    report = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results,
+            }
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fh_baseline:
+            json.dump(report, fh_baseline, indent=2)
+            fh_baseline.write('\n')
+    else:
+        try:
+            with open(args.baseline, 'r') as fh_baseline:
+                baseline = json.load(fh_baseline)
+            report['baseline'] = args.baseline
+            report['regressions'] = regressions(results, baseline.get('results', {}), args.threshold)
+        except FileNotFoundError:
+            print(f'No baseline {args.baseline}, use --save-baseline', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as fh_output:
+            json.dump(report, fh_output, indent=2)
+            fh_output.write('\n')
+    else:
+        print(json.dumps(report, indent=2))
+
+    if report.get('regressions'):
+        for name, ratio in report['regressions'].items():
+            print(f'{name}: {ratio:.2f}x baseline', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles adaptive RX channel scheduling
+
+Inverters answer on a small and stable subset of channels. The scheduler
+keeps hit statistics per inverter and fragment sequence number, so the
+receiver can listen on the most likely channel first and hop in order of
+probability. Used with rx_scheduling: adaptive, by default the receiver
+hops in plain round-robin order.
+"""
+
+class RxChannelScheduler:
+    """ Per inverter RX channel hit statistics """
+    decay = 0.9
+
+    def __init__(self, channels):
+        """
+        :param list channels: available RX channels, default hop order
+        """
+        self.channels = list(channels)
+        self.hits = {}
+
+    def record(self, inverter_addr, seq, channel):
+        """
+        Record fragment received on channel
+
+        :param bytes inverter_addr: inverter hm address
+        :param int seq: fragment sequence number
+        :param int channel: channel fragment was received on
+        """
+        for key in [(inverter_addr, seq & 0x7f), (inverter_addr, None)]:
+            scores = self.hits.setdefault(key, {})
+            for s_channel in scores:
+                scores[s_channel] = scores[s_channel] * self.decay
+            scores[channel] = scores.get(channel, 0) + 1
+
+    def order(self, inverter_addr, seq=None):
+        """
+        Hop list for fragment seq of inverter, channels ordered by probability
+
+        Channels without statistics for seq are ranked by the inverter's
+        overall statistics, then by the default hop order. Every channel is
+        listed once, a frame is on air for a short time only and the
+        receiver has to visit all channels within.
+
+        :param inverter_addr: inverter hm address
+        :type inverter_addr: bytes or None
+        :param seq: expected fragment sequence number
+        :type seq: int or None
+        :return: hop list
+        :rtype: list
+        """
+        if inverter_addr is None:
+            return list(self.channels)
+
+        seq_scores = {}
+        if seq is not None:
+            seq_scores = self.hits.get((inverter_addr, seq & 0x7f), {})
+        inv_scores = self.hits.get((inverter_addr, None), {})
+
+        return sorted(self.channels, key=lambda channel: (
+            -seq_scores.get(channel, 0),
+            -inv_scores.get(channel, 0),
+            self.channels.index(channel)))
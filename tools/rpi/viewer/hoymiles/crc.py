@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles CRC functions
+
+CRC8 of ESB frames and Modbus CRC16 of payloads. The crcmod C extension is
+used if available, otherwise table driven pure Python implementations.
+Both take the CRC of preceding data as second argument, so a CRC can be
+updated fragment by fragment.
+"""
+
+try:
+    import crcmod
+    import crcmod._crcfunext
+except ModuleNotFoundError:
+    crcmod = None
+
+CRC_M_INIT = 0xffff
+CRC8_INIT = 0
+
+def crc_table(poly):
+    """
+    Lookup table of a reflected CRC
+
+    :param int poly: bit reversed polynomial
+    :return: CRC of every byte value
+    :rtype: tuple
+    """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ poly
+            else:
+                crc = crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+CRC_M_TABLE = crc_table(0xa001)
+CRC8_TABLE = crc_table(0x80)
+
+def crc_m_py(data, crc=CRC_M_INIT):
+    """
+    Modbus CRC16, table driven
+
+    :param bytes data: data
+    :param int crc: CRC of preceding data (default: initial value)
+    :return: CRC16
+    :rtype: int
+    """
+    table = CRC_M_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+    return crc
+
+def crc8_py(data, crc=CRC8_INIT):
+    """
+    ESB frame CRC8, table driven
+
+    :param bytes data: data
+    :param int crc: CRC of preceding data (default: initial value)
+    :return: CRC8
+    :rtype: int
+    """
+    table = CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+if crcmod:
+    f_crc_m = crcmod.predefined.mkPredefinedCrcFun('modbus')
+    f_crc8 = crcmod.mkCrcFun(0x101, initCrc=CRC8_INIT, xorOut=0)
+else:
+    f_crc_m = crc_m_py
+    f_crc8 = crc8_py
+
+def benchmark(number=20000):
+    """
+    Compare CRC implementations on payload and fragment sized data
+
+    :param int number: calls per measurement
+    :return: seconds per call by implementation and data
+    :rtype: dict
+    """
+    import timeit
+
+    implementations = {'table': (crc_m_py, crc8_py)}
+    if crcmod:
+        implementations['crcmod'] = (f_crc_m, f_crc8)
+
+    payload = bytes(range(62))
+    results = {}
+    for name, (crc_m, crc8) in implementations.items():
+        results[name] = {
+                'crc8 frame (26 B)': timeit.timeit(lambda: crc8(payload[:26]), number=number) / number,
+                'crc16 payload (62 B)': timeit.timeit(lambda: crc_m(payload), number=number) / number,
+                'crc16 end frame (14 B)': timeit.timeit(
+                    lambda: crc_m(payload[48:], 0x1234), number=number) / number,
+                }
+    return results
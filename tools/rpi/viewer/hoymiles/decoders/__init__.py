@@ -6,11 +6,16 @@ Hoymiles Micro-Inverters decoder library
 """
 
 import struct
+from collections import namedtuple
+from operator import itemgetter
 from datetime import datetime, timedelta
-import crcmod
 
-f_crc_m = crcmod.predefined.mkPredefinedCrcFun('modbus')
-f_crc8 = crcmod.mkCrcFun(0x101, initCrc=0, xorOut=0)
+try:
+    import numpy
+except ModuleNotFoundError:
+    numpy = None
+
+from ..crc import f_crc_m, f_crc8
 
 def g_unpack(s_fmt, s_buf):
     """Chunk unpack helper
@@ -86,13 +91,183 @@ class Response:
                 'inverter_name': self.inverter_name,
                 'dtu_ser': self.dtu_ser}
 
+class StatusChannel(namedtuple('StatusChannel',
+        ['voltage', 'current', 'power', 'energy_total', 'energy_daily', 'powerfactor'],
+        defaults=(None,) * 6)):
+    """
+    Immutable values of one AC phase or DC PV-string, fields not provided
+    by the inverter model are None
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        """ dict style access, e.g. phase['power'] """
+        if isinstance(key, str):
+            if key in self._fields and getattr(self, key) is not None:
+                return getattr(self, key)
+            raise KeyError(key)
+        return super().__getitem__(key)
+
+    def as_dict(self):
+        """
+        Values provided by the inverter model
+
+        :return: values by key
+        :rtype: dict
+        """
+        return {key: value for key, value in zip(self._fields, self) if value is not None}
+
+class StatusRecord(namedtuple('StatusRecord',
+        ['inverter_ser', 'inverter_name', 'dtu_ser', 'phases', 'strings',
+        'temperature', 'frequency', 'powerfactor', 'event_count', 'time'],
+        defaults=(None,) * 10)):
+    """
+    Immutable decoded status of one inverter, shared read-only by all
+    consumers of a StatusResponse
+
+    phases and strings are tuples of StatusChannel.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        """ dict style access, e.g. record['temperature'] """
+        if isinstance(key, str):
+            if key in self._fields:
+                return getattr(self, key)
+            raise KeyError(key)
+        return super().__getitem__(key)
+
+    def as_dict(self):
+        """
+        Convert to nested dict, phases and strings become lists of dicts
+
+        :return: dict of all values
+        :rtype: dict
+        """
+        data = self._asdict()
+        data['phases'] = [phase.as_dict() for phase in self.phases]
+        data['strings'] = [string.as_dict() for string in self.strings]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild record from as_dict() output, e.g. after a JSON round trip
+
+        :param dict data: as_dict() output, time may be an ISO 8601 string
+        :return: status record
+        :rtype: StatusRecord
+        """
+        data = dict(data)
+        data['phases'] = tuple(StatusChannel(**phase) for phase in data.get('phases', []))
+        data['strings'] = tuple(StatusChannel(**string) for string in data.get('strings', []))
+        if isinstance(data.get('time', None), str):
+            data['time'] = datetime.fromisoformat(data['time'])
+        return cls(**data)
+
 class StatusResponse(Response):
-    """Inverter StatusResponse object"""
+    """
+    Inverter StatusResponse object
+
+    Models describe their payload in a field table, entries are
+    (group, index, key, offset, type, scale):
+      group  'ac' (phase), 'dc' (PV-string) or None (inverter global)
+      index  phase/string number within group
+      key    value name, see e_keys
+      offset byte offset in payload
+      type   struct format character (big endian)
+      scale  raw value divisor, 1 keeps the integer
+
+    The table gets compiled into a single struct.Struct once per model,
+    every payload is unpacked in one call into a StatusRecord.
+    """
     e_keys  = ['voltage','current','power','energy_total','energy_daily','powerfactor']
-    temperature = None
-    frequency = None
-    powerfactor = None
-    event_count = None
+    fields = ()
+    _layout = None
+    _record_layout = None
+    _record = None
+
+    @classmethod
+    def compile_fields(cls):
+        """
+        Compile field table into struct and value mapping
+
+        Fields sharing offset and type are unpacked once.
+
+        :return: compiled struct, (slot, scale, group, index, key) per field
+        :rtype: tuple
+        :raises ValueError: if fields overlap
+        """
+        if '_layout' in cls.__dict__:
+            return cls._layout
+
+        slots = sorted({(offset, s_type) for _, _, _, offset, s_type, _ in cls.fields})
+        s_fmt = '>'
+        position = 0
+        for offset, s_type in slots:
+            if offset < position:
+                raise ValueError(f'{cls.__name__}: field at offset {offset} overlaps')
+            s_fmt = s_fmt + 'x' * (offset - position) + s_type
+            position = offset + struct.calcsize('>' + s_type)
+
+        mapping = [(slots.index((offset, s_type)), scale, group, index, key)
+                for group, index, key, offset, s_type, scale in cls.fields]
+
+        # StatusRecord layout, picks StatusChannel fields from the scaled
+        # values in mapping order, missing fields from the trailing None
+        missing = len(mapping)
+        channels = {'ac': [], 'dc': []}
+        scalars = []
+        for position, (_, _, group, index, key) in enumerate(mapping):
+            if group is None:
+                scalars.append((key, position))
+                continue
+            while len(channels[group]) <= index:
+                channels[group].append([missing] * len(StatusChannel._fields))
+            channels[group][index][StatusChannel._fields.index(key)] = position
+        cls._record_layout = (
+                [(slot, scale) for slot, scale, _, _, _ in mapping],
+                [itemgetter(*channel) for channel in channels['ac']],
+                [itemgetter(*channel) for channel in channels['dc']],
+                scalars)
+
+        cls._layout = (struct.Struct(s_fmt), mapping)
+        return cls._layout
+
+    @property
+    def record(self):
+        """
+        Decoded payload, created on first access and shared afterwards
+
+        :return: all fields of the model's table
+        :rtype: StatusRecord
+        """
+        if self._record is None:
+            s_struct, _ = self.compile_fields()
+            slots, ac_layout, dc_layout, scalars = self._record_layout
+            raw = s_struct.unpack_from(self.response)
+            values = [raw[slot] if scale == 1 else raw[slot] / scale for slot, scale in slots]
+            values.append(None)
+
+            self._record = StatusRecord(
+                    inverter_ser=self.inverter_ser,
+                    inverter_name=self.inverter_name,
+                    dtu_ser=self.dtu_ser,
+                    time=self.time_rx,
+                    phases=tuple(tuple.__new__(StatusChannel, layout(values)) for layout in ac_layout),
+                    strings=tuple(tuple.__new__(StatusChannel, layout(values)) for layout in dc_layout),
+                    **{key: values[position] for key, position in scalars})
+        return self._record
+
+    def __getattr__(self, name):
+        """ Field access by property name, e.g. dc_voltage_0 or ac_power_0 """
+        group, _, name_key = name.partition('_')
+        key, _, index = name_key.rpartition('_')
+        if group in ('ac', 'dc') and index.isdigit():
+            entries = self.record.phases if group == 'ac' else self.record.strings
+            if int(index) < len(entries) and getattr(entries[int(index)], key, None) is not None:
+                return getattr(entries[int(index)], key)
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
 
     def unpack(self, fmt, base):
         """
@@ -103,8 +278,7 @@ class StatusResponse(Response):
         :return: unpacked values
         :rtype: tuple
         """
-        size = struct.calcsize(fmt)
-        return struct.unpack(fmt, self.response[base:base+size])
+        return struct.unpack_from(fmt, self.response, base)
 
     @property
     def phases(self):
@@ -114,21 +288,7 @@ class StatusResponse(Response):
         :retrun: list of dict's
         :rtype: list
         """
-        phases = []
-        p_exists = True
-        while p_exists:
-            p_exists = False
-            phase_id = len(phases)
-            phase = {}
-            for key in self.e_keys:
-                prop = f'ac_{key}_{phase_id}'
-                if hasattr(self, prop):
-                    p_exists = True
-                    phase[key] = getattr(self, prop)
-            if p_exists:
-                phases.append(phase)
-
-        return phases
+        return [phase.as_dict() for phase in self.record.phases]
 
     @property
     def strings(self):
@@ -138,21 +298,27 @@ class StatusResponse(Response):
         :retrun: list of dict's
         :rtype: list
         """
-        strings = []
-        s_exists = True
-        while s_exists:
-            s_exists = False
-            string_id = len(strings)
-            string = {}
-            for key in self.e_keys:
-                prop = f'dc_{key}_{string_id}'
-                if hasattr(self, prop):
-                    s_exists = True
-                    string[key] = getattr(self, prop)
-            if s_exists:
-                strings.append(string)
-
-        return strings
+        return [string.as_dict() for string in self.record.strings]
+
+    @property
+    def temperature(self):
+        """ Inverter temperature in °C """
+        return self.record.temperature
+
+    @property
+    def frequency(self):
+        """ Grid frequency in Hertz """
+        return self.record.frequency
+
+    @property
+    def powerfactor(self):
+        """ Powerfactor """
+        return self.record.powerfactor
+
+    @property
+    def event_count(self):
+        """ Event counter """
+        return self.record.event_count
 
     def __dict__(self):
         """
@@ -161,15 +327,7 @@ class StatusResponse(Response):
         :return: dict of properties
         :rtype: dict
         """
-        data = super().__dict__()
-        data['phases'] = self.phases
-        data['strings'] = self.strings
-        data['temperature'] = self.temperature
-        data['frequency'] = self.frequency
-        data['powerfactor'] = self.powerfactor
-        data['event_count'] = self.event_count
-        data['time'] = self.time_rx
-        return data
+        return self.record.as_dict()
 
 class UnknownResponse(Response):
     """
@@ -194,8 +352,7 @@ class UnknownResponse(Response):
         :rtype: bool
         """
         # check crc
-        pcrc = struct.unpack('>B', self.response[-1:])[0]
-        return f_crc8(self.response[:-1]) == pcrc
+        return f_crc8(self.response[:-1]) == self.response[-1]
 
     def validate_crc_m(self):
         """
@@ -205,7 +362,7 @@ class UnknownResponse(Response):
         :rtype: bool
         """
         # check crc
-        pcrc = struct.unpack('>H', self.response[-2:])[0]
+        pcrc = struct.unpack_from('>H', self.response, len(self.response) - 2)[0]
         return f_crc_m(self.response[:-2]) == pcrc
 
     def unpack_table(self, *args):
@@ -213,6 +370,40 @@ class UnknownResponse(Response):
         print_table_unpack(*args)
 
 
+class EventRecord(namedtuple('EventRecord',
+        ['opcode', 'code', 'text', 'count', 'uptime', 'time', 'data'])):
+    """
+    Immutable inverter event log entry
+
+    uptime is the inverter uptime (timedelta) the event occurred at,
+    time the derived datetime and data the not yet understood trailing
+    fields of the entry.
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """
+        Identity of the event across repeated log fetches
+
+        :return: raw event fields
+        :rtype: tuple
+        """
+        return (self.opcode, self.code, self.count, int(self.uptime.total_seconds()), *self.data)
+
+    def as_dict(self):
+        """
+        Convert to JSON friendly dict
+
+        :return: event values
+        :rtype: dict
+        """
+        data = self._asdict()
+        data['uptime'] = int(self.uptime.total_seconds())
+        data['time'] = self.time.isoformat()
+        data['data'] = list(self.data)
+        return data
+
 class EventsResponse(UnknownResponse):
     """ Hoymiles micro-inverter event log decode helper """
 
@@ -289,30 +480,67 @@ class EventsResponse(UnknownResponse):
             9000: 'Microinverter is suspected of being stolen' # 0x2328
             }
 
+    event_struct = struct.Struct('>BBHHHHH')
+    _events = None
+
     def __init__(self, *args, **params):
+        """
+        :param bytes response: response payload bytes
+        :param boot_time: inverter start time, estimated from newest event if omitted
+        :type boot_time: datetime
+        """
         super().__init__(*args, **params)
 
-        crc_valid = self.validate_crc_m()
-        if crc_valid:
-            print(' payload has valid modbus crc')
+        self.boot_time = params.get('boot_time', None)
+
+        if self.validate_crc_m():
             self.response = self.response[:-2]
 
-        status = self.response[:2]
+        self.status = bytes(self.response[:2])
 
-        chunk_size = 12
-        for i_chunk in range(2, len(self.response), chunk_size):
-            chunk = self.response[i_chunk:i_chunk+chunk_size]
+    @property
+    def events(self):
+        """
+        Decoded event log entries, oldest first as sent by the inverter
 
-            print(' '.join([f'{byte:02x}' for byte in chunk]) + ': ')
+        Event times are derived from the inverter uptime. Without boot_time
+        the newest event is assumed to have happened at reception, so times
+        are upper bounds.
 
-            opcode, a_code, a_count, uptime_sec = struct.unpack('>BBHH', chunk[0:6])
-            a_text = self.alarm_codes.get(a_code, 'N/A')
+        :return: event records
+        :rtype: tuple
+        """
+        if self._events is None:
+            body = self.response[2:]
+            body = body[:len(body) - len(body) % self.event_struct.size]
+            chunks = list(self.event_struct.iter_unpack(body))
+
+            boot_time = self.boot_time
+            if boot_time is None and chunks:
+                boot_time = self.time_rx - timedelta(seconds=max(chunk[3] for chunk in chunks))
+
+            self._events = tuple(EventRecord(
+                    opcode=opcode,
+                    code=a_code,
+                    text=self.alarm_codes.get(a_code, 'N/A'),
+                    count=a_count,
+                    uptime=timedelta(seconds=uptime_sec),
+                    time=boot_time + timedelta(seconds=uptime_sec),
+                    data=tuple(data))
+                for opcode, a_code, a_count, uptime_sec, *data in chunks)
+        return self._events
 
-            print(f' uptime={timedelta(seconds=uptime_sec)} a_count={a_count} opcode={opcode} a_code={a_code} a_text={a_text}')
+    def __dict__(self):
+        """
+        Get all known data
 
-            for fmt in ['BBHHHHH']:
-                print(f' {fmt:7}: ' + str(struct.unpack('>' + fmt, chunk)))
-            print(end='', flush=True)
+        :return: dict of properties
+        :rtype: dict
+        """
+        data = super().__dict__()
+        data['events'] = [event.as_dict() for event in self.events]
+        data['time'] = self.time_rx
+        return data
 
 class DebugDecodeAny(UnknownResponse):
     """Default decoder"""
@@ -347,13 +575,13 @@ class DebugDecodeAny(UnknownResponse):
 
         try:
             if len(self.response) > 2:
-                print(' type utf-8  : ' + self.response.decode('utf-8'))
+                print(' type utf-8  : ' + bytes(self.response).decode('utf-8'))
         except UnicodeDecodeError:
             print(' type utf-8  : utf-8 decode error')
 
         try:
             if len(self.response) > 2:
-                print(' type ascii  : ' + self.response.decode('ascii'))
+                print(' type ascii  : ' + bytes(self.response).decode('ascii'))
         except UnicodeDecodeError:
             print(' type ascii  : ascii decode error')
 
@@ -364,48 +592,20 @@ class Hm300Decode02(EventsResponse):
 
 class Hm300Decode0B(StatusResponse):
     """ 1121-series mirco-inverters status data """
+    fields = (
+            # group, index, key, offset, type, scale
+            ('dc', 0, 'voltage', 2, 'H', 10),
+            ('dc', 0, 'current', 4, 'H', 100),
+            ('dc', 0, 'power', 6, 'H', 10),
+            ('dc', 0, 'energy_total', 8, 'L', 1),
+            ('dc', 0, 'energy_daily', 12, 'H', 1),
+            ('ac', 0, 'voltage', 14, 'H', 10),
+            ('ac', 0, 'current', 22, 'H', 100),
+            ('ac', 0, 'power', 18, 'H', 10),
+            (None, None, 'frequency', 16, 'H', 100),
+            (None, None, 'temperature', 26, 'H', 10),
+            )
 
-    @property
-    def dc_voltage_0(self):
-        """ String 1 VDC """
-        return self.unpack('>H', 2)[0]/10
-    @property
-    def dc_current_0(self):
-        """ String 1 ampere """
-        return self.unpack('>H', 4)[0]/100
-    @property
-    def dc_power_0(self):
-        """ String 1 watts """
-        return self.unpack('>H', 6)[0]/10
-    @property
-    def dc_energy_total_0(self):
-        """ String 1 total energy in Wh """
-        return self.unpack('>L', 8)[0]
-    @property
-    def dc_energy_daily_0(self):
-        """ String 1 daily energy in Wh """
-        return self.unpack('>H', 12)[0]
-
-    @property
-    def ac_voltage_0(self):
-        """ Phase 1 VAC """
-        return self.unpack('>H', 14)[0]/10
-    @property
-    def ac_current_0(self):
-        """ Phase 1 ampere """
-        return self.unpack('>H', 22)[0]/100
-    @property
-    def ac_power_0(self):
-        """ Phase 1 watts """
-        return self.unpack('>H', 18)[0]/10
-    @property
-    def frequency(self):
-        """ Grid frequency in Hertz """
-        return self.unpack('>H', 16)[0]/100
-    @property
-    def temperature(self):
-        """ Inverter temperature in °C """
-        return self.unpack('>H', 26)[0]/10
 
 class Hm300Decode11(EventsResponse):
     """ Inverter generic events log """
@@ -420,77 +620,27 @@ class Hm600Decode02(EventsResponse):
 
 class Hm600Decode0B(StatusResponse):
     """ 1141-series mirco-inverters status data """
+    fields = (
+            # group, index, key, offset, type, scale
+            ('dc', 0, 'voltage', 2, 'H', 10),
+            ('dc', 0, 'current', 4, 'H', 100),
+            ('dc', 0, 'power', 6, 'H', 10),
+            ('dc', 0, 'energy_total', 14, 'L', 1),
+            ('dc', 0, 'energy_daily', 22, 'H', 1),
+            ('dc', 1, 'voltage', 8, 'H', 10),
+            ('dc', 1, 'current', 10, 'H', 100),
+            ('dc', 1, 'power', 12, 'H', 10),
+            ('dc', 1, 'energy_total', 18, 'L', 1),
+            ('dc', 1, 'energy_daily', 24, 'H', 1),
+            ('ac', 0, 'voltage', 26, 'H', 10),
+            ('ac', 0, 'current', 34, 'H', 10),
+            ('ac', 0, 'power', 30, 'H', 10),
+            (None, None, 'frequency', 28, 'H', 100),
+            (None, None, 'powerfactor', 36, 'H', 1000),
+            (None, None, 'temperature', 38, 'H', 10),
+            (None, None, 'event_count', 40, 'H', 1),
+            )
 
-    @property
-    def dc_voltage_0(self):
-        """ String 1 VDC """
-        return self.unpack('>H', 2)[0]/10
-    @property
-    def dc_current_0(self):
-        """ String 1 ampere """
-        return self.unpack('>H', 4)[0]/100
-    @property
-    def dc_power_0(self):
-        """ String 1 watts """
-        return self.unpack('>H', 6)[0]/10
-    @property
-    def dc_energy_total_0(self):
-        """ String 1 total energy in Wh """
-        return self.unpack('>L', 14)[0]
-    @property
-    def dc_energy_daily_0(self):
-        """ String 1 daily energy in Wh """
-        return self.unpack('>H', 22)[0]
-
-    @property
-    def dc_voltage_1(self):
-        """ String 2 VDC """
-        return self.unpack('>H', 8)[0]/10
-    @property
-    def dc_current_1(self):
-        """ String 2 ampere """
-        return self.unpack('>H', 10)[0]/100
-    @property
-    def dc_power_1(self):
-        """ String 2 watts """
-        return self.unpack('>H', 12)[0]/10
-    @property
-    def dc_energy_total_1(self):
-        """ String 2 total energy in Wh """
-        return self.unpack('>L', 18)[0]
-    @property
-    def dc_energy_daily_1(self):
-        """ String 2 daily energy in Wh """
-        return self.unpack('>H', 24)[0]
-
-    @property
-    def ac_voltage_0(self):
-        """ Phase 1 VAC """
-        return self.unpack('>H', 26)[0]/10
-    @property
-    def ac_current_0(self):
-        """ Phase 1 ampere """
-        return self.unpack('>H', 34)[0]/10
-    @property
-    def ac_power_0(self):
-        """ Phase 1 watts """
-        return self.unpack('>H', 30)[0]/10
-    @property
-    def frequency(self):
-        """ Grid frequency in Hertz """
-        return self.unpack('>H', 28)[0]/100
-    @property
-    def powerfactor(self):
-        """ Powerfactor """
-        return self.unpack('>H', 36)[0]/1000
-    @property
-    def temperature(self):
-        """ Inverter temperature in °C """
-        return self.unpack('>H', 38)[0]/10
-    @property
-    def event_count(self):
-        """ Event counter """
-        return self.unpack('>H', 40)[0]
 
 class Hm600Decode11(EventsResponse):
     """ Inverter generic events log """
@@ -505,122 +655,246 @@ class Hm1200Decode02(EventsResponse):
 
 class Hm1200Decode0B(StatusResponse):
     """ 1161-series mirco-inverters status data """
+    fields = (
+            # group, index, key, offset, type, scale
+            ('dc', 0, 'voltage', 2, 'H', 10),
+            ('dc', 0, 'current', 4, 'H', 100),
+            ('dc', 0, 'power', 8, 'H', 10),
+            ('dc', 0, 'energy_total', 12, 'L', 1),
+            ('dc', 0, 'energy_daily', 20, 'H', 1),
+            ('dc', 1, 'voltage', 2, 'H', 10),
+            ('dc', 1, 'current', 6, 'H', 100),
+            ('dc', 1, 'power', 10, 'H', 10),
+            ('dc', 1, 'energy_total', 16, 'L', 1),
+            ('dc', 1, 'energy_daily', 22, 'H', 1),
+            ('dc', 2, 'voltage', 24, 'H', 10),
+            ('dc', 2, 'current', 26, 'H', 100),
+            ('dc', 2, 'power', 30, 'H', 10),
+            ('dc', 2, 'energy_total', 34, 'L', 1),
+            ('dc', 2, 'energy_daily', 42, 'H', 1),
+            ('dc', 3, 'voltage', 24, 'H', 10),
+            ('dc', 3, 'current', 28, 'H', 100),
+            ('dc', 3, 'power', 32, 'H', 10),
+            ('dc', 3, 'energy_total', 38, 'L', 1),
+            ('dc', 3, 'energy_daily', 44, 'H', 1),
+            ('ac', 0, 'voltage', 46, 'H', 10),
+            ('ac', 0, 'current', 54, 'H', 100),
+            ('ac', 0, 'power', 50, 'H', 10),
+            (None, None, 'frequency', 48, 'H', 100),
+            (None, None, 'powerfactor', 56, 'H', 1000),
+            (None, None, 'temperature', 58, 'H', 10),
+            (None, None, 'event_count', 60, 'H', 1),
+            )
 
-    @property
-    def dc_voltage_0(self):
-        """ String 1 VDC """
-        return self.unpack('>H', 2)[0]/10
-    @property
-    def dc_current_0(self):
-        """ String 1 ampere """
-        return self.unpack('>H', 4)[0]/100
-    @property
-    def dc_power_0(self):
-        """ String 1 watts """
-        return self.unpack('>H', 8)[0]/10
-    @property
-    def dc_energy_total_0(self):
-        """ String 1 total energy in Wh """
-        return self.unpack('>L', 12)[0]
-    @property
-    def dc_energy_daily_0(self):
-        """ String 1 daily energy in Wh """
-        return self.unpack('>H', 20)[0]
 
-    @property
-    def dc_voltage_1(self):
-        """ String 2 VDC """
-        return self.unpack('>H', 2)[0]/10
-    @property
-    def dc_current_1(self):
-        """ String 2 ampere """
-        return self.unpack('>H', 6)[0]/100
-    @property
-    def dc_power_1(self):
-        """ String 2 watts """
-        return self.unpack('>H', 10)[0]/10
-    @property
-    def dc_energy_total_1(self):
-        """ String 2 total energy in Wh """
-        return self.unpack('>L', 16)[0]
-    @property
-    def dc_energy_daily_1(self):
-        """ String 2 daily energy in Wh """
-        return self.unpack('>H', 22)[0]
+class Hm1200Decode11(EventsResponse):
+    """ Inverter generic events log """
 
-    @property
-    def dc_voltage_2(self):
-        """ String 3 VDC """
-        return self.unpack('>H', 24)[0]/10
-    @property
-    def dc_current_2(self):
-        """ String 3 ampere """
-        return self.unpack('>H', 26)[0]/100
-    @property
-    def dc_power_2(self):
-        """ String 3 watts """
-        return self.unpack('>H', 30)[0]/10
-    @property
-    def dc_energy_total_2(self):
-        """ String 3 total energy in Wh """
-        return self.unpack('>L', 34)[0]
-    @property
-    def dc_energy_daily_2(self):
-        """ String 3 daily energy in Wh """
-        return self.unpack('>H', 42)[0]
+class Hm1200Decode12(EventsResponse):
+    """ Inverter major events log """
 
-    @property
-    def dc_voltage_3(self):
-        """ String 4 VDC """
-        return self.unpack('>H', 24)[0]/10
-    @property
-    def dc_current_3(self):
-        """ String 4 ampere """
-        return self.unpack('>H', 28)[0]/100
-    @property
-    def dc_power_3(self):
-        """ String 4 watts """
-        return self.unpack('>H', 32)[0]/10
-    @property
-    def dc_energy_total_3(self):
-        """ String 4 total energy in Wh """
-        return self.unpack('>L', 38)[0]
-    @property
-    def dc_energy_daily_3(self):
-        """ String 4 daily energy in Wh """
-        return self.unpack('>H', 44)[0]
 
-    @property
-    def ac_voltage_0(self):
-        """ Phase 1 VAC """
-        return self.unpack('>H', 46)[0]/10
-    @property
-    def ac_current_0(self):
-        """ Phase 1 ampere """
-        return self.unpack('>H', 54)[0]/100
-    @property
-    def ac_power_0(self):
-        """ Phase 1 watts """
-        return self.unpack('>H', 50)[0]/10
-    @property
-    def frequency(self):
-        """ Grid frequency in Hertz """
-        return self.unpack('>H', 48)[0]/100
-    @property
-    def powerfactor(self):
-        """ Powerfactor """
-        return self.unpack('>H', 56)[0]/1000
-    @property
-    def temperature(self):
-        """ Inverter temperature in °C """
-        return self.unpack('>H', 58)[0]/10
-    @property
-    def event_count(self):
-        """ Event counter """
-        return self.unpack('>H', 60)[0]
+# Inverter models by serial prefix
+inverter_models = {
+        '1121': 'Hm300',
+        '1141': 'Hm600',
+        '1161': 'Hm1200',
+        }
+
+# Decoders by (serial prefix, request command)
+decoder_registry = {
+        ('1121', 0x02): Hm300Decode02,
+        ('1121', 0x0b): Hm300Decode0B,
+        ('1121', 0x11): Hm300Decode11,
+        ('1121', 0x12): Hm300Decode12,
+        ('1141', 0x02): Hm600Decode02,
+        ('1141', 0x0b): Hm600Decode0B,
+        ('1141', 0x11): Hm600Decode11,
+        ('1141', 0x12): Hm600Decode12,
+        ('1161', 0x02): Hm1200Decode02,
+        ('1161', 0x0b): Hm1200Decode0B,
+        ('1161', 0x11): Hm1200Decode11,
+        ('1161', 0x12): Hm1200Decode12,
+        }
+
+_serial_decoders = {}
+
+def register_decoder(ser_prefix, command, decoder, model=None):
+    """
+    Add or replace decoder for an inverter model
 
-class Hm1200Decode11(EventsResponse):
-    """ Inverter generic events log """
+    :param str ser_prefix: first 4 digits of inverter serial
+    :param int command: request command byte
+    :param type decoder: Response subclass
+    :param model: model name for new serial prefixes
+    :type model: str
+    """
+    if model:
+        inverter_models[ser_prefix] = model
+    decoder_registry[(ser_prefix, command)] = decoder
+    _serial_decoders.clear()
 
-class Hm1200Decode12(EventsResponse):
-    """ Inverter major events log """
\ No newline at end of file
+def serial_decoders(inverter_ser):
+    """
+    Decoders for an inverter serial, resolved once per serial
+
+    :param str inverter_ser: inverter serial
+    :return: decoder class by request command
+    :rtype: dict
+    :raises ValueError: on invalid inverter serial
+    :raises NotImplementedError: if inverter model is unknown
+    """
+    ser_str = str(inverter_ser)
+    if ser_str in _serial_decoders:
+        return _serial_decoders[ser_str]
+
+    if not inverter_ser or len(ser_str) < 12:
+        raise ValueError(f'Invalid inverter serial {inverter_ser!r} while decoding response')
+
+    ser_prefix = ser_str[:4]
+    if ser_prefix not in inverter_models:
+        raise NotImplementedError(f'Model lookup failed for serial {ser_str}, ' \
+                f'known serial prefixes: {", ".join(inverter_models)}')
+
+    _serial_decoders[ser_str] = {command: decoder
+            for (d_prefix, command), decoder in decoder_registry.items()
+            if d_prefix == ser_prefix}
+    return _serial_decoders[ser_str]
+
+def _bulk_buffer(decoder, payloads, record_size):
+    """
+    Join payloads into one buffer of fixed size records
+
+    :param type decoder: StatusResponse subclass
+    :param payloads: list of payloads, bytes-like buffer or binary file
+    :param record_size: bytes per record in buffer/file
+    :type record_size: int
+    :return: buffer, record size
+    :rtype: tuple
+    :raises ValueError: if payloads are too short for the model
+    """
+    s_struct, _ = decoder.compile_fields()
+    if hasattr(payloads, 'read'):
+        payloads = payloads.read()
+
+    if isinstance(payloads, (bytes, bytearray, memoryview)):
+        if not record_size:
+            record_size = s_struct.size
+        if record_size < s_struct.size or len(payloads) % record_size:
+            raise ValueError(f'Buffer of {len(payloads)} bytes does not hold ' \
+                    f'{record_size} byte {decoder.__name__} records')
+        return payloads, record_size
+
+    record_size = s_struct.size
+    for payload in payloads:
+        if len(payload) < record_size:
+            raise ValueError(f'Payload of {len(payload)} bytes too short for {decoder.__name__}')
+    return b''.join(payload[:record_size] for payload in payloads), record_size
+
+def _bulk_decoder(decoder):
+    """
+    Status decoder for bulk decoding
+
+    :param decoder: StatusResponse subclass or inverter serial
+    :return: StatusResponse subclass
+    :rtype: type
+    """
+    if isinstance(decoder, type):
+        return decoder
+    return serial_decoders(decoder)[0x0b]
+
+def _bulk_fields(decoder, buffer, record_size):
+    """
+    Raw field views on a buffer of status records
+
+    :param type decoder: StatusResponse subclass
+    :param bytes buffer: fixed size records
+    :param int record_size: bytes per record
+    :return: (name, raw values, scale) per field
+    :rtype: list
+    """
+    raw_fields = {}
+    for _, _, _, offset, s_type, _ in decoder.fields:
+        kind = 'f' if s_type in 'efd' else ('i' if s_type.islower() else 'u')
+        raw_fields[(offset, s_type)] = f'>{kind}{struct.calcsize(">" + s_type)}'
+    raw = numpy.frombuffer(buffer, dtype=numpy.dtype({
+        'names': [f'o{offset}{s_type}' for offset, s_type in raw_fields],
+        'formats': list(raw_fields.values()),
+        'offsets': [offset for offset, _ in raw_fields],
+        'itemsize': record_size}))
+
+    return [(key if group is None else f'{group}_{key}_{index}', raw[f'o{offset}{s_type}'], scale)
+            for group, index, key, offset, s_type, scale in decoder.fields]
+
+def decode_status_columns(decoder, payloads, record_size=None):
+    """
+    Decode many status payloads of one model at once
+
+    Columns are named like the decoder attributes (dc_voltage_0,
+    ac_power_0, frequency, ...) and scaled exactly like StatusResponse.
+    Columns are numpy arrays if numpy is available, lists otherwise.
+
+    :param decoder: StatusResponse subclass (e.g. Hm600Decode0B) or inverter serial
+    :param payloads: list of payloads, concatenated records or binary file
+    :param record_size: bytes per record in a buffer/file (default: model struct size)
+    :type record_size: int
+    :return: values by column name
+    :rtype: dict
+    """
+    decoder = _bulk_decoder(decoder)
+    buffer, record_size = _bulk_buffer(decoder, payloads, record_size)
+
+    columns = {}
+    if numpy is not None:
+        for name, values, scale in _bulk_fields(decoder, buffer, record_size):
+            if scale == 1:
+                columns[name] = values.astype(values.dtype.newbyteorder('='))
+            else:
+                columns[name] = numpy.divide(values, scale, dtype=numpy.float64)
+        return columns
+
+    s_struct, mapping = decoder.compile_fields()
+    s_struct = struct.Struct(s_struct.format + 'x' * (record_size - s_struct.size))
+    rows = list(s_struct.iter_unpack(buffer))
+
+    for slot, scale, group, index, key in mapping:
+        name = key if group is None else f'{group}_{key}_{index}'
+        if scale == 1:
+            columns[name] = [row[slot] for row in rows]
+        else:
+            columns[name] = [row[slot] / scale for row in rows]
+    return columns
+
+def decode_status_array(decoder, payloads, record_size=None):
+    """
+    Decode many status payloads of one model at once into a big-endian
+    numpy structured array, one record per payload
+
+    Fields are named like the decoder attributes and scaled exactly like
+    StatusResponse: scaled values are float64, unscaled values keep their
+    integer type.
+
+    :param decoder: StatusResponse subclass (e.g. Hm600Decode0B) or inverter serial
+    :param payloads: list of payloads, concatenated records or binary file
+    :param record_size: bytes per record in a buffer/file (default: model struct size)
+    :type record_size: int
+    :return: decoded records
+    :rtype: numpy.ndarray
+    :raises ModuleNotFoundError: if numpy is not installed
+    """
+    if numpy is None:
+        raise ModuleNotFoundError('Bulk decoding into arrays requires numpy')
+
+    decoder = _bulk_decoder(decoder)
+    buffer, record_size = _bulk_buffer(decoder, payloads, record_size)
+    fields = _bulk_fields(decoder, buffer, record_size)
+
+    array = numpy.empty(len(buffer) // record_size, dtype=numpy.dtype({
+        'names': [name for name, _, _ in fields],
+        'formats': [values.dtype if scale == 1 else '>f8' for _, values, scale in fields]}))
+    for name, values, scale in fields:
+        if scale == 1:
+            array[name] = values
+        else:
+            numpy.divide(values, scale, out=array[name], dtype=numpy.float64)
+    return array
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles inverter event store
+
+Inverters return their whole event log on every fetch. The store keeps
+the events seen per inverter on disk, so only new events get written out
+and published.
+"""
+
+import os
+import json
+
+class EventStore:
+    """ Per inverter JSON lines files of seen events """
+    max_events = 1000
+
+    def __init__(self, directory):
+        """
+        :param str directory: directory for the per inverter event files
+        """
+        self.directory = directory
+        self.seen = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, inverter_ser):
+        """
+        Event file of inverter
+
+        :param str inverter_ser: inverter serial
+        :return: file path
+        :rtype: str
+        """
+        return os.path.join(self.directory, f'{inverter_ser}.jsonl')
+
+    def keys(self, inverter_ser):
+        """
+        Keys of stored events, read from disk on first use
+
+        :param str inverter_ser: inverter serial
+        :return: event keys, oldest first
+        :rtype: dict
+        """
+        inverter_ser = str(inverter_ser)
+        if inverter_ser not in self.seen:
+            keys = {}
+            try:
+                with open(self.path(inverter_ser), 'r') as fh_events:
+                    for line in fh_events:
+                        try:
+                            keys[tuple(json.loads(line)['key'])] = None
+                        except (ValueError, KeyError):
+                            continue
+            except FileNotFoundError:
+                pass
+            self.seen[inverter_ser] = keys
+        return self.seen[inverter_ser]
+
+    def add(self, inverter_ser, events):
+        """
+        Store events not seen before
+
+        :param str inverter_ser: inverter serial
+        :param list events: hoymiles.decoders.EventRecord objects of one fetch
+        :return: new events
+        :rtype: list
+        """
+        keys = self.keys(inverter_ser)
+
+        new_events = []
+        for event in events:
+            if event.key in keys:
+                continue
+            keys[event.key] = None
+            new_events.append(event)
+
+        if new_events:
+            with open(self.path(inverter_ser), 'a') as fh_events:
+                for event in new_events:
+                    fh_events.write(json.dumps(dict(event.as_dict(), key=list(event.key))) + '\n')
+
+            if len(keys) > 2 * self.max_events:
+                self.compact(inverter_ser)
+
+        return new_events
+
+    def compact(self, inverter_ser):
+        """
+        Keep only the newest max_events events of inverter
+
+        :param str inverter_ser: inverter serial
+        """
+        inverter_ser = str(inverter_ser)
+        with open(self.path(inverter_ser), 'r') as fh_events:
+            lines = fh_events.readlines()[-self.max_events:]
+
+        tmp_path = self.path(inverter_ser) + '.tmp'
+        with open(tmp_path, 'w') as fh_events:
+            fh_events.writelines(lines)
+        os.replace(tmp_path, self.path(inverter_ser))
+
+        keys = self.keys(inverter_ser)
+        self.seen[inverter_ser] = dict.fromkeys(list(keys)[-self.max_events:])
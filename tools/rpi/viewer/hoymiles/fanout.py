@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles output fan-out
+
+The poll loop hands decoded results to a bounded queue and goes on. A
+fan-out thread passes every result to the worker of each registered
+output plugin, workers call their plugin from their own thread. A slow
+output only fills its own queue, the oldest (or newest) entries are
+dropped by its drop policy. Spool replays are submitted to the worker of
+their plugin, so a plugin is only ever called from its worker thread.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from .metrics import RollingHistogram
+
+class OutputWorker:
+    """ Calls one output plugin from a worker thread """
+    queue_size = 1000
+    drop_policy = 'drop-oldest'
+
+    def __init__(self, name, plugin, **params):
+        """
+        :param str name: plugin name, also the inverter config section holding
+            call parameters of this plugin
+        :param plugin: output plugin
+        :type plugin: hoymiles.outputs.OutputPluginFactory
+        :param queue_size: queued calls at most (default: 1000)
+        :type queue_size: int
+        :param drop_policy: 'drop-oldest', 'drop-newest' or 'block' the fan-out
+            while the queue is full (default: drop-oldest)
+        :type drop_policy: str
+        :raises ValueError: on unknown drop policy
+        """
+        self.name = name
+        self.plugin = plugin
+        self.queue_size = params.get('queue_size', self.queue_size)
+        self.drop_policy = params.get('drop_policy', self.drop_policy)
+        if self.drop_policy not in ['drop-oldest', 'drop-newest', 'block']:
+            raise ValueError(f'Unknown drop policy {self.drop_policy}')
+
+        self.calls = deque()
+        self.busy = False
+        self.closing = False
+        self.cond = threading.Condition()
+
+        self.handled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.wait = RollingHistogram()
+        self.latency = RollingHistogram()
+
+        self.worker = threading.Thread(target=self.run, name=f'output-{name}', daemon=True)
+        self.worker.start()
+
+    def put(self, call):
+        """
+        Queue call
+
+        :param tuple call: method name, arguments, inverter config section, time queued,
+            future of the result or None
+        :return: if the call was queued
+        :rtype: bool
+        """
+        with self.cond:
+            if len(self.calls) >= self.queue_size:
+                if self.drop_policy == 'block':
+                    self.cond.wait_for(lambda: len(self.calls) < self.queue_size or self.closing)
+                elif self.drop_policy == 'drop-oldest':
+                    future = self.calls.popleft()[4]
+                    if future:
+                        future.set_exception(queue.Full(f'Output {self.name}: call dropped'))
+                    self.dropped = self.dropped + 1
+                else:
+                    self.dropped = self.dropped + 1
+                    return False
+            if self.closing:
+                return False
+            self.calls.append(call)
+            self.cond.notify_all()
+            return True
+
+    def submit(self, method, *args):
+        """
+        Queue call and return its result, subject to queue size and drop policy
+
+        :param str method: plugin method, e.g. send_status
+        :param args: method arguments
+        :return: future of the call's result, fails with queue.Full if the
+            call is dropped
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        if not self.put((method, args, None, time.monotonic(), future)):
+            future.set_exception(queue.Full(f'Output {self.name}: call dropped'))
+        return future
+
+    def run(self):
+        """ Worker: call plugin in queue order """
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.calls or self.closing)
+                if not self.calls:
+                    return
+                method, args, inverter, t_queued, future = self.calls.popleft()
+                self.busy = True
+                self.cond.notify_all()
+
+            params = inverter.get(self.name, {}) if inverter else {}
+            t_start = time.monotonic()
+            self.wait.add(t_start - t_queued)
+            try:
+                result = getattr(self.plugin, method)(*args, **params)
+                self.handled = self.handled + 1
+                if future:
+                    future.set_result(result)
+            except NotImplementedError as e_output:
+                # Plugin does not store this kind of data
+                if future:
+                    future.set_exception(e_output)
+            except Exception as e_output:
+                self.failed = self.failed + 1
+                if future:
+                    # Submitter handles the failure, e.g. keeps records spooled
+                    future.set_exception(e_output)
+                else:
+                    print(f'Output {self.name}: {method} failed: {e_output}')
+            self.latency.add(time.monotonic() - t_start)
+
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+
+    def close(self, timeout=30):
+        """
+        Handle queued calls and stop worker
+
+        :param float timeout: seconds to wait at most
+        :return: if the worker stopped
+        :rtype: bool
+        """
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.worker.join(timeout)
+        return not self.worker.is_alive()
+
+    def stats(self):
+        """
+        Queue statistics
+
+        :return: depth, handled, dropped and failed calls, queue wait and call latency summaries
+        :rtype: dict
+        """
+        with self.cond:
+            depth = len(self.calls) + self.busy
+        return {
+                'depth': depth,
+                'handled': self.handled,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'wait': self.wait.as_dict(),
+                'latency': self.latency.as_dict(),
+                }
+
+class OutputFanout:
+    """ Bounded queue of output calls, handed to the worker of every plugin """
+    queue_size = 1000
+
+    def __init__(self, **params):
+        """
+        :param queue_size: queued calls at most, further calls are dropped (default: 1000)
+        :type queue_size: int
+        """
+        self.queue_size = params.get('queue_size', self.queue_size)
+        self.queue = queue.Queue(self.queue_size)
+        self.workers = {}
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self.run, name='output-fanout', daemon=True)
+        self.thread.start()
+
+    def register(self, name, plugin, **params):
+        """
+        Add output plugin, it gets its own worker
+
+        :param str name: plugin name
+        :param plugin: output plugin
+        :type plugin: hoymiles.outputs.OutputPluginFactory
+        :param params: worker parameters (queue_size, drop_policy), see OutputWorker
+        :return: worker of plugin
+        :rtype: OutputWorker
+        """
+        worker = OutputWorker(name, plugin, **params)
+        self.workers = dict(self.workers, **{name: worker})
+        return worker
+
+    def publish(self, method, *args, inverter=None):
+        """
+        Queue plugin call, never blocks
+
+        :param str method: plugin method, e.g. store_status
+        :param args: method arguments
+        :param inverter: inverter config section, the section named like a
+            plugin holds its call parameters (e.g. mqtt: topic)
+        :type inverter: dict
+        :return: if the call was queued
+        :rtype: bool
+        """
+        try:
+            self.queue.put_nowait((method, args, inverter, time.monotonic(), None))
+            return True
+        except queue.Full:
+            self.dropped = self.dropped + 1
+            return False
+
+    def run(self):
+        """ Fan-out thread: hand every call to all workers """
+        while True:
+            call = self.queue.get()
+            if call is None:
+                return
+            for worker in self.workers.values():
+                worker.put(call)
+
+    def close(self, timeout=30):
+        """
+        Handle queued calls, stop workers and close plugins
+
+        :param float timeout: seconds to wait per worker at most
+        """
+        self.queue.put(None)
+        self.thread.join(timeout)
+        for worker in self.workers.values():
+            worker.close(timeout)
+            if hasattr(worker.plugin, 'close'):
+                worker.plugin.close()
+
+    def stats(self):
+        """
+        Fan-out queue statistics
+
+        :return: depth and dropped calls
+        :rtype: dict
+        """
+        return {
+                'depth': self.queue.qsize(),
+                'dropped': self.dropped,
+                }
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles NRF24 receive wait primitives
+
+HoymilesNRF.receive() calls wait() whenever the RX fifo was found empty.
+Polling waits a fixed interval, interrupt driven waits return as soon as
+the nRF24 IRQ line signals a received payload.
+"""
+
+import threading
+import time
+
+try:
+    import RPi.GPIO as GPIO
+except ModuleNotFoundError:
+    GPIO = None
+
+class RxWaitPolling:
+    """ Wait a fixed interval, caller has to poll the radio afterwards """
+    irq = False
+
+    def wait(self, timeout):
+        """
+        Sleep for timeout seconds
+
+        :param float timeout: seconds to wait
+        :return: always True, radio must be polled
+        :rtype: bool
+        """
+        time.sleep(timeout)
+        return True
+
+class RxWaitGpio:
+    """ Wait on falling edge of the nRF24 IRQ line """
+    irq = True
+
+    def __init__(self, irq_pin):
+        """
+        :param int irq_pin: GPIO (BCM numbering) the nRF24 IRQ pin is connected to
+        :raises RuntimeError: if RPi.GPIO is not available
+        """
+        if not GPIO:
+            raise RuntimeError('RPi.GPIO not installed, required for irq_pin')
+        self.irq_pin = irq_pin
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(irq_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+    def wait(self, timeout):
+        """
+        Wait until IRQ gets asserted
+
+        :param float timeout: seconds to wait
+        :return: if IRQ is asserted
+        :rtype: bool
+        """
+        # IRQ is active low, catch payloads that arrived before we got here
+        if GPIO.input(self.irq_pin) == GPIO.LOW:
+            return True
+        return GPIO.wait_for_edge(self.irq_pin, GPIO.FALLING,
+                timeout=max(1, int(timeout * 1000))) is not None
+
+class RxWaitEvent:
+    """ Software triggered IRQ line, e.g. for tests """
+    irq = True
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def trigger(self):
+        """ Assert IRQ """
+        self.event.set()
+
+    def wait(self, timeout):
+        """
+        Wait until trigger() gets called
+
+        :param float timeout: seconds to wait
+        :return: if IRQ was asserted
+        :rtype: bool
+        """
+        asserted = self.event.wait(timeout)
+        self.event.clear()
+        return asserted
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles allocation meter
+
+Measures Python heap allocations of poll cycles using tracemalloc. Tracing
+slows down the interpreter, so it is only enabled on request.
+"""
+
+import tracemalloc
+
+class AllocationMeter:
+    """ Heap allocation counters of poll cycles """
+    cycles = 0
+    polls = 0
+    peak_total = 0
+    retained_total = 0
+
+    def __init__(self, frames=1):
+        """
+        :param int frames: traceback frames stored per allocation
+        """
+        self.base = 0
+        tracemalloc.start(frames)
+
+    def start(self):
+        """
+        Start measuring a poll cycle
+        """
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+
+    def stop(self, polls):
+        """
+        Finish measuring a poll cycle
+
+        Peak is the highest heap usage above the start of the cycle (transient
+        buffers, decoded values, outputs), retained is what is still allocated
+        at the end of the cycle.
+
+        :param int polls: inverters polled in cycle
+        :return: peak bytes, retained bytes
+        :rtype: tuple
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        peak = peak - self.base
+        retained = current - self.base
+
+        self.cycles = self.cycles + 1
+        self.polls = self.polls + polls
+        self.peak_total = self.peak_total + peak
+        self.retained_total = self.retained_total + retained
+        return peak, retained
+
+    def summary(self):
+        """
+        Averages of all measured cycles
+
+        :return: human readable summary
+        :rtype: str
+        """
+        if not self.polls:
+            return 'no polls measured'
+        return f'{self.peak_total / self.cycles:.0f} B peak per cycle, ' \
+               f'{self.peak_total / self.polls:.0f} B peak per poll, ' \
+               f'{self.retained_total / self.polls:+.0f} B retained per poll ' \
+               f'({self.polls} polls in {self.cycles} cycles)'
+
+    def close(self):
+        """
+        Stop tracing
+        """
+        tracemalloc.stop()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles poll instrumentation
+
+Stage timings (monotonic clock) and event counters per inverter, kept in
+memory as rolling windows. Instrumented code checks
+hoymiles.HOYMILES_METRICS first, so nothing is recorded and almost no time
+is spent while it is None.
+"""
+
+import time
+from collections import deque
+
+class RollingHistogram:
+    """ The most recent samples of a value """
+
+    def __init__(self, size=256):
+        """
+        :param int size: samples kept
+        """
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        """
+        Add sample
+
+        :param float value: sample
+        """
+        self.samples.append(value)
+        self.count = self.count + 1
+        self.total = self.total + value
+
+    def percentile(self, percent):
+        """
+        Percentile of the kept samples
+
+        :param float percent: percentile (0 - 100)
+        :return: sample value, None without samples
+        :rtype: float
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    def as_dict(self):
+        """
+        Summary of the kept samples
+
+        :return: count (all time), mean, p50, p90 and max of the window
+        :rtype: dict
+        """
+        if not self.samples:
+            return {'count': self.count}
+        return {
+                'count': self.count,
+                'mean': sum(self.samples) / len(self.samples),
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'max': max(self.samples),
+                }
+
+class PollMetrics:
+    """ Stage timings and counters per inverter """
+    window = 256
+
+    def __init__(self, window=None):
+        """
+        :param window: samples kept per stage and inverter (default: 256)
+        :type window: int
+        """
+        if window:
+            self.window = window
+        self.timings = {}
+        self.counters = {}
+        self.t_start = time.monotonic()
+
+    def observe(self, inverter_ser, stage, seconds):
+        """
+        Record duration of a stage
+
+        :param inverter_ser: inverter serial
+        :type inverter_ser: str or int
+        :param str stage: stage name
+        :param float seconds: duration
+        """
+        timings = self.timings.setdefault(str(inverter_ser), {})
+        histogram = timings.get(stage, None)
+        if histogram is None:
+            histogram = timings.setdefault(stage, RollingHistogram(self.window))
+        histogram.add(seconds)
+
+    def count(self, inverter_ser, counter, value=1):
+        """
+        Increment counter
+
+        :param inverter_ser: inverter serial
+        :type inverter_ser: str or int
+        :param str counter: counter name
+        :param int value: increment
+        """
+        counters = self.counters.setdefault(str(inverter_ser), {})
+        counters[counter] = counters.get(counter, 0) + value
+
+    def inverter(self, inverter_ser):
+        """
+        Counters and stage summaries of inverter, e.g. for outputs
+
+        :param inverter_ser: inverter serial
+        :type inverter_ser: str or int
+        :return: {'counters': {...}, 'stages': {stage: summary}}
+        :rtype: dict
+        """
+        inverter_ser = str(inverter_ser)
+        return {
+                'counters': dict(self.counters.get(inverter_ser, {})),
+                'stages': {stage: histogram.as_dict()
+                    for stage, histogram in self.timings.get(inverter_ser, {}).items()},
+                }
+
+    def summary(self):
+        """
+        One line per inverter: counters, then mean/p90 milliseconds per stage
+
+        :return: summary lines
+        :rtype: list
+        """
+        lines = []
+        for inverter_ser in sorted(set(self.counters) | set(self.timings)):
+            counters = self.counters.get(inverter_ser, {})
+            fields = [f'{counter}={value}' for counter, value in sorted(counters.items())]
+            for stage, histogram in self.timings.get(inverter_ser, {}).items():
+                if histogram.samples:
+                    mean = sum(histogram.samples) / len(histogram.samples)
+                    fields.append(f'{stage}={mean * 1e3:.1f}/{histogram.percentile(90) * 1e3:.1f}ms')
+            lines.append(f'{inverter_ser}: ' + ' '.join(fields))
+        return lines
@@ -6,13 +6,224 @@ Hoymiles output plugin library
 """
 
 import socket
+import json
+import threading
+import time
 from datetime import datetime, timezone
-from hoymiles.decoders import StatusResponse
+from hoymiles.decoders import StatusResponse, StatusRecord
+from hoymiles.writer import BatchWriter
+
+def status_record(response):
+    """
+    Shared status record of a response
+
+    :param response: StatusResponse object or its record
+    :type response: hoymiles.decoders.StatusResponse or hoymiles.decoders.StatusRecord
+    :return: status record
+    :rtype: hoymiles.decoders.StatusRecord
+    :raises ValueError: when response is not instance of StatusResponse
+    """
+    if isinstance(response, StatusResponse):
+        return response.record
+    if isinstance(response, StatusRecord):
+        return response
+    raise ValueError('Data needs to be instance of StatusResponse')
+
+def influx_lines(data, measurement):
+    """
+    Encode status record as InfluxDB line protocol
+
+    :param hoymiles.decoders.StatusRecord data: status record
+    :param str measurement: measurement-prefix, tags may be appended
+    :return: lines
+    :rtype: list
+    """
+    measurement = measurement + f',location={data.inverter_ser}'
+
+    data_stack = []
+
+    time_rx = datetime.now()
+    if isinstance(data.time, datetime):
+        time_rx = data.time
+
+    # InfluxDB uses UTC
+    utctime = datetime.fromtimestamp(time_rx.timestamp(), tz=timezone.utc)
+
+    # InfluxDB requires nanoseconds
+    ctime = int(utctime.timestamp() * 1e9)
+
+    # AC Data
+    phase_id = 0
+    for phase in data.phases:
+        data_stack.append(f'{measurement},phase={phase_id},type=power value={phase.power} {ctime}')
+        data_stack.append(f'{measurement},phase={phase_id},type=voltage value={phase.voltage} {ctime}')
+        data_stack.append(f'{measurement},phase={phase_id},type=current value={phase.current} {ctime}')
+        phase_id = phase_id + 1
+
+    # DC Data
+    string_id = 0
+    for string in data.strings:
+        data_stack.append(f'{measurement},string={string_id},type=total value={string.energy_total/1000:.4f} {ctime}')
+        data_stack.append(f'{measurement},string={string_id},type=power value={string.power:.2f} {ctime}')
+        data_stack.append(f'{measurement},string={string_id},type=voltage value={string.voltage:.3f} {ctime}')
+        data_stack.append(f'{measurement},string={string_id},type=current value={string.current:3f} {ctime}')
+        string_id = string_id + 1
+    # Global
+    if data.event_count is not None:
+        data_stack.append(f'{measurement},type=total_events value={data.event_count} {ctime}')
+    if data.powerfactor is not None:
+        data_stack.append(f'{measurement},type=pf value={data.powerfactor:f} {ctime}')
+    data_stack.append(f'{measurement},type=frequency value={data.frequency:.3f} {ctime}')
+    data_stack.append(f'{measurement},type=temperature value={data.temperature:.2f} {ctime}')
+
+    return data_stack
+
+def mqtt_values(data):
+    """
+    Values of status record as published to MQTT topics
+
+    :param hoymiles.decoders.StatusRecord data: status record
+    :return: (subtopic, value) pairs, e.g. ('emeter/0/power', 52.3)
+    :rtype: list
+    """
+    values = []
+
+    # AC Data
+    phase_id = 0
+    for phase in data.phases:
+        values.append((f'emeter/{phase_id}/power', phase.power))
+        values.append((f'emeter/{phase_id}/voltage', phase.voltage))
+        values.append((f'emeter/{phase_id}/current', phase.current))
+        phase_id = phase_id + 1
+
+    # DC Data
+    string_id = 0
+    for string in data.strings:
+        values.append((f'emeter-dc/{string_id}/total', string.energy_total / 1000))
+        values.append((f'emeter-dc/{string_id}/power', string.power))
+        values.append((f'emeter-dc/{string_id}/voltage', string.voltage))
+        values.append((f'emeter-dc/{string_id}/current', string.current))
+        string_id = string_id + 1
+    # Global
+    if data.powerfactor is not None:
+        values.append(('pf', data.powerfactor))
+    values.append(('frequency', data.frequency))
+    values.append(('temperature', data.temperature))
+
+    return values
+
+def mqtt_document(data, values=None):
+    """
+    Status record as one JSON document, laid out like the topics, e.g.
+    {"emeter": [{"power": 52.3, ...}], "emeter-dc": [...], "frequency": 50.0, ...}
+
+    :param hoymiles.decoders.StatusRecord data: status record
+    :param values: mqtt_values() result, computed if not given
+    :type values: list
+    :return: JSON document
+    :rtype: str
+    """
+    if values is None:
+        values = mqtt_values(data)
+
+    document = {}
+    if isinstance(data.time, datetime):
+        document['time'] = data.time.isoformat()
+    for subtopic, value in values:
+        group, _, key = subtopic.rpartition('/')
+        if group:
+            name, index = group.split('/')
+            channels = document.setdefault(name, [])
+            if int(index) == len(channels):
+                channels.append({})
+            channels[int(index)][key] = value
+        else:
+            document[key] = value
+
+    return json.dumps(document, separators=(',', ':'))
+
+class MqttStatusPublisher:
+    """ Publishes status records as topics or JSON document, optionally only changes """
+    format = 'topics'
+    changes_only = False
+    deadband = 0
+    refresh_interval = 300
 
-try:
-    from influxdb_client import InfluxDBClient
-except ModuleNotFoundError:
-    pass
+    def __init__(self, **params):
+        """
+        :param format: 'topics' (one message per value) or 'json' (one document
+            per status to {topic}/status) (default: topics)
+        :type format: str
+        :param changes_only: publish values (topics) or documents (json) only if
+            a value changed by more than its deadband (default: False)
+        :type changes_only: bool
+        :param deadband: change ignored by changes_only, either for all values or
+            by value name, e.g. {'power': 1, 'voltage': 0.5} (default: 0)
+        :type deadband: float or dict
+        :param refresh_interval: seconds after which unchanged values are published
+            anyway (default: 300)
+        :type refresh_interval: float
+        :raises ValueError: on unknown format
+        """
+        self.format = params.get('format', self.format)
+        self.changes_only = params.get('changes_only', self.changes_only)
+        self.deadband = params.get('deadband', self.deadband)
+        self.refresh_interval = params.get('refresh_interval', self.refresh_interval)
+        if self.format not in ['topics', 'json']:
+            raise ValueError(f'Unknown mqtt format {self.format}')
+
+        self.published = {}
+
+    def changed(self, topic, value, now):
+        """
+        Check if value is to be published
+
+        :param str topic: value topic
+        :param float value: value
+        :param float now: monotonic time
+        :return: if value changed beyond its deadband or refresh is due
+        :rtype: bool
+        """
+        if not self.changes_only:
+            return True
+        last_value, t_published = self.published.get(topic, (None, None))
+        if last_value is None or now - t_published >= self.refresh_interval:
+            return True
+        deadband = self.deadband
+        if isinstance(deadband, dict):
+            deadband = deadband.get(topic.rpartition('/')[2], 0)
+        return abs(value - last_value) > deadband
+
+    def publish(self, client, topic, data):
+        """
+        Publish status record
+
+        :param paho.mqtt.client.Client client: mqtt-client instance
+        :param str topic: topic prefix
+        :param hoymiles.decoders.StatusRecord data: status record
+        :return: messages published
+        :rtype: int
+        """
+        values = mqtt_values(data)
+        now = time.monotonic()
+
+        if self.format == 'json':
+            if not any(self.changed(f'{topic}/{subtopic}', value, now) for subtopic, value in values):
+                return 0
+            client.publish(f'{topic}/status', mqtt_document(data, values))
+            if self.changes_only:
+                for subtopic, value in values:
+                    self.published[f'{topic}/{subtopic}'] = (value, now)
+            return 1
+
+        published = 0
+        for subtopic, value in values:
+            if self.changed(f'{topic}/{subtopic}', value, now):
+                client.publish(f'{topic}/{subtopic}', value)
+                if self.changes_only:
+                    self.published[f'{topic}/{subtopic}'] = (value, now)
+                published = published + 1
+        return published
 
 class OutputPluginFactory:
     def __init__(self, **params):
@@ -36,9 +247,47 @@ class OutputPluginFactory:
         """
         raise NotImplementedError('The current output plugin does not implement store_status')
 
+    def store_metrics(self, inverter_ser, metrics, **params):
+        """
+        Default function
+
+        :raises NotImplementedError: when the plugin does not implement store metrics data
+        """
+        raise NotImplementedError('The current output plugin does not implement store_metrics')
+
+    def store_events(self, inverter_ser, events, **params):
+        """
+        Default function
+
+        :raises NotImplementedError: when the plugin does not implement store events
+        """
+        raise NotImplementedError('The current output plugin does not implement store_events')
+
+    def send_status(self, records):
+        """
+        Store spooled status records right away, for hoymiles.spool.SpoolDrainer
+
+        Plugins buffering in the background override this to write
+        synchronously, failures must raise to keep the records spooled.
+
+        :param list records: (StatusRecord, store_status parameters) pairs
+        """
+        for data, params in records:
+            self.store_status(data, **params)
+
+try:
+    from influxdb_client import InfluxDBClient
+    from influxdb_client.client.write_api import SYNCHRONOUS
+    from influxdb_client.rest import ApiException
+except ModuleNotFoundError:
+    pass
+
 class InfluxOutputPlugin(OutputPluginFactory):
     """ Influx2 output plugin """
     api = None
+    client = None
+    writer = None
+    bucket = 'hoymiles/autogen'
 
     def __init__(self, url, token, **params):
         """
@@ -47,81 +296,131 @@ class InfluxOutputPlugin(OutputPluginFactory):
         The following targets must be present in your InfluxDB. This does not
         automatically create anything for You.
 
+        Lines are buffered and written in batches by a background thread
+        through a synchronous influxdb_client write API, see
+        hoymiles.writer.BatchWriter for the buffer parameters (batch_size,
+        max_records, flush_interval, backpressure, retries, backoff).
+
         :param str url: The url to connect this client to. Like http://localhost:8086
         :param str token: Influx2 access token which is allowed to write to bucket
         :param org: Influx2 org, the token belongs to
         :type org: str
-        :param bucket: Influx2 bucket to store data in (also known as retention policy)
+        :param bucket: Influx2 bucket to store data in (also known as retention policy),
+            default hoymiles/autogen
         :type bucket: str
         :param measurement: Default measurement-prefix to use
         :type measurement: str
+        :param timeout: HTTP request timeout in seconds (default: 10)
+        :type timeout: float
         """
         super().__init__(**params)
 
-        self._bucket = params.get('bucket', 'hoymiles/autogen')
+        self._bucket = params.get('bucket', self.bucket)
+        if 'bucket' not in params:
+            print(f'Output influxdb: no bucket configured, writing to {self._bucket}')
         self._org = params.get('org', '')
         self._measurement = params.get('measurement',
                 f'inverter,host={socket.gethostname()}')
 
-        client = InfluxDBClient(url, token, bucket=self._bucket)
-        self.api = client.write_api()
+        # BatchWriter batches and retries, the client writes each batch once
+        self.client = InfluxDBClient(url, token, org=self._org,
+                timeout=int(params.get('timeout', 10) * 1000))
+        self.api = self.client.write_api(write_options=SYNCHRONOUS)
+        # Writer thread and spool replays (output worker) both write
+        self._write_lock = threading.Lock()
+
+        writer_params = {key: params[key] for key in [
+            'batch_size', 'max_records', 'flush_interval', 'backpressure', 'retries', 'backoff']
+            if key in params}
+        self.writer = BatchWriter(self.send, name='influx', **writer_params)
+
+    def send(self, lines):
+        """
+        Write lines to InfluxDB, called by the writer thread
+
+        :param list lines: line protocol lines
+        :raises ValueError: if InfluxDB rejects the lines (HTTP 4xx except 429)
+        :raises Exception: if InfluxDB is not reachable or fails (will be retried)
+        """
+        try:
+            with self._write_lock:
+                self.api.write(self._bucket, self._org, lines)
+        except ApiException as e_api:
+            if e_api.status and 400 <= e_api.status < 500 and e_api.status != 429:
+                raise ValueError(f'InfluxDB rejected write: {e_api.status} {e_api.reason}') from e_api
+            raise
+
+    def send_status(self, records):
+        """
+        Write spooled status records to InfluxDB right away, for
+        hoymiles.spool.SpoolDrainer
+
+        :param list records: (StatusRecord, store_status parameters) pairs
+        :raises ValueError: if InfluxDB rejects the lines
+        :raises Exception: if InfluxDB is not reachable or fails
+        """
+        lines = []
+        for data, params in records:
+            lines.extend(influx_lines(data, self._measurement))
+        self.send(lines)
+
+    def stats(self):
+        """
+        Write buffer statistics
+
+        :return: queue depth, written/dropped/failed lines and write latency
+        :rtype: dict
+        """
+        return self.writer.stats()
+
+    def close(self, timeout=30):
+        """
+        Write buffered lines, stop the writer thread and close the client
+
+        :param float timeout: seconds to wait at most
+        :return: if all lines were handled
+        :rtype: bool
+        """
+        handled = self.writer.close(timeout)
+        self.api.close()
+        self.client.close()
+        return handled
 
     def store_status(self, response, **params):
         """
         Publish StatusResponse object
 
-        :param hoymiles.decoders.StatusResponse response: StatusResponse object
-        :type response: hoymiles.decoders.StatusResponse
+        :param response: StatusResponse object or its record
+        :type response: hoymiles.decoders.StatusResponse or hoymiles.decoders.StatusRecord
         :param measurement: Custom influx measurement name
         :type measurement: str or None
 
         :raises ValueError: when response is not instance of StatusResponse
         """
 
-        if not isinstance(response, StatusResponse):
-            raise ValueError('Data needs to be instance of StatusResponse')
+        data = status_record(response)
+        data_stack = influx_lines(data, self._measurement)
 
-        data = response.__dict__()
+        self.writer.put(data_stack)
 
-        measurement = self._measurement + f',location={data["inverter_ser"]}'
+    def store_metrics(self, inverter_ser, metrics, **params):
+        """
+        Publish poll metrics of inverter
+
+        :param str inverter_ser: inverter serial
+        :param dict metrics: hoymiles.metrics.PollMetrics.inverter() result
+        """
+        measurement = self._measurement + f',location={inverter_ser}'
+        ctime = int(datetime.now(tz=timezone.utc).timestamp() * 1e9)
 
         data_stack = []
+        for counter, value in metrics.get('counters', {}).items():
+            data_stack.append(f'{measurement},type=metrics,counter={counter} value={value} {ctime}')
+        for stage, summary in metrics.get('stages', {}).items():
+            for key, value in summary.items():
+                data_stack.append(f'{measurement},type=metrics,stage={stage},stat={key} value={value} {ctime}')
 
-        time_rx = datetime.now()
-        if 'time' in data and isinstance(data['time'], datetime):
-            time_rx = data['time']
-
-        # InfluxDB uses UTC
-        utctime = datetime.fromtimestamp(time_rx.timestamp(), tz=timezone.utc)
-
-        # InfluxDB requires nanoseconds
-        ctime = int(utctime.timestamp() * 1e9)
-
-        # AC Data
-        phase_id = 0
-        for phase in data['phases']:
-            data_stack.append(f'{measurement},phase={phase_id},type=power value={phase["power"]} {ctime}')
-            data_stack.append(f'{measurement},phase={phase_id},type=voltage value={phase["voltage"]} {ctime}')
-            data_stack.append(f'{measurement},phase={phase_id},type=current value={phase["current"]} {ctime}')
-            phase_id = phase_id + 1
-
-        # DC Data
-        string_id = 0
-        for string in data['strings']:
-            data_stack.append(f'{measurement},string={string_id},type=total value={string["energy_total"]/1000:.4f} {ctime}')
-            data_stack.append(f'{measurement},string={string_id},type=power value={string["power"]:.2f} {ctime}')
-            data_stack.append(f'{measurement},string={string_id},type=voltage value={string["voltage"]:.3f} {ctime}')
-            data_stack.append(f'{measurement},string={string_id},type=current value={string["current"]:3f} {ctime}')
-            string_id = string_id + 1
-        # Global
-        if data['event_count'] is not None:
-            data_stack.append(f'{measurement},type=total_events value={data["event_count"]} {ctime}')
-        if data['powerfactor'] is not None:
-            data_stack.append(f'{measurement},type=pf value={data["powerfactor"]:f} {ctime}')
-        data_stack.append(f'{measurement},type=frequency value={data["frequency"]:.3f} {ctime}')
-        data_stack.append(f'{measurement},type=temperature value={data["temperature"]:.2f} {ctime}')
-
-        self.api.write(self._bucket, self._org, data_stack)
+        self.writer.put(data_stack)
 
 try:
     import paho.mqtt.client
@@ -152,52 +451,100 @@ class MqttOutputPlugin(OutputPluginFactory):
         :param hoymiles.StatusResponse data: decoded inverter StatusResponse
         :param topic: custom mqtt topic prefix (default: hoymiles/{inverter_ser})
         :type topic: str
+
+        Status publishing options (format, changes_only, deadband,
+        refresh_interval) are passed on to MqttStatusPublisher.
+
+        :param loop_start: run network I/O on paho's own thread, False if the
+            caller drives it, e.g. hoymiles.aio.run_mqtt_client (default: True)
+        :type loop_start: bool
         """
         super().__init__(*args, **params)
 
+        self.publish_params = {key: params[key] for key in [
+            'format', 'changes_only', 'deadband', 'refresh_interval'] if key in params}
+        self.publishers = {}
+
         mqtt_client = paho.mqtt.client.Client()
         mqtt_client.username_pw_set(params.get('user', None), params.get('password', None))
         mqtt_client.connect(params.get('host', '127.0.0.1'), params.get('port', 1883))
-        mqtt_client.loop_start()
+        if params.get('loop_start', True):
+            mqtt_client.loop_start()
 
         self.client = mqtt_client
 
+    def close(self):
+        """
+        Disconnect from broker
+        """
+        self.client.disconnect()
+        self.client.loop_stop()
+
     def store_status(self, response, **params):
         """
         Publish StatusResponse object
 
-        :param hoymiles.decoders.StatusResponse response: StatusResponse object
+        :param response: StatusResponse object or its record
+        :type response: hoymiles.decoders.StatusResponse or hoymiles.decoders.StatusRecord
         :param topic: custom mqtt topic prefix (default: hoymiles/{inverter_ser})
         :type topic: str
+        :param format: publishing options of this topic (also changes_only,
+            deadband, refresh_interval), override the plugin's options
+        :type format: str
 
         :raises ValueError: when response is not instance of StatusResponse
         """
 
-        if not isinstance(response, StatusResponse):
-            raise ValueError('Data needs to be instance of StatusResponse')
-
-        data = response.__dict__()
-
-        topic = params.get('topic', f'hoymiles/{data["inverter_ser"]}')
-
-        # AC Data
-        phase_id = 0
-        for phase in data['phases']:
-            self.client.publish(f'{topic}/emeter/{phase_id}/power', phase['power'])
-            self.client.publish(f'{topic}/emeter/{phase_id}/voltage', phase['voltage'])
-            self.client.publish(f'{topic}/emeter/{phase_id}/current', phase['current'])
-            phase_id = phase_id + 1
-
-        # DC Data
-        string_id = 0
-        for string in data['strings']:
-            self.client.publish(f'{topic}/emeter-dc/{string_id}/total', string['energy_total']/1000)
-            self.client.publish(f'{topic}/emeter-dc/{string_id}/power', string['power'])
-            self.client.publish(f'{topic}/emeter-dc/{string_id}/voltage', string['voltage'])
-            self.client.publish(f'{topic}/emeter-dc/{string_id}/current', string['current'])
-            string_id = string_id + 1
-        # Global
-        if data['powerfactor'] is not None:
-            self.client.publish(f'{topic}/pf', data['powerfactor'])
-        self.client.publish(f'{topic}/frequency', data['frequency'])
-        self.client.publish(f'{topic}/temperature', data['temperature'])
+        data = status_record(response)
+
+        topic = params.get('topic', None) or f'hoymiles/{data.inverter_ser}'
+
+        publisher = self.publishers.get(topic, None)
+        if publisher is None:
+            publisher = self.publishers.setdefault(topic, MqttStatusPublisher(**dict(self.publish_params,
+                **{key: params[key] for key in ['format', 'changes_only', 'deadband', 'refresh_interval']
+                    if key in params})))
+        publisher.publish(self.client, topic, data)
+
+    def store_metrics(self, inverter_ser, metrics, **params):
+        """
+        Publish poll metrics of inverter as JSON
+
+        :param str inverter_ser: inverter serial
+        :param dict metrics: hoymiles.metrics.PollMetrics.inverter() result
+        :param topic: custom mqtt topic prefix (default: hoymiles/{inverter_ser})
+        :type topic: str
+        """
+        topic = params.get('topic', None) or f'hoymiles/{inverter_ser}'
+
+        self.client.publish(f'{topic}/metrics', json.dumps(metrics))
+
+    def store_events(self, inverter_ser, events, **params):
+        """
+        Publish inverter events, one JSON message per event
+
+        :param str inverter_ser: inverter serial
+        :param list events: hoymiles.decoders.EventRecord objects
+        :param topic: custom mqtt topic prefix (default: hoymiles/{inverter_ser})
+        :type topic: str
+        """
+        topic = params.get('topic', None) or f'hoymiles/{inverter_ser}'
+
+        for event in events:
+            self.client.publish(f'{topic}/events', json.dumps(event.as_dict()))
+
+    def send_status(self, records):
+        """
+        Publish spooled status records, for hoymiles.spool.SpoolDrainer
+
+        :param list records: (StatusRecord, store_status parameters) pairs
+        :raises ConnectionError: while the broker is not connected (records stay spooled)
+        """
+        if not self.client.is_connected():
+            raise ConnectionError('MQTT broker not connected')
+        super().send_status(records)
+
+output_plugins = {
+        'mqtt': MqttOutputPlugin,
+        'influxdb': InfluxOutputPlugin,
+        }
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles inverter to radio assignment for setups with multiple nRF24
+transceivers
+"""
+
+class RadioShards:
+    """
+    Assign inverters to radios, statically from config or dynamically by
+    measured link quality
+    """
+    smoothing = 0.2
+    tolerance = 0.1
+
+    def __init__(self, radio_count, dynamic=False):
+        """
+        :param int radio_count: number of radios available
+        :param dynamic: assign by link quality instead of round-robin
+        :type dynamic: bool
+        """
+        self.radio_count = radio_count
+        self.dynamic = dynamic
+        self.quality = {}
+
+    def record(self, radio_id, inverter_ser, success):
+        """
+        Update link quality (moving average of successful polls)
+
+        :param int radio_id: radio index
+        :param str inverter_ser: inverter serial
+        :param bool success: if poll returned data
+        """
+        key = (radio_id, str(inverter_ser))
+        quality = self.quality.get(key, 1.0)
+        self.quality[key] = quality + self.smoothing * ((1.0 if success else 0.0) - quality)
+
+    def best_radio(self, inverter_ser, shards):
+        """
+        Radio with best link quality, least loaded one if several are
+        about equally good. Untested links count as perfect, so every
+        radio gets a chance.
+
+        :param str inverter_ser: inverter serial
+        :param list shards: current assignment
+        :return: radio index
+        :rtype: int
+        """
+        qualities = [self.quality.get((radio_id, str(inverter_ser)), 1.0)
+                for radio_id in range(self.radio_count)]
+        best = max(qualities)
+        candidates = [radio_id for radio_id in range(self.radio_count)
+                if qualities[radio_id] >= best - self.tolerance]
+        return min(candidates, key=lambda radio_id: len(shards[radio_id]))
+
+    def assign(self, inverters):
+        """
+        Split inverters into one list per radio
+
+        Inverters with a valid 'radio' index in their config are always
+        assigned to that radio.
+
+        :param list inverters: inverter config sections
+        :return: inverter config sections per radio
+        :rtype: list
+        """
+        shards = [[] for _ in range(self.radio_count)]
+        for inverter_id, inverter in enumerate(inverters):
+            radio_id = inverter.get('radio', None)
+            if not isinstance(radio_id, int) or not 0 <= radio_id < self.radio_count:
+                if self.dynamic:
+                    radio_id = self.best_radio(inverter.get('serial'), shards)
+                else:
+                    radio_id = inverter_id % self.radio_count
+            shards[radio_id].append(inverter)
+        return shards
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles simulated radio, emulates a farm of virtual inverters
+
+Allows to run and benchmark everything above the radio without an nRF24
+transceiver attached.
+"""
+
+import math
+import random
+import struct
+import time
+from . import HoymilesNRF, ser_to_hm_addr, f_crc_m, f_crc8
+from .irq import RxWaitPolling
+
+# Response layout per model, (struct format, offset, value generator).
+# Offsets match the ones used by the decoders in hoymiles.decoders
+_SIM_STATUS_LAYOUT = {
+        'Hm300': (28, [
+            ('>H', 2, lambda s: s.dc_voltage * 10),
+            ('>H', 4, lambda s: s.dc_current * 100),
+            ('>H', 6, lambda s: s.dc_power * 10),
+            ('>L', 8, lambda s: s.energy_total),
+            ('>H', 12, lambda s: s.energy_daily),
+            ('>H', 14, lambda s: 2300),
+            ('>H', 16, lambda s: 5000),
+            ('>H', 18, lambda s: s.dc_power * 9.5),
+            ('>H', 22, lambda s: s.dc_power * 9.5 / 23),
+            ('>H', 26, lambda s: 250),
+            ]),
+        'Hm600': (42, [
+            ('>H', 2, lambda s: s.dc_voltage * 10),
+            ('>H', 4, lambda s: s.dc_current * 100),
+            ('>H', 6, lambda s: s.dc_power * 10),
+            ('>H', 8, lambda s: s.dc_voltage * 10),
+            ('>H', 10, lambda s: s.dc_current * 100),
+            ('>H', 12, lambda s: s.dc_power * 10),
+            ('>L', 14, lambda s: s.energy_total),
+            ('>L', 18, lambda s: s.energy_total),
+            ('>H', 22, lambda s: s.energy_daily),
+            ('>H', 24, lambda s: s.energy_daily),
+            ('>H', 26, lambda s: 2300),
+            ('>H', 28, lambda s: 5000),
+            ('>H', 30, lambda s: s.dc_power * 19),
+            ('>H', 34, lambda s: s.dc_power * 19 / 230),
+            ('>H', 36, lambda s: 1000),
+            ('>H', 38, lambda s: 250),
+            ('>H', 40, lambda s: s.event_count),
+            ]),
+        'Hm1200': (62, [
+            ('>H', 2, lambda s: s.dc_voltage * 10),
+            ('>H', 4, lambda s: s.dc_current * 100),
+            ('>H', 6, lambda s: s.dc_current * 100),
+            ('>H', 8, lambda s: s.dc_power * 10),
+            ('>H', 10, lambda s: s.dc_power * 10),
+            ('>L', 12, lambda s: s.energy_total),
+            ('>L', 16, lambda s: s.energy_total),
+            ('>H', 20, lambda s: s.energy_daily),
+            ('>H', 22, lambda s: s.energy_daily),
+            ('>H', 24, lambda s: s.dc_voltage * 10),
+            ('>H', 26, lambda s: s.dc_current * 100),
+            ('>H', 28, lambda s: s.dc_current * 100),
+            ('>H', 30, lambda s: s.dc_power * 10),
+            ('>H', 32, lambda s: s.dc_power * 10),
+            ('>L', 34, lambda s: s.energy_total),
+            ('>L', 38, lambda s: s.energy_total),
+            ('>H', 42, lambda s: s.energy_daily),
+            ('>H', 44, lambda s: s.energy_daily),
+            ('>H', 46, lambda s: 2300),
+            ('>H', 48, lambda s: 5000),
+            ('>H', 50, lambda s: s.dc_power * 38),
+            ('>H', 54, lambda s: s.dc_power * 38 / 23),
+            ('>H', 56, lambda s: 1000),
+            ('>H', 58, lambda s: 250),
+            ('>H', 60, lambda s: s.event_count),
+            ]),
+        }
+
+_SIM_MODEL_PREFIX = {
+        '1121': 'Hm300',
+        '1141': 'Hm600',
+        '1161': 'Hm1200',
+        }
+
+class SimulatedInverter:
+    """
+    Virtual inverter, builds response payloads and fragments them
+    the same way real Hoymiles inverters do
+    """
+    mtu = 16
+    channel_stay = 0.8
+    event_rate = 0.02
+    event_log_size = 8
+    event_count = 0
+    energy_total = 0
+    energy_daily = 0
+
+    def __init__(self, inverter_ser, rx_channel_list, rng=None):
+        """
+        :param inverter_ser: inverter serial
+        :type inverter_ser: str
+        :param list rx_channel_list: channels the inverter answers on
+        :param rng: random number generator
+        :type rng: random.Random
+        """
+        self.inverter_ser = str(inverter_ser)
+        self.inverter_addr = ser_to_hm_addr(inverter_ser)
+        self.model = _SIM_MODEL_PREFIX.get(self.inverter_ser[:4], 'Hm600')
+        self.rng = rng if rng else random.Random()
+
+        # Real inverters answer on a small and stable subset of channels,
+        # the first one is used most (example.log: 75, then 61 and 3)
+        self.channels = self.rng.sample(rx_channel_list, min(3, len(rx_channel_list)))
+        self.energy_total = self.rng.randint(10000, 500000)
+        self.t_start = time.monotonic()
+        self.events = []
+        for _ in range(self.rng.randint(0, 20)):
+            self.add_event()
+
+        self.last_payload = b''
+
+    @property
+    def dc_power(self):
+        """ Simulated DC power per string in watts """
+        return 150 + 100 * math.sin(time.monotonic() / 60)
+
+    @property
+    def dc_voltage(self):
+        """ Simulated string voltage """
+        return 30 + self.rng.random()
+
+    @property
+    def dc_current(self):
+        """ Simulated string current """
+        return self.dc_power / self.dc_voltage
+
+    def status_payload(self):
+        """
+        Build 0x0B status payload
+
+        :return: payload including Modbus CRC
+        :rtype: bytes
+        """
+        size, layout = _SIM_STATUS_LAYOUT[self.model]
+        self.energy_daily = int((time.monotonic() - self.t_start) / 36)
+
+        payload = bytearray(size)
+        payload[0:2] = b'\x00\x01'
+        for fmt, offset, value in layout:
+            limit = 0xffff if fmt == '>H' else 0xffffffff
+            struct.pack_into(fmt, payload, offset, min(int(value(self)), limit))
+
+        return bytes(payload) + struct.pack('>H', f_crc_m(bytes(payload)))
+
+    def add_event(self):
+        """ Raise a new alarm, counts up event_count """
+        self.event_count = self.event_count + 1
+        uptime = int(time.monotonic() - self.t_start) & 0xffff
+        self.events.append(struct.pack('>BBHHHHH',
+                1, self.rng.choice([1, 2, 130, 143, 209]), self.event_count, uptime, uptime, 0, 0))
+
+    def events_payload(self):
+        """
+        Build 0x11/0x12 event log payload, the newest event_log_size events
+
+        :return: payload including Modbus CRC
+        :rtype: bytes
+        """
+        payload = b'\x00\x01' + b''.join(self.events[-self.event_log_size:])
+
+        return payload + struct.pack('>H', f_crc_m(payload))
+
+    def respond(self, packet):
+        """
+        Handle request packet
+
+        :param bytes packet: ESB frame received from DTU
+        :return: list of (seq, frame) tuples to send
+        :rtype: list
+        """
+        seq = packet[9]
+
+        # Empty frame with seq > 0x80 requests retransmission of a fragment
+        if seq > 0x80 and len(packet) == 11:
+            return [frag for frag in self.fragment(self.last_payload) if frag[0] & 0x7f == seq - 0x80]
+
+        command = packet[10]
+        if command == 0x0b:
+            if self.rng.random() < self.event_rate:
+                self.add_event()
+            self.last_payload = self.status_payload()
+        elif command in [0x11, 0x12]:
+            self.last_payload = self.events_payload()
+        else:
+            return []
+
+        return self.fragment(self.last_payload)
+
+    def fragment(self, payload):
+        """
+        Split payload into ESB frames
+
+        :param bytes payload: payload including Modbus CRC
+        :return: list of (seq, frame) tuples
+        :rtype: list
+        """
+        chunks = [payload[i:i+self.mtu] for i in range(0, len(payload), self.mtu)]
+
+        frames = []
+        for chunk_id, chunk in enumerate(chunks, start=1):
+            seq = chunk_id
+            if chunk_id == len(chunks):
+                seq = 0x80 + chunk_id
+            frame = b'\x95' + self.inverter_addr + self.inverter_addr + bytes([seq]) + chunk
+            frames.append((seq, frame + bytes([f_crc8(frame)])))
+
+        return frames
+
+    def pick_channel(self, previous=None):
+        """
+        Channel the inverter sends the next fragment on, consecutive
+        fragments mostly stay on the channel of the previous one
+
+        :param previous: channel of the previous fragment of the response
+        :type previous: int or None
+        :return: channel
+        :rtype: int
+        """
+        if previous is None:
+            if self.rng.random() < 0.6:
+                return self.channels[0]
+            return self.rng.choice(self.channels)
+        if self.rng.random() < self.channel_stay:
+            return previous
+        return self.rng.choice([channel for channel in self.channels if channel != previous] or self.channels)
+
+class SimulatedRF24:
+    """
+    Stand-in for the RF24 driver object, only implements the calls
+    used by HoymilesNRF
+    """
+    fifo_size = 3
+
+    def __init__(self, inverters=None, rx_channel_list=None, **sim_config):
+        """
+        :param inverters: serials of the virtual inverters
+        :type inverters: list
+        :param rx_channel_list: channels inverters answer on
+        :type rx_channel_list: list
+        :param loss: per-fragment loss probability (default: 0.05)
+        :type loss: float
+        :param duplicate: per-fragment duplication probability (default: 0.02)
+        :type duplicate: float
+        :param latency: seconds between response fragments, +-3ms jitter (default: 0.045)
+        :type latency: float
+        :param air_time: seconds a fragment is on air, the inverter repeats it
+            (ESB retransmits) until the next one is due (default: 0.03)
+        :type air_time: float
+        :param seed: random seed for reproducible runs
+        :type seed: int
+        """
+        self.rng = random.Random(sim_config.get('seed', None))
+        self.loss = sim_config.get('loss', 0.05)
+        self.duplicate = sim_config.get('duplicate', 0.02)
+        self.latency = sim_config.get('latency', 0.045)
+        self.air_time = sim_config.get('air_time', 0.03)
+
+        if not rx_channel_list:
+            rx_channel_list = HoymilesNRF.rx_channel_list
+
+        self.inverters = {}
+        for inverter_ser in inverters or []:
+            inverter = SimulatedInverter(inverter_ser, rx_channel_list, rng=self.rng)
+            self.inverters[inverter.inverter_addr] = inverter
+
+        self.channel = 0
+        self.listening = False
+        self.listen_log = []
+        self.on_air = []
+        self.fifo = []
+
+        self.stats = {
+                'requests': 0,
+                'retransmit_requests': 0,
+                'fragments_sent': 0,
+                'fragments_lost': 0,
+                'fragments_duplicated': 0,
+                'fragments_missed': 0,
+                'fragments_received': 0,
+                }
+
+    def begin(self):
+        """ Radio is always there """
+        return True
+
+    def powerDown(self):
+        """ Nothing to power down """
+
+    def setDataRate(self, rate):
+        """ Fixed 250kbps """
+
+    def openReadingPipe(self, pipe, address):
+        """ DTU address is not checked """
+
+    def openWritingPipe(self, address):
+        """ Inverter address is taken from the packet """
+
+    def setAutoAck(self, enable):
+        """ Auto-ack is always simulated """
+
+    def setRetries(self, delay, count):
+        """ Retries are not simulated """
+
+    def setCRCLength(self, length):
+        """ CRC is not simulated """
+
+    def enableDynamicPayloads(self):
+        """ Payloads are always dynamic """
+
+    def setPALevel(self, level):
+        """ TX power is not simulated """
+
+    def maskIRQ(self, tx_ok, tx_fail, rx_ready):
+        """ IRQ always signals received payloads only """
+
+    def setChannel(self, channel):
+        """
+        Select channel
+
+        :param int channel: channel
+        """
+        if self.listening:
+            self.stopListening()
+            self.channel = channel
+            self.startListening()
+        else:
+            self.channel = channel
+
+    def startListening(self):
+        """ Enter RX mode """
+        self.listening = True
+        self.listen_log.append([self.channel, time.monotonic(), None])
+
+    def stopListening(self):
+        """ Enter TX mode """
+        self.listening = False
+        if self.listen_log and self.listen_log[-1][2] is None:
+            self.listen_log[-1][2] = time.monotonic()
+
+    def write(self, packet):
+        """
+        Deliver request to virtual inverter and schedule its answer
+
+        :param bytes packet: request frame
+        :return: if inverter acknowledged the frame
+        :rtype: bool
+        """
+        inverter = self.inverters.get(bytes(packet[1:5]))
+        if not inverter or self.rng.random() < self.loss:
+            return False
+
+        self.stats['requests'] = self.stats['requests'] + 1
+        if packet[9] > 0x80 and len(packet) == 11:
+            self.stats['retransmit_requests'] = self.stats['retransmit_requests'] + 1
+
+        t_air = time.monotonic()
+        channel = None
+        for seq, frame in inverter.respond(packet):
+            t_air = t_air + self.latency + self.rng.uniform(-0.003, 0.003)
+            channel = inverter.pick_channel(channel)
+            self.stats['fragments_sent'] = self.stats['fragments_sent'] + 1
+            if self.rng.random() < self.loss:
+                self.stats['fragments_lost'] = self.stats['fragments_lost'] + 1
+                continue
+            self.on_air.append((t_air, channel, frame))
+            if self.rng.random() < self.duplicate:
+                self.stats['fragments_duplicated'] = self.stats['fragments_duplicated'] + 1
+                self.on_air.append((t_air + self.latency / 2, channel, frame))
+
+        self.on_air.sort(key=lambda item: item[0])
+        return True
+
+    def heard(self, channel, t_from, t_to):
+        """
+        Check if the radio listened on channel at some time in between
+
+        :param int channel: channel
+        :param float t_from: start of interval
+        :param float t_to: end of interval
+        :return: if listening on channel
+        :rtype: bool
+        """
+        for l_channel, l_from, l_to in self.listen_log:
+            if l_channel == channel and l_from <= t_to and (l_to is None or l_to >= t_from):
+                return True
+        return False
+
+    def _deliver(self):
+        """ Move fragments the radio listened to in the meantime into RX fifo """
+        now = time.monotonic()
+        on_air = []
+        for item in self.on_air:
+            t_air, channel, frame = item
+            if t_air > now:
+                on_air.append(item)
+            elif len(self.fifo) < self.fifo_size \
+                    and self.heard(channel, t_air, min(now, t_air + self.air_time)):
+                self.fifo.append(frame)
+                self.stats['fragments_received'] = self.stats['fragments_received'] + 1
+            elif t_air + self.air_time > now:
+                on_air.append(item)
+            else:
+                self.stats['fragments_missed'] = self.stats['fragments_missed'] + 1
+        self.on_air = on_air
+
+        # Listen history is needed for fragments still on air only
+        t_keep = min([item[0] for item in on_air], default=now)
+        self.listen_log = [entry for entry in self.listen_log
+                if entry[2] is None or entry[2] >= t_keep]
+
+    def available_pipe(self):
+        """
+        Check RX fifo
+
+        :return: if payload available, pipe number
+        :rtype: tuple
+        """
+        self._deliver()
+        return len(self.fifo) > 0, 1
+
+    def getDynamicPayloadSize(self):
+        """
+        Size of next payload in RX fifo
+
+        :return: payload size
+        :rtype: int
+        """
+        return len(self.fifo[0])
+
+    def read(self, size):
+        """
+        Pop payload from RX fifo
+
+        :param int size: bytes to read
+        :return: payload
+        :rtype: bytes
+        """
+        return self.fifo.pop(0)[:size]
+
+class SimulatedRxWait:
+    """ IRQ line of the simulated radio """
+    irq = True
+
+    def __init__(self, device):
+        """
+        :param SimulatedRF24 device: simulated radio
+        """
+        self.device = device
+
+    def wait(self, timeout):
+        """
+        Sleep until next fragment arrives on the current channel
+
+        :param float timeout: seconds to wait
+        :return: if IRQ got asserted
+        :rtype: bool
+        """
+        self.device._deliver()
+        if self.device.fifo:
+            return True
+
+        t_end = time.monotonic() + timeout
+        for t_air, channel, frame in self.device.on_air:
+            if t_air > t_end:
+                break
+            if self.device.listening and channel == self.device.channel:
+                time.sleep(max(0, t_air - time.monotonic()))
+                return True
+
+        time.sleep(max(0, t_end - time.monotonic()))
+        return False
+
+class HoymilesSimulatedNRF(HoymilesNRF):
+    """Hoymiles NRF24 Interface backed by a simulated radio"""
+
+    def __init__(self, inverters=None, **radio_config):
+        """
+        Create simulated radio and virtual inverter farm
+
+        :param inverters: serials of the virtual inverters
+        :type inverters: list
+        :param radio_config: nrf config section, see SimulatedRF24 for
+            simulation parameters
+        """
+        device = SimulatedRF24(inverters=inverters,
+                rx_channel_list=self.rx_channel_list,
+                **radio_config)
+
+        rx_wait = RxWaitPolling()
+        if radio_config.get('irq_pin', None) is not None:
+            rx_wait = SimulatedRxWait(device)
+
+        super().__init__(device=device, rx_wait=rx_wait, **radio_config)
+
+    @property
+    def stats(self):
+        """
+        Simulation counters
+
+        :return: counters of simulated radio
+        :rtype: dict
+        """
+        return self.radio.stats
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles output spool
+
+Decoded results are appended to a local write-ahead log and return at
+once, drainer threads replay the log to every output (sink) at their own
+pace. An unreachable broker or database only makes its sink fall behind,
+the records stay on disk and are sent in order once it is back.
+
+The log is a directory of segment files, JSON lines named after the offset
+of their first record. Every sink has a committed offset (<sink>.offset),
+segments all sinks are done with get deleted.
+"""
+
+import os
+import re
+import json
+import bisect
+import threading
+import time
+from .metrics import RollingHistogram
+
+class Spool:
+    """ Segmented append-only record log with per sink offsets """
+    segment_size = 8 * 1024 * 1024
+    max_bytes = 256 * 1024 * 1024
+    fsync_interval = 1
+    fsync_records = 1000
+
+    def __init__(self, directory, **params):
+        """
+        :param str directory: directory for segment and offset files
+        :param segment_size: bytes after which a new segment is started (default: 8 MiB)
+        :type segment_size: int
+        :param max_bytes: size limit of all segments, the oldest segment is dropped
+            even if not all sinks are done with it (default: 256 MiB)
+        :type max_bytes: int
+        :param fsync_interval: seconds records wait at most to be synced to disk (default: 1)
+        :type fsync_interval: float
+        :param fsync_records: records after which a sync is started early (default: 1000)
+        :type fsync_records: int
+        """
+        self.directory = directory
+        self.segment_size = params.get('segment_size', self.segment_size)
+        self.max_bytes = params.get('max_bytes', self.max_bytes)
+        self.fsync_interval = params.get('fsync_interval', self.fsync_interval)
+        self.fsync_records = params.get('fsync_records', self.fsync_records)
+
+        self.cond = threading.Condition()
+        self.segments = []
+        self.sizes = {}
+        self.offsets = {}
+        self.next_offset = 0
+        self.fh_segment = None
+        self.unsynced = 0
+        self.rolled = []
+        self.closing = False
+
+        self.dropped = 0
+        self.syncs = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+
+        self.syncer = threading.Thread(target=self.run, name='spool-sync', daemon=True)
+        self.syncer.start()
+
+    def path(self, base):
+        """
+        Segment file
+
+        :param int base: offset of first record in segment
+        :return: file path
+        :rtype: str
+        """
+        return os.path.join(self.directory, f'{base:020d}.seg')
+
+    def offset_path(self, sink):
+        """
+        Committed offset file of sink
+
+        :param str sink: sink name
+        :return: file path
+        :rtype: str
+        """
+        return os.path.join(self.directory, f'{sink}.offset')
+
+    def recover(self):
+        """
+        Find segments on disk and continue the newest one. A record torn by
+        a crash (no trailing newline) is cut off.
+        """
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                if re.fullmatch(r'\d{20}\.seg', name))
+        if not self.segments:
+            self.segments = [0]
+        for base in self.segments:
+            try:
+                self.sizes[base] = os.path.getsize(self.path(base))
+            except FileNotFoundError:
+                self.sizes[base] = 0
+
+        base = self.segments[-1]
+        records = 0
+        size = 0
+        with open(self.path(base), 'ab+') as fh_segment:
+            fh_segment.seek(0)
+            for line in fh_segment:
+                if not line.endswith(b'\n'):
+                    break
+                records = records + 1
+                size = size + len(line)
+            fh_segment.truncate(size)
+        self.sizes[base] = size
+        self.next_offset = base + records
+        self.fh_segment = open(self.path(base), 'ab')
+
+    def append(self, records):
+        """
+        Append records, they are synced to disk in the background
+
+        :param list records: JSON serializable records
+        :return: offset after the last record
+        :rtype: int
+        :raises RuntimeError: if the spool is closed
+        """
+        data = b''.join(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+                for record in records)
+        with self.cond:
+            if self.closing:
+                raise RuntimeError('Spool is closed')
+            # Readers only see next_offset, so whole records are flushed first
+            self.fh_segment.write(data)
+            self.fh_segment.flush()
+            self.sizes[self.segments[-1]] = self.sizes[self.segments[-1]] + len(data)
+            self.next_offset = self.next_offset + len(records)
+            self.unsynced = self.unsynced + len(records)
+            if self.sizes[self.segments[-1]] >= self.segment_size:
+                self.roll()
+            self.cond.notify_all()
+            return self.next_offset
+
+    def roll(self):
+        """
+        Start a new segment, the old one is synced and closed by the sync
+        thread (call with cond held)
+        """
+        self.rolled.append(self.fh_segment)
+        base = self.next_offset
+        self.segments.append(base)
+        self.sizes[base] = 0
+        self.fh_segment = open(self.path(base), 'ab')
+
+        while len(self.segments) > 1 and sum(self.sizes.values()) > self.max_bytes:
+            # Size limit reached: the oldest records are lost for sinks not done with them
+            base, end = self.segments[0], self.segments[1]
+            if self.offsets:
+                self.dropped = self.dropped + end - min(max(min(self.offsets.values()), base), end)
+            self.remove(base)
+
+    def remove(self, base):
+        """
+        Delete oldest segment (call with cond held)
+
+        :param int base: offset of first record in segment
+        """
+        self.segments.remove(base)
+        del self.sizes[base]
+        try:
+            os.remove(self.path(base))
+        except FileNotFoundError:
+            pass
+
+    def compact(self):
+        """
+        Delete segments every registered sink is done with, the active
+        segment is kept (call with cond held)
+        """
+        if not self.offsets:
+            return
+        committed = min(self.offsets.values())
+        while len(self.segments) > 1 and self.segments[1] <= committed:
+            self.remove(self.segments[0])
+
+    def register(self, sink):
+        """
+        Add sink, only registered sinks keep segments from being deleted
+
+        A new sink starts at the oldest stored record.
+
+        :param str sink: sink name
+        :return: committed offset of sink
+        :rtype: int
+        """
+        with self.cond:
+            try:
+                with open(self.offset_path(sink), 'r') as fh_offset:
+                    offset = int(fh_offset.read())
+            except (FileNotFoundError, ValueError):
+                offset = self.segments[0]
+            offset = min(max(offset, self.segments[0]), self.next_offset)
+            self.offsets[sink] = offset
+            return offset
+
+    def commit(self, sink, offset):
+        """
+        Store offset of sink: all records before it are done. The offset is
+        not synced, a crash may send some records again.
+
+        :param str sink: sink name
+        :param int offset: offset of the next record to send
+        """
+        tmp_path = self.offset_path(sink) + '.tmp'
+        with open(tmp_path, 'w') as fh_offset:
+            fh_offset.write(str(offset))
+        os.replace(tmp_path, self.offset_path(sink))
+
+        with self.cond:
+            self.offsets[sink] = offset
+            self.compact()
+
+    def segment(self, offset):
+        """
+        Segment holding record
+
+        :param int offset: record offset
+        :return: offset of first record in segment, offset after the segment (None for the active segment)
+        :rtype: tuple
+        """
+        with self.cond:
+            index = max(0, bisect.bisect_right(self.segments, offset) - 1)
+            end = self.segments[index + 1] if index + 1 < len(self.segments) else None
+            return self.segments[index], end
+
+    def sync(self):
+        """
+        Sync appended records and rolled segments to disk. The file is
+        synced through a duplicate descriptor, appending goes on meanwhile.
+        """
+        with self.cond:
+            rolled, self.rolled = self.rolled, []
+            fd_segment = os.dup(self.fh_segment.fileno()) if self.unsynced else None
+            self.unsynced = 0
+
+        for fh_segment in rolled:
+            os.fsync(fh_segment.fileno())
+            fh_segment.close()
+        if fd_segment is not None:
+            try:
+                os.fsync(fd_segment)
+            finally:
+                os.close(fd_segment)
+            self.syncs = self.syncs + 1
+
+    def run(self):
+        """ Sync thread: sync every fsync_interval or fsync_records records """
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.unsynced >= self.fsync_records
+                        or self.rolled or self.closing, self.fsync_interval)
+                if self.closing:
+                    return
+            self.sync()
+
+    def close(self):
+        """
+        Stop sync thread, sync and close the active segment
+        """
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.syncer.join()
+        self.sync()
+        self.fh_segment.close()
+
+    def stats(self):
+        """
+        Spool statistics
+
+        :return: stored segments, bytes and records, records dropped by the size limit,
+            syncs and the lag (records not yet sent) per sink
+        :rtype: dict
+        """
+        with self.cond:
+            return {
+                    'segments': len(self.segments),
+                    'bytes': sum(self.sizes.values()),
+                    'records': self.next_offset - self.segments[0],
+                    'dropped': self.dropped,
+                    'syncs': self.syncs,
+                    'lag': {sink: self.next_offset - offset for sink, offset in self.offsets.items()},
+                    }
+
+class SpoolDrainer:
+    """ Replays a spool to one sink from a worker thread """
+    batch_size = 500
+    flush_interval = 0
+    backoff = 1
+    max_backoff = 60
+
+    def __init__(self, spool, sink, send, **params):
+        """
+        :param Spool spool: spool to read
+        :param str sink: sink name, keeps its own committed offset
+        :param send: writes a list of records, raises on failure. ValueError
+            marks the batch as not writable at all, it is skipped. Other
+            errors are retried until the sink is back.
+        :type send: callable
+        :param batch_size: records per send at most (default: 500)
+        :type batch_size: int
+        :param flush_interval: seconds to wait for a batch to fill, 0 sends
+            whatever is there (default: 0)
+        :type flush_interval: float
+        :param backoff: seconds before the first retry, doubles on every retry up to max_backoff (default: 1)
+        :type backoff: float
+        """
+        self.spool = spool
+        self.sink = sink
+        self.send = send
+        self.batch_size = params.get('batch_size', self.batch_size)
+        self.flush_interval = params.get('flush_interval', self.flush_interval)
+        self.backoff = params.get('backoff', self.backoff)
+        self.max_backoff = params.get('max_backoff', self.max_backoff)
+
+        self.offset = spool.register(sink)
+        self.fh_segment = None
+        self.segment_base = None
+        self.delay = 0
+        self.closing = False
+
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retried = 0
+        self.latency = RollingHistogram()
+
+        self.worker = threading.Thread(target=self.run, name=f'spool-{sink}', daemon=True)
+        self.worker.start()
+
+    def pending(self):
+        """
+        Records not read yet (call with spool.cond held)
+
+        :return: record count
+        :rtype: int
+        """
+        return self.spool.next_offset - self.offset
+
+    def read(self, limit):
+        """
+        Read next records
+
+        :param int limit: records to read at most
+        :return: records
+        :rtype: list
+        """
+        records = []
+        while len(records) < limit:
+            with self.spool.cond:
+                first = self.spool.segments[0]
+                end = self.spool.next_offset
+            if self.offset < first:
+                # Dropped by the spool size limit
+                self.skipped = self.skipped + first - self.offset
+                self.offset = first
+            if self.offset >= end:
+                break
+
+            base, segment_end = self.spool.segment(self.offset)
+            if base != self.segment_base:
+                self.open_segment(base)
+            if self.fh_segment is None:
+                # Segment deleted meanwhile
+                if segment_end is None:
+                    break
+                self.skipped = self.skipped + segment_end - self.offset
+                self.offset = segment_end
+                continue
+
+            for _ in range(min(limit - len(records), end - self.offset,
+                    (segment_end or end) - self.offset)):
+                records.append(json.loads(self.fh_segment.readline()))
+                self.offset = self.offset + 1
+        return records
+
+    def open_segment(self, base):
+        """
+        Open segment and seek to the current offset
+
+        :param int base: offset of first record in segment
+        """
+        if self.fh_segment:
+            self.fh_segment.close()
+        self.segment_base = base
+        try:
+            self.fh_segment = open(self.spool.path(base), 'rb')
+        except FileNotFoundError:
+            self.fh_segment = None
+            return
+        for _ in range(self.offset - base):
+            self.fh_segment.readline()
+
+    def run(self):
+        """ Worker: send records as they get appended, in order """
+        t_send = time.monotonic()
+        batch = []
+        while True:
+            with self.spool.cond:
+                if not batch:
+                    self.spool.cond.wait_for(lambda: self.pending() > 0 or self.closing)
+                    if self.flush_interval and not self.closing:
+                        self.spool.cond.wait_for(lambda: self.pending() >= self.batch_size or self.closing,
+                                max(0, t_send + self.flush_interval - time.monotonic()))
+                if self.closing and not batch and not self.pending():
+                    break
+
+            if not batch:
+                batch = self.read(self.batch_size)
+            if not batch:
+                continue
+            t_send = time.monotonic()
+            if self.write(batch):
+                batch = []
+                self.spool.commit(self.sink, self.offset)
+            elif self.closing:
+                # Left in the spool for the next start
+                break
+
+        if self.fh_segment:
+            self.fh_segment.close()
+
+    def write(self, batch):
+        """
+        Send batch, back off exponentially while the sink fails
+
+        :param list batch: records
+        :return: if batch is done (sent or not writable), False to retry
+        :rtype: bool
+        """
+        if self.delay:
+            with self.spool.cond:
+                if self.spool.cond.wait_for(lambda: self.closing, self.delay):
+                    return False
+        try:
+            t_start = time.monotonic()
+            self.send(batch)
+            self.latency.add(time.monotonic() - t_start)
+            self.sent = self.sent + len(batch)
+            self.delay = 0
+            return True
+        except ValueError as e_send:
+            print(f'Spool {self.sink}: send failed, skipping {len(batch)} records: {e_send}')
+            self.failed = self.failed + len(batch)
+            return True
+        except Exception as e_send:
+            if not self.delay:
+                print(f'Spool {self.sink}: send failed, retrying until sink is back: {e_send}')
+            self.retried = self.retried + 1
+            self.delay = min(max(self.backoff, self.delay * 2), self.max_backoff)
+            return False
+
+    def close(self, timeout=30):
+        """
+        Send what is left and stop worker, unsent records stay in the spool
+
+        :param float timeout: seconds to wait at most
+        :return: if the worker stopped
+        :rtype: bool
+        """
+        with self.spool.cond:
+            self.closing = True
+            self.spool.cond.notify_all()
+        self.worker.join(timeout)
+        return not self.worker.is_alive()
+
+    def stats(self):
+        """
+        Drainer statistics
+
+        :return: lag (records not yet sent), sent, failed and skipped records,
+            failed sends (retried) and send latency summary
+        :rtype: dict
+        """
+        with self.spool.cond:
+            lag = self.spool.next_offset - self.spool.offsets.get(self.sink, self.offset)
+        return {
+                'lag': lag,
+                'sent': self.sent,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'retried': self.retried,
+                'latency': self.latency.as_dict(),
+                }
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Hoymiles buffered background writer
+
+Outputs hand over records and return at once, a worker thread writes them
+in batches. Slow or unreachable servers only fill the (bounded) buffer
+instead of stretching the poll cycle.
+"""
+
+import threading
+import time
+from collections import deque
+from .metrics import RollingHistogram
+
+class BatchWriter:
+    """ Bounded record buffer, written in batches by a worker thread """
+    batch_size = 500
+    max_records = 10000
+    flush_interval = 10
+    backpressure = 'drop-oldest'
+    retries = 3
+    backoff = 1
+    max_backoff = 60
+
+    def __init__(self, send, **params):
+        """
+        :param send: writes a list of records, raises on failure. ValueError
+            marks the batch as not writable at all, it is dropped without retry
+        :type send: callable
+        :param batch_size: records per write (default: 500)
+        :type batch_size: int
+        :param max_records: buffer limit (default: 10000)
+        :type max_records: int
+        :param flush_interval: seconds a record waits at most for its batch to fill (default: 10)
+        :type flush_interval: float
+        :param backpressure: 'drop-oldest' or 'block' callers while the buffer is full
+        :type backpressure: str
+        :param retries: retries of a failed write (default: 3)
+        :type retries: int
+        :param backoff: seconds before the first retry, doubles on every retry up to max_backoff (default: 1)
+        :type backoff: float
+        :param name: worker thread name
+        :type name: str
+        :raises ValueError: on unknown backpressure policy
+        """
+        self.send = send
+        self.batch_size = params.get('batch_size', self.batch_size)
+        self.max_records = params.get('max_records', self.max_records)
+        self.flush_interval = params.get('flush_interval', self.flush_interval)
+        self.backpressure = params.get('backpressure', self.backpressure)
+        self.retries = params.get('retries', self.retries)
+        self.backoff = params.get('backoff', self.backoff)
+        self.batch_size = min(self.batch_size, self.max_records)
+        if self.backpressure not in ['drop-oldest', 'block']:
+            raise ValueError(f'Unknown backpressure policy {self.backpressure}')
+
+        self.buffer = deque()
+        self.in_flight = 0
+        self.delay = 0
+        self.flush_requested = False
+        self.closing = False
+        self.cond = threading.Condition()
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retried = 0
+        self.latency = RollingHistogram()
+
+        self.worker = threading.Thread(target=self.run,
+                name=params.get('name', 'writer'), daemon=True)
+        self.worker.start()
+
+    def put(self, records):
+        """
+        Queue records for writing
+
+        :param list records: records to write
+        :return: records dropped to make room
+        :rtype: int
+        """
+        dropped = 0
+        with self.cond:
+            if self.closing:
+                raise RuntimeError('Writer is closed')
+            for record in records:
+                if len(self.buffer) >= self.max_records:
+                    if self.backpressure == 'block':
+                        self.cond.notify_all()
+                        self.cond.wait_for(lambda: len(self.buffer) < self.max_records or self.closing)
+                    else:
+                        self.buffer.popleft()
+                        dropped = dropped + 1
+                self.buffer.append(record)
+            self.dropped = self.dropped + dropped
+            if len(self.buffer) >= self.batch_size:
+                self.cond.notify_all()
+        return dropped
+
+    def flush(self, timeout=None):
+        """
+        Write all buffered records now and wait until done
+
+        :param timeout: seconds to wait at most
+        :type timeout: float
+        :return: if the buffer got empty
+        :rtype: bool
+        """
+        with self.cond:
+            self.flush_requested = True
+            self.cond.notify_all()
+            return self.cond.wait_for(lambda: not self.buffer and not self.in_flight, timeout)
+
+    def close(self, timeout=30):
+        """
+        Flush buffer and stop worker
+
+        :param float timeout: seconds to wait for the final flush
+        :return: if all records were written or dropped
+        :rtype: bool
+        """
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.worker.join(timeout)
+        return not self.worker.is_alive()
+
+    def stats(self):
+        """
+        Buffer and write statistics
+
+        :return: depth, written, dropped and failed records, failed write attempts (retried)
+            and write latency summary
+        :rtype: dict
+        """
+        with self.cond:
+            depth = len(self.buffer) + self.in_flight
+        return {
+                'depth': depth,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'retried': self.retried,
+                'latency': self.latency.as_dict(),
+                }
+
+    def run(self):
+        """ Worker: write batches once full, flushed or flush_interval elapsed """
+        t_write = time.monotonic()
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.buffer) >= self.batch_size
+                        or self.flush_requested or self.closing,
+                        max(0, t_write + self.flush_interval - time.monotonic()))
+                if not self.buffer:
+                    self.flush_requested = False
+                    self.cond.notify_all()
+                    if self.closing:
+                        return
+                    t_write = time.monotonic()
+                    continue
+                batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+                self.in_flight = len(batch)
+                self.cond.notify_all()
+
+            written = self.write(batch)
+            t_write = time.monotonic()
+
+            with self.cond:
+                self.in_flight = 0
+                if not written:
+                    self.requeue(batch)
+                self.cond.notify_all()
+
+    def write(self, batch):
+        """
+        Send batch, retry with exponential backoff. The backoff continues
+        across batches until a write succeeds.
+
+        :param list batch: records
+        :return: if batch is done (written or not writable), False to keep it
+        :rtype: bool
+        """
+        for attempt in range(self.retries + 1):
+            if self.delay:
+                with self.cond:
+                    if self.cond.wait_for(lambda: self.closing, self.delay):
+                        # Shutdown: no more waiting
+                        self.delay = 0
+            try:
+                t_start = time.monotonic()
+                self.send(batch)
+                self.latency.add(time.monotonic() - t_start)
+                self.written = self.written + len(batch)
+                self.delay = 0
+                return True
+            except ValueError as e_send:
+                print(f'Write failed, dropping {len(batch)} records: {e_send}')
+                self.failed = self.failed + len(batch)
+                return True
+            except Exception as e_send:
+                print(f'Write failed (attempt {attempt + 1}): {e_send}')
+                self.retried = self.retried + 1
+                if not self.closing:
+                    self.delay = min(max(self.backoff, self.delay * 2), self.max_backoff)
+
+        if self.closing:
+            self.failed = self.failed + len(batch)
+            return True
+        return False
+
+    def requeue(self, batch):
+        """
+        Put unwritten batch back in front of the buffer, the oldest records
+        give way if it is full (call with cond held)
+
+        :param list batch: records
+        """
+        room = self.max_records - len(self.buffer)
+        if room < len(batch):
+            self.dropped = self.dropped + len(batch) - max(room, 0)
+            batch = batch[len(batch) - max(room, 0):]
+        self.buffer.extendleft(reversed(batch))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Fragment reassembly buffer: slot table, chained payload CRC, missing
+frames and pruning
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import random
+import struct
+import unittest
+from datetime import datetime, timedelta
+
+import hoymiles
+from hoymiles.crc import f_crc_m
+from hoymiles.simulator import SimulatedInverter
+
+INVERTER_SER = 114100000001
+
+def frames(payload, inverter_ser=INVERTER_SER, time_rx=None):
+    """
+    ESB frames of payload like the inverter sends them
+
+    :param bytes payload: payload including Modbus CRC
+    :param int inverter_ser: sending inverter
+    :param datetime time_rx: receive time of all frames (default: now)
+    :return: frames in sequence order
+    :rtype: list
+    """
+    inverter = SimulatedInverter(inverter_ser, [3, 23, 40, 61, 75], rng=random.Random(1))
+    return [hoymiles.InverterPacketFragment(time_rx=time_rx or datetime.now(), payload=frame)
+            for seq, frame in inverter.fragment(payload)]
+
+def with_crc(data):
+    """
+    :param bytes data: payload data
+    :return: data followed by its Modbus CRC
+    :rtype: bytes
+    """
+    return data + struct.pack('>H', f_crc_m(data))
+
+class TestFragmentBuffer(unittest.TestCase):
+
+    def setUp(self):
+        inverter = SimulatedInverter(INVERTER_SER, [3, 23, 40, 61, 75], rng=random.Random(1))
+        self.payload = inverter.status_payload()
+        self.frames = frames(self.payload)
+        self.src = self.frames[0].src
+        self.assertGreater(len(self.frames), 2)
+
+    def test_complete_in_any_order(self):
+        fragments = hoymiles.FragmentBuffer()
+        for frame in reversed(self.frames):
+            self.assertFalse(fragments.complete(self.src))
+            self.assertIsNone(fragments.crc_valid(self.src))
+            self.assertTrue(fragments.add(frame))
+        self.assertTrue(fragments.complete(self.src))
+        self.assertEqual(fragments.missing(self.src), [])
+        self.assertTrue(fragments.crc_valid(self.src))
+        self.assertEqual(bytes(fragments.payload(self.src)), self.payload)
+        self.assertIs(fragments.end_frame(self.src), self.frames[-1])
+
+    def test_missing_frames(self):
+        fragments = hoymiles.FragmentBuffer()
+        self.assertEqual(fragments.missing(self.src), [1])
+        fragments.add(self.frames[1])
+        # End frame not seen yet, the frame after the highest one is missing too
+        self.assertEqual(fragments.missing(self.src), [1, 3])
+        fragments.add(self.frames[-1])
+        self.assertEqual(fragments.missing(self.src),
+                [seq_id for seq_id in range(1, len(self.frames)) if seq_id != 2])
+        self.assertFalse(fragments.complete(self.src))
+        with self.assertRaises(BufferError):
+            fragments.payload(self.src)
+
+    def test_duplicates_dropped(self):
+        fragments = hoymiles.FragmentBuffer()
+        self.assertTrue(fragments.add(self.frames[0]))
+        self.assertFalse(fragments.add(self.frames[0]))
+        self.assertEqual(fragments.duplicates, 1)
+        self.assertEqual(fragments.crcs[self.src], [f_crc_m(self.frames[0].data)])
+
+    def test_crc_mismatch(self):
+        payload = bytearray(self.payload)
+        payload[5] = payload[5] ^ 0xff
+        fragments = hoymiles.FragmentBuffer()
+        for frame in frames(bytes(payload)):
+            fragments.add(frame)
+        self.assertTrue(fragments.complete(self.src))
+        self.assertFalse(fragments.crc_valid(self.src))
+
+    def test_chained_crc_matches_payload_crc(self):
+        fragments = hoymiles.FragmentBuffer()
+        for frame in self.frames:
+            fragments.add(frame)
+        data = b''
+        for frame, crc in zip(self.frames, fragments.crcs[self.src]):
+            data = data + bytes(frame.data)
+            self.assertEqual(crc, f_crc_m(data))
+        # End frame holds the payload CRC and is not chained
+        self.assertEqual(len(fragments.crcs[self.src]), len(self.frames) - 1)
+
+    def test_crc_split_over_end_frame(self):
+        # 33 bytes: the end frame only holds the last CRC byte
+        payload = with_crc(bytes(range(31)))
+        for data, valid in [(payload, True), (payload[:30] + b'\xff' + payload[31:], False)]:
+            end = frames(data)
+            self.assertEqual(len(end[-1].data), 1)
+            fragments = hoymiles.FragmentBuffer()
+            for frame in end:
+                fragments.add(frame)
+            self.assertEqual(fragments.crc_valid(self.src), valid)
+
+    def test_oldest_source_evicted(self):
+        fragments = hoymiles.FragmentBuffer()
+        fragments.max_sources = 2
+        first = [frames(self.payload, inverter_ser)[0]
+                for inverter_ser in [114100000001, 114100000002, 114100000003]]
+        for frame in first:
+            fragments.add(frame)
+        self.assertEqual(list(fragments.slots), [frame.src for frame in first[1:]])
+        self.assertNotIn(first[0].src, fragments.crcs)
+        self.assertEqual(fragments.missing(first[0].src), [1])
+
+    def test_prune_stale_frames(self):
+        fragments = hoymiles.FragmentBuffer()
+        stale = frames(self.payload, time_rx=datetime.now() - timedelta(seconds=60))
+        for frame in stale[:-1]:
+            fragments.add(frame)
+        fragments.add(self.frames[-1])
+        self.assertTrue(fragments.complete(self.src))
+
+        fragments.prune(30)
+        self.assertEqual(fragments.missing(self.src), list(range(1, len(self.frames))))
+        self.assertEqual(fragments.crcs[self.src], [])
+        self.assertIs(fragments.end_frame(self.src), self.frames[-1])
+
+        # Retransmitted frames complete the payload again
+        for frame in self.frames[:-1]:
+            self.assertTrue(fragments.add(frame))
+        self.assertTrue(fragments.crc_valid(self.src))
+        self.assertEqual(bytes(fragments.payload(self.src)), self.payload)
+
+        fragments.prune(-1)
+        self.assertNotIn(self.src, fragments.slots)
+
+if __name__ == '__main__':
+    unittest.main()
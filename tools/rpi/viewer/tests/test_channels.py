@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+RX channel prediction, hop order and fallback order
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import unittest
+
+import hoymiles
+from hoymiles.channels import RxChannelScheduler
+from hoymiles.simulator import HoymilesSimulatedNRF
+
+CHANNELS = [3, 23, 40, 61, 75]
+INVERTER_A = b'\x72\x22\x01\x43'
+INVERTER_B = b'\x78\x56\x34\x12'
+
+class TestRxChannelScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = RxChannelScheduler(CHANNELS)
+
+    def test_default_order_without_statistics(self):
+        self.assertEqual(self.scheduler.order(INVERTER_A, 1), CHANNELS)
+        self.assertEqual(self.scheduler.order(None), CHANNELS)
+
+    def test_predicted_channel_first(self):
+        self.scheduler.record(INVERTER_A, 1, 75)
+        self.scheduler.record(INVERTER_A, 0x83, 61)
+
+        self.assertEqual(self.scheduler.order(INVERTER_A, 1), [75, 61, 3, 23, 40])
+        # End frame seq carries 0x80
+        self.assertEqual(self.scheduler.order(INVERTER_A, 3)[0], 61)
+        # Other inverters keep the default order
+        self.assertEqual(self.scheduler.order(INVERTER_B, 1), CHANNELS)
+
+    def test_fallback_to_inverter_statistics(self):
+        for _ in range(3):
+            self.scheduler.record(INVERTER_A, 1, 61)
+        self.scheduler.record(INVERTER_A, 2, 3)
+
+        # No statistics for seq 5: inverter hits (61 before 3), then default order
+        self.assertEqual(self.scheduler.order(INVERTER_A, 5), [61, 3, 23, 40, 75])
+        self.assertEqual(self.scheduler.order(INVERTER_A), [61, 3, 23, 40, 75])
+
+    def test_recent_hits_outweigh_decayed_ones(self):
+        self.scheduler.record(INVERTER_A, 1, 40)
+        for _ in range(30):
+            self.scheduler.record(INVERTER_A, 1, 75)
+        for _ in range(3):
+            self.scheduler.record(INVERTER_A, 1, 23)
+
+        self.assertEqual(self.scheduler.order(INVERTER_A, 1)[:3], [75, 23, 40])
+
+class TestRxScheduling(unittest.TestCase):
+
+    def test_round_robin_by_default(self):
+        radio = HoymilesSimulatedNRF()
+        self.assertIsNone(radio.scheduler)
+        self.assertEqual(radio.rx_hop_list, hoymiles.HoymilesNRF.rx_channel_list)
+
+    def test_adaptive(self):
+        radio = HoymilesSimulatedNRF(rx_scheduling='adaptive')
+        self.assertIsInstance(radio.scheduler, RxChannelScheduler)
+
+    def test_unknown_scheduling(self):
+        with self.assertRaises(ValueError):
+            HoymilesSimulatedNRF(rx_scheduling='random')
+
+if __name__ == '__main__':
+    unittest.main()
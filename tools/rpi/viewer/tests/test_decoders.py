@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bulk status decoding must give the same values as decoding every payload
+on its own
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import io
+import random
+import unittest
+from unittest import mock
+
+from hoymiles import decoders
+from hoymiles.simulator import SimulatedInverter
+
+MODELS = {
+        '112100000001': decoders.Hm300Decode0B,
+        '114100000001': decoders.Hm600Decode0B,
+        '116100000001': decoders.Hm1200Decode0B,
+        }
+
+def status_payloads(inverter_ser, count=20):
+    """
+    :param str inverter_ser: simulated inverter serial
+    :param int count: payloads
+    :return: status payloads with different values
+    :rtype: list
+    """
+    inverter = SimulatedInverter(inverter_ser, [3, 23, 40, 61, 75], rng=random.Random(1))
+    return [inverter.status_payload() for _ in range(count)]
+
+def expected_columns(decoder, payloads):
+    """
+    Values of StatusResponse, one payload at a time
+
+    :param type decoder: StatusResponse subclass
+    :param list payloads: status payloads
+    :return: values by column name
+    :rtype: dict
+    """
+    columns = {}
+    for payload in payloads:
+        response = decoder(payload)
+        for group, index, key, _, _, _ in decoder.fields:
+            if group is None:
+                columns.setdefault(key, []).append(getattr(response.record, key))
+            else:
+                name = f'{group}_{key}_{index}'
+                columns.setdefault(name, []).append(getattr(response, name))
+    return columns
+
+class TestBulkDecode(unittest.TestCase):
+
+    def test_columns_match_status_response(self):
+        for inverter_ser, decoder in MODELS.items():
+            payloads = status_payloads(inverter_ser)
+            expected = expected_columns(decoder, payloads)
+            columns = decoders.decode_status_columns(inverter_ser, payloads)
+            self.assertEqual(columns.keys(), expected.keys())
+            for name, values in expected.items():
+                self.assertEqual(list(columns[name]), values, f'{decoder.__name__} {name}')
+
+    def test_columns_without_numpy(self):
+        payloads = status_payloads('114100000001')
+        expected = expected_columns(decoders.Hm600Decode0B, payloads)
+        with mock.patch.object(decoders, 'numpy', None):
+            self.assertEqual(decoders.decode_status_columns(decoders.Hm600Decode0B, payloads), expected)
+            with self.assertRaises(ModuleNotFoundError):
+                decoders.decode_status_array(decoders.Hm600Decode0B, payloads)
+
+    @unittest.skipIf(decoders.numpy is None, 'numpy not installed')
+    def test_array_matches_status_response(self):
+        for inverter_ser, decoder in MODELS.items():
+            payloads = status_payloads(inverter_ser)
+            expected = expected_columns(decoder, payloads)
+            array = decoders.decode_status_array(decoder, payloads)
+            self.assertEqual(len(array), len(payloads))
+            self.assertEqual(list(array.dtype.names), list(expected))
+            for name, values in expected.items():
+                self.assertEqual(array[name].tolist(), values, f'{decoder.__name__} {name}')
+
+    def test_buffer_and_file_records(self):
+        payloads = status_payloads('116100000001')
+        expected = expected_columns(decoders.Hm1200Decode0B, payloads)
+        # Fixed size records as stored on disk, CRC included
+        record_size = len(payloads[0])
+        for source in [b''.join(payloads), io.BytesIO(b''.join(payloads))]:
+            columns = decoders.decode_status_columns(decoders.Hm1200Decode0B, source, record_size)
+            self.assertEqual({name: list(values) for name, values in columns.items()}, expected)
+
+    def test_short_payloads(self):
+        payloads = status_payloads('114100000001', 2)
+        with self.assertRaises(ValueError):
+            decoders.decode_status_columns(decoders.Hm600Decode0B, [payloads[0], payloads[1][:10]])
+        with self.assertRaises(ValueError):
+            decoders.decode_status_columns(decoders.Hm600Decode0B, b''.join(payloads)[:-1],
+                    len(payloads[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Output workers: queue order, drop policies and submitted calls
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import queue
+import threading
+import unittest
+
+from hoymiles.fanout import OutputWorker, OutputFanout
+
+class RecordingPlugin:
+    """ Stand-in output plugin, blocks until released """
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def store_status(self, data, **params):
+        self.release.wait(5)
+        self.calls.append((data, params))
+
+    def send_status(self, records):
+        self.release.wait(5)
+        if records == 'bad':
+            raise ValueError('rejected')
+        self.calls.append(records)
+        return len(records)
+
+def worker_busy(worker):
+    """ Wait until the worker called the plugin and blocks in it """
+    with worker.cond:
+        return worker.cond.wait_for(lambda: worker.busy and not worker.calls, 5)
+
+class TestOutputWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.plugin = RecordingPlugin()
+
+    def tearDown(self):
+        self.plugin.release.set()
+
+    def test_calls_in_order_with_inverter_params(self):
+        worker = OutputWorker('mqtt', self.plugin)
+        self.plugin.release.set()
+        for data in range(5):
+            worker.put(('store_status', (data,), {'mqtt': {'topic': 't'}}, 0, None))
+        self.assertTrue(worker.close(5))
+        self.assertEqual(self.plugin.calls, [(data, {'topic': 't'}) for data in range(5)])
+
+    def test_drop_oldest(self):
+        worker = OutputWorker('mqtt', self.plugin, queue_size=2)
+        worker.put(('store_status', (0,), None, 0, None))
+        self.assertTrue(worker_busy(worker))
+        for data in range(1, 4):
+            self.assertTrue(worker.put(('store_status', (data,), None, 0, None)))
+        self.plugin.release.set()
+        worker.close(5)
+        self.assertEqual([data for data, params in self.plugin.calls], [0, 2, 3])
+        self.assertEqual(worker.stats()['dropped'], 1)
+
+    def test_drop_newest(self):
+        worker = OutputWorker('mqtt', self.plugin, queue_size=2, drop_policy='drop-newest')
+        worker.put(('store_status', (0,), None, 0, None))
+        self.assertTrue(worker_busy(worker))
+        self.assertEqual([worker.put(('store_status', (data,), None, 0, None)) for data in range(1, 4)],
+                [True, True, False])
+        self.plugin.release.set()
+        worker.close(5)
+        self.assertEqual([data for data, params in self.plugin.calls], [0, 1, 2])
+
+    def test_unknown_drop_policy(self):
+        with self.assertRaises(ValueError):
+            OutputWorker('mqtt', self.plugin, drop_policy='drop-all')
+
+    def test_submit_returns_result(self):
+        worker = OutputWorker('influxdb', self.plugin)
+        self.plugin.release.set()
+        self.assertEqual(worker.submit('send_status', ['a', 'b']).result(5), 2)
+        with self.assertRaises(ValueError):
+            worker.submit('send_status', 'bad').result(5)
+        self.assertEqual(worker.stats()['failed'], 1)
+        worker.close(5)
+
+    def test_submitted_call_dropped(self):
+        worker = OutputWorker('influxdb', self.plugin, queue_size=1)
+        worker.put(('store_status', (0,), None, 0, None))
+        self.assertTrue(worker_busy(worker))
+        future = worker.submit('send_status', ['a'])
+        worker.put(('store_status', (1,), None, 0, None))
+        with self.assertRaises(queue.Full):
+            future.result(5)
+        self.plugin.release.set()
+        worker.close(5)
+        self.assertEqual(self.plugin.calls, [(0, {}), (1, {})])
+
+class TestOutputFanout(unittest.TestCase):
+
+    def test_every_worker_gets_every_call(self):
+        fanout = OutputFanout()
+        plugins = [RecordingPlugin(), RecordingPlugin()]
+        for name, plugin in zip(['mqtt', 'influxdb'], plugins):
+            plugin.release.set()
+            fanout.register(name, plugin)
+        for data in range(3):
+            self.assertTrue(fanout.publish('store_status', data))
+        fanout.close(5)
+        for plugin in plugins:
+            self.assertEqual([data for data, params in plugin.calls], [0, 1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Reassembly across poll retries, frames of different responses must never
+be mixed
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import random
+import unittest
+from datetime import datetime
+
+import hoymiles
+from hoymiles.simulator import SimulatedInverter
+
+DTU_SER = 99978563412
+INVERTER_SER = 114100000001
+
+def responses(count=2, seed=1):
+    """
+    Frames of status responses with different values
+
+    :param int count: responses
+    :param int seed: random seed
+    :return: (payload, frames) per response
+    :rtype: list
+    """
+    inverter = SimulatedInverter(INVERTER_SER, [3, 23, 40, 61, 75], rng=random.Random(seed))
+    result = []
+    for _ in range(count):
+        payload = inverter.status_payload()
+        frames = [hoymiles.InverterPacketFragment(time_rx=datetime.now(), payload=frame)
+                for seq, frame in inverter.fragment(payload)]
+        result.append((payload, frames))
+    return result
+
+def transaction(fragments, **params):
+    """
+    Status transaction on a stand-in radio, nothing goes on air
+
+    :param hoymiles.FragmentBuffer fragments: reassembly buffer of earlier attempts
+    :return: transaction
+    :rtype: hoymiles.InverterTransaction
+    """
+    request = next(hoymiles.compose_esb_packet(hoymiles.compose_set_time_payload(1651509676),
+        seq=b'\x80', src=DTU_SER, dst=INVERTER_SER))
+    return hoymiles.InverterTransaction(radio=object(), inverter_ser=INVERTER_SER, dtu_ser=DTU_SER,
+            request=request, fragments=fragments, **params)
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        (self.payload_a, self.frames_a), (self.payload_b, self.frames_b) = responses()
+        self.assertGreater(len(self.frames_a), 2)
+        self.assertNotEqual(self.payload_a, self.payload_b)
+
+    def test_resume_requests_missing_frames(self):
+        fragments = hoymiles.FragmentBuffer()
+        fragments.add(self.frames_a[0])
+
+        com = transaction(fragments)
+        self.assertNotIn(com.request, com.tx_queue)
+        # End frame not seen yet, the frame after the highest one is asked for
+        self.assertEqual([packet[9] & 0x7f for packet in com.tx_queue], [2])
+
+        for frame in self.frames_a[1:]:
+            com.frame_append(frame)
+        self.assertEqual(bytes(com.get_payload()), self.payload_a)
+
+    def test_request_drops_partial_frames(self):
+        fragments = hoymiles.FragmentBuffer()
+        fragments.add(self.frames_a[0])
+
+        # Too many frames missing, whole payload is requested again
+        com = transaction(fragments, retransmit_limit=0)
+        self.assertEqual(com.tx_queue, [com.request])
+
+        self.assertEqual([fragments.add(frame) for frame in self.frames_b], [True] * len(self.frames_b))
+        self.assertTrue(com.payload_complete)
+        self.assertEqual(bytes(com.get_payload()), self.payload_b)
+
+    def test_request_after_unanswered_resume(self):
+        fragments = hoymiles.FragmentBuffer()
+        fragments.add(self.frames_a[0])
+
+        com = transaction(fragments)
+        self.assertNotIn(com.request, com.tx_queue)
+
+        # No answer to the retransmit requests
+        com = transaction(fragments)
+        self.assertEqual(com.tx_queue, [com.request])
+        for frame in self.frames_b:
+            com.frame_append(frame)
+        self.assertEqual(bytes(com.get_payload()), self.payload_b)
+
+    def test_pipeline_requeue_drops_partial_frames(self):
+        fragments = hoymiles.FragmentBuffer()
+        com = transaction(fragments, retransmit_limit=0)
+        pipeline = hoymiles.TransactionPipeline(None, [com])
+        com.tx_queue = []
+
+        # Attempt got only the first frame of the response
+        com.frame_append(self.frames_a[0])
+        pipeline.requeue()
+        self.assertEqual(com.tx_queue, [com.request])
+
+        for frame in self.frames_b:
+            com.frame_append(frame)
+        self.assertEqual(bytes(com.get_payload()), self.payload_b)
+
+if __name__ == '__main__':
+    unittest.main()
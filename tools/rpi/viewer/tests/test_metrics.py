@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Poll metrics of shared RX windows
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import unittest
+
+import hoymiles
+from hoymiles.metrics import PollMetrics, RollingHistogram
+
+DTU_SER = 99978563412
+INVERTERS = [114100000001, 114100000002, 114100000003]
+
+class CountingRadio:
+    """ Stand-in radio, only its counters are read """
+    hops = 0
+    crc_errors = 0
+
+class TestRxWindowCounters(unittest.TestCase):
+
+    def test_pipeline_splits_radio_counters(self):
+        radio = CountingRadio()
+        coms = [hoymiles.InverterTransaction(radio=radio, inverter_ser=inverter_ser, dtu_ser=DTU_SER)
+                for inverter_ser in INVERTERS]
+        metrics = PollMetrics()
+
+        radio.hops = 10
+        radio.crc_errors = 2
+        for share_id, com in enumerate(coms):
+            com.record_rx_window(metrics, 0, 0, (0, 0), len(coms), share_id)
+
+        hops = [metrics.inverter(inverter_ser)['counters']['hops'] for inverter_ser in INVERTERS]
+        crc_errors = [metrics.inverter(inverter_ser)['counters']['frame_crc_failures']
+                for inverter_ser in INVERTERS]
+        self.assertEqual(hops, [4, 3, 3])
+        self.assertEqual(crc_errors, [1, 1, 0])
+        for inverter_ser in INVERTERS:
+            self.assertIn('rx', metrics.inverter(inverter_ser)['stages'])
+
+    def test_single_transaction_gets_all(self):
+        radio = CountingRadio()
+        com = hoymiles.InverterTransaction(radio=radio, inverter_ser=INVERTERS[0], dtu_ser=DTU_SER)
+        metrics = PollMetrics()
+        radio.hops = 7
+        com.record_rx_window(metrics, 0, 0, (2, 0))
+        self.assertEqual(metrics.inverter(INVERTERS[0])['counters']['hops'], 5)
+
+class TestRollingHistogram(unittest.TestCase):
+
+    def test_window(self):
+        histogram = RollingHistogram(4)
+        for sample in range(10):
+            histogram.add(sample)
+        summary = histogram.as_dict()
+        self.assertEqual(summary['count'], 10)
+        self.assertEqual(summary['max'], 9)
+        self.assertEqual(summary['mean'], 7.5)
+
+if __name__ == '__main__':
+    unittest.main()
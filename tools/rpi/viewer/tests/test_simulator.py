@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Simulated radio, polls must complete like on real hardware
+(example-logs/example.log) unless fragments get lost
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import random
+import unittest
+
+import hoymiles
+from hoymiles.simulator import HoymilesSimulatedNRF, SimulatedInverter, SimulatedRF24
+
+DTU_SER = 99978563412
+INVERTERS = ['112100000001', '114100000001', '116100000001']
+
+def poll(radio, inverter_ser, retries=4):
+    """
+    Status poll like hoymiles.__main__.poll_inverter
+
+    :param hoymiles.HoymilesNRF radio: radio to use
+    :param str inverter_ser: inverter serial
+    :param int retries: requests at most
+    :return: payload or None
+    :rtype: bytes
+    """
+    fragments = hoymiles.FragmentBuffer()
+    for _ in range(retries):
+        com = hoymiles.InverterTransaction(radio=radio, inverter_ser=inverter_ser, dtu_ser=DTU_SER,
+                fragments=fragments,
+                request=next(hoymiles.compose_esb_packet(hoymiles.compose_set_time_payload(),
+                    seq=b'\x80', src=DTU_SER, dst=inverter_ser)))
+        while com.rxtx():
+            try:
+                return bytes(com.get_payload())
+            except BufferError:
+                pass
+    return None
+
+class TestSimulatedPoll(unittest.TestCase):
+
+    def check_polls(self, **radio_config):
+        radio = HoymilesSimulatedNRF(inverters=INVERTERS, seed=1, loss=0, duplicate=0, **radio_config)
+        for inverter_ser in INVERTERS:
+            payload = poll(radio, inverter_ser)
+            inverter = radio.radio.inverters[hoymiles.ser_to_hm_addr(inverter_ser)]
+            self.assertEqual(payload, inverter.last_payload, f'{inverter.model} poll incomplete')
+
+    def test_poll_without_loss_completes(self):
+        self.check_polls()
+
+    def test_poll_without_loss_completes_irq(self):
+        self.check_polls(irq_pin=24)
+
+class TestSimulatedAir(unittest.TestCase):
+
+    def test_fragments_mostly_stay_on_channel(self):
+        inverter = SimulatedInverter(INVERTERS[1], [3, 23, 40, 61, 75], rng=random.Random(1))
+        stays = 0
+        channel = inverter.pick_channel()
+        for _ in range(1000):
+            next_channel = inverter.pick_channel(channel)
+            self.assertIn(next_channel, inverter.channels)
+            stays = stays + (next_channel == channel)
+            channel = next_channel
+        self.assertGreater(stays, 700)
+        self.assertLess(stays, 900)
+
+    def test_fragment_heard_while_on_air(self):
+        device = SimulatedRF24()
+        device.listen_log = [[40, 1.0, 1.005], [61, 1.005, None]]
+        self.assertTrue(device.heard(40, 0.99, 1.02))
+        self.assertTrue(device.heard(61, 1.01, 1.04))
+        self.assertFalse(device.heard(40, 1.01, 1.04))
+        self.assertFalse(device.heard(75, 0.99, 1.04))
+
+if __name__ == '__main__':
+    unittest.main()
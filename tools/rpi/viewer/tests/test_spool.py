@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Output spool: records are replayed in order across segments and restarts
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import os
+import tempfile
+import time
+import unittest
+
+from hoymiles.spool import Spool, SpoolDrainer
+
+class RecordingSink:
+    """ Stand-in sink, fails the sends given by the test """
+
+    def __init__(self, failures=None):
+        self.batches = []
+        self.failures = list(failures or [])
+
+    def send(self, records):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append(records)
+
+    @property
+    def records(self):
+        return [record for batch in self.batches for record in batch]
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def spool(self, **params):
+        spool = Spool(self.directory, **params)
+        self.addCleanup(spool.close)
+        return spool
+
+    def test_replay_order_across_segments(self):
+        spool = self.spool(segment_size=64)
+        for start in range(0, 30, 3):
+            spool.append([{'n': n} for n in range(start, start + 3)])
+        self.assertGreater(spool.stats()['segments'], 2)
+
+        sink = RecordingSink()
+        drainer = SpoolDrainer(spool, 'influxdb', sink.send, batch_size=4)
+        self.assertTrue(drainer.close(5))
+        self.assertEqual(sink.records, [{'n': n} for n in range(30)])
+        self.assertTrue(all(len(batch) <= 4 for batch in sink.batches))
+        self.assertEqual(drainer.stats()['lag'], 0)
+        # Only the active segment is left
+        self.assertEqual(spool.stats()['segments'], 1)
+
+    def test_resume_at_committed_offset(self):
+        spool = Spool(self.directory, segment_size=64)
+        spool.append([{'n': n} for n in range(10)])
+        sink = RecordingSink()
+        SpoolDrainer(spool, 'influxdb', sink.send).close(5)
+        spool.append([{'n': n} for n in range(10, 15)])
+        spool.close()
+
+        # Records appended after the last send are replayed after a restart
+        spool = self.spool(segment_size=64)
+        self.assertEqual(spool.register('influxdb'), 10)
+        spool.append([{'n': 15}])
+        SpoolDrainer(spool, 'influxdb', sink.send).close(5)
+        self.assertEqual(sink.records, [{'n': n} for n in range(16)])
+
+    def test_torn_record_cut_off(self):
+        spool = Spool(self.directory)
+        spool.append([{'n': 0}, {'n': 1}])
+        spool.close()
+        with open(spool.path(0), 'ab') as fh_segment:
+            fh_segment.write(b'{"n":')
+
+        spool = self.spool()
+        self.assertEqual(spool.next_offset, 2)
+        spool.append([{'n': 2}])
+        sink = RecordingSink()
+        SpoolDrainer(spool, 'mqtt', sink.send).close(5)
+        self.assertEqual(sink.records, [{'n': n} for n in range(3)])
+
+    def test_sinks_keep_own_offsets(self):
+        spool = self.spool(segment_size=64)
+        spool.register('influxdb')
+        spool.append([{'n': n} for n in range(10)])
+        fast = RecordingSink()
+        SpoolDrainer(spool, 'mqtt', fast.send).close(5)
+
+        # Segments are kept for the sink that did not send them yet
+        self.assertEqual(spool.stats()['lag'], {'mqtt': 0, 'influxdb': 10})
+        self.assertGreater(spool.stats()['segments'], 1)
+        slow = RecordingSink()
+        SpoolDrainer(spool, 'influxdb', slow.send).close(5)
+        self.assertEqual(slow.records, fast.records)
+
+    def test_failed_send_retried_in_order(self):
+        spool = self.spool()
+        spool.append([{'n': n} for n in range(5)])
+        sink = RecordingSink(failures=[ConnectionError('down'), ConnectionError('down')])
+        drainer = SpoolDrainer(spool, 'influxdb', sink.send, batch_size=2, backoff=0.01)
+        # Closing stops retries, wait for the sink to get everything first
+        for _ in range(500):
+            if not drainer.stats()['lag']:
+                break
+            time.sleep(0.01)
+        drainer.close(5)
+        self.assertEqual(sink.records, [{'n': n} for n in range(5)])
+        self.assertEqual(drainer.stats()['retried'], 2)
+
+    def test_not_writable_batch_skipped(self):
+        spool = self.spool()
+        spool.append([{'n': n} for n in range(6)])
+        sink = RecordingSink(failures=[ValueError('bad record')])
+        drainer = SpoolDrainer(spool, 'influxdb', sink.send, batch_size=2)
+        drainer.close(5)
+        self.assertEqual(sink.records, [{'n': n} for n in range(2, 6)])
+        self.assertEqual(drainer.stats()['failed'], 2)
+        self.assertTrue(os.path.exists(spool.offset_path('influxdb')))
+
+    def test_size_limit_drops_oldest(self):
+        spool = self.spool(segment_size=64, max_bytes=128)
+        spool.register('influxdb')
+        for n in range(30):
+            spool.append([{'n': n}])
+        stats = spool.stats()
+        self.assertGreater(stats['dropped'], 0)
+        sink = RecordingSink()
+        SpoolDrainer(spool, 'influxdb', sink.send).close(5)
+        self.assertEqual(sink.records, [{'n': n} for n in range(30 - stats['records'], 30)])
+
+if __name__ == '__main__':
+    unittest.main()
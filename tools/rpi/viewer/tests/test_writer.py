@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Batch writer: batching, backpressure and failed writes
+
+    $ cd tools/rpi/viewer && python3 -m unittest discover tests
+"""
+
+import threading
+import unittest
+
+from hoymiles.writer import BatchWriter
+
+class RecordingSend:
+    """ Stand-in server, fails the writes given by the test and blocks until released """
+
+    def __init__(self, failures=None):
+        self.batches = []
+        self.failures = list(failures or [])
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, records):
+        self.release.wait(5)
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append(records)
+
+    @property
+    def records(self):
+        return [record for batch in self.batches for record in batch]
+
+def writer_busy(writer):
+    """ Wait until the worker took a batch and writes it """
+    with writer.cond:
+        return writer.cond.wait_for(lambda: writer.in_flight, 5)
+
+class TestBatchWriter(unittest.TestCase):
+
+    def test_batches_in_order(self):
+        send = RecordingSend()
+        writer = BatchWriter(send, batch_size=4, flush_interval=60)
+        for record in range(10):
+            writer.put([record])
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(send.records, list(range(10)))
+        self.assertEqual([len(batch) for batch in send.batches], [4, 4, 2])
+        writer.close(5)
+        self.assertEqual(writer.stats()['written'], 10)
+
+    def test_close_writes_rest(self):
+        send = RecordingSend()
+        writer = BatchWriter(send, flush_interval=60)
+        writer.put(['a', 'b'])
+        self.assertTrue(writer.close(5))
+        self.assertEqual(send.batches, [['a', 'b']])
+        with self.assertRaises(RuntimeError):
+            writer.put(['c'])
+
+    def test_drop_oldest(self):
+        send = RecordingSend()
+        send.release.clear()
+        writer = BatchWriter(send, batch_size=1, max_records=3)
+        writer.put([0])
+        self.assertTrue(writer_busy(writer))
+        self.assertEqual(writer.put([1, 2, 3, 4, 5]), 2)
+        send.release.set()
+        writer.close(5)
+        self.assertEqual(send.records, [0, 3, 4, 5])
+        self.assertEqual(writer.stats()['dropped'], 2)
+
+    def test_unknown_backpressure_policy(self):
+        with self.assertRaises(ValueError):
+            BatchWriter(RecordingSend(), backpressure='drop-all')
+
+    def test_not_writable_batch_dropped(self):
+        send = RecordingSend(failures=[ValueError('bad record')])
+        writer = BatchWriter(send, batch_size=2, flush_interval=60)
+        writer.put([0, 1, 2, 3])
+        writer.close(5)
+        self.assertEqual(send.records, [2, 3])
+        self.assertEqual(writer.stats()['failed'], 2)
+        self.assertEqual(writer.stats()['retried'], 0)
+
+    def test_failed_write_retried(self):
+        send = RecordingSend(failures=[ConnectionError('down')] * 2)
+        writer = BatchWriter(send, batch_size=2, flush_interval=60, backoff=0.01)
+        writer.put([0, 1, 2])
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(send.records, [0, 1, 2])
+        self.assertEqual(writer.stats()['retried'], 2)
+        writer.close(5)
+
+    def test_batch_kept_after_last_retry(self):
+        send = RecordingSend(failures=[ConnectionError('down')] * 2)
+        writer = BatchWriter(send, batch_size=2, flush_interval=60, retries=1, backoff=0.01)
+        writer.put([0, 1])
+        # Given up after retries, the batch goes back into the buffer
+        self.assertTrue(writer.flush(5))
+        self.assertEqual(send.records, [0, 1])
+        self.assertEqual(writer.stats()['failed'], 0)
+        writer.close(5)
+
+if __name__ == '__main__':
+    unittest.main()